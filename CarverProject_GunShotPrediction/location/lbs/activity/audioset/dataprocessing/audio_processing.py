@@ -12,6 +12,21 @@ python audio_processing.py
     --src_dir PATH_TO_INPUT_FILES --dest_dir PATH_TO_OUTPUT_FILES
     --filename CSV FILE --labels LABELS
     --redo BOOLEAN TO REDOWNLOAD THE YOUTUBE FILES
+    --download_workers NUMBER OF DOWNLOADS TO RUN AT THE SAME TIME
+    --extract_workers NUMBER OF PROCESSES EXTRACTING FEATURES
+    --cache_dir PATH TO A CACHE OF EXTRACTED FEATURES
+    --output_format dataframe, shards, feature_store OR tfrecord
+    --manifest BOOLEAN TO RECORD PROGRESS AND RESUME INTERRUPTED RUNS
+    --ranged_download BOOLEAN TO FETCH ONLY THE LABELLED WINDOW OF EACH VIDEO
+    --pipeline BOOLEAN TO EXTRACT FEATURES WHILE VIDEOS ARE DOWNLOADING
+    --num_shards NUMBER OF SHARDS TO SPLIT THE CSV FILE INTO
+    --shard_index INDEX OF THE SHARD TO INGEST
+    --profile_dir PATH TO WRITE A REPORT OF THE TIME SPENT IN EACH STAGE TO
+    --sample_rate SAMPLING RATE OF THE CLIPS FEATURES ARE EXTRACTED FROM
+    --res_type RESAMPLER, E.G. polyphase FOR THE FASTEST
+    --pcm_dir PATH TO A STORE OF DECODED CLIPS REUSED ACROSS RUNS
+    --feature_modules MODULES REGISTERING CUSTOM FEATURES
+    --pool_statistics STATISTICS TO POOL EACH FEATURE INTO, E.G. mean std p90
 
 Example:
 python audio_processing.py
@@ -26,19 +41,39 @@ bazel-bin/location/lbs/activity/audioset/dataprocessing/audio_processing
     --dest_dir location/lbs/activity/audioset/dataprocessing/example_dest_dir
     --audioset_csv balanced_train_segments --labels "Gunshot, gunfire" --False
 
+Multi-node ingestion:
+Each machine runs the script with the same --num_shards and its own
+--shard_index, and ingests only the videos whose stable hash falls in its
+shard. Their outputs are then concatenated with merge_outputs.py.
+
     Performance: to confirm the presence of, extract features from, and output
     to a csv file, takes about 3 hours for around 20,000 samples.
+    benchmark.py measures the throughput of each step offline, on
+    synthetic data.
 """
 from __future__ import unicode_literals
+import collections
+from concurrent import futures
+import itertools
 from os.path import isfile, join
-import datetime
-import librosa
 from absl import app
 from absl import flags
 from absl import logging
 import pandas as pd
 import audioset_helper
 import downloader
+import failure_store
+import feature_cache
+import feature_extraction
+import feature_store
+import ingest_manifest
+import ontology_index
+import pcm_store
+import pipeline
+import pooling
+import profiling
+import sharded_output
+import tfrecord_output
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string('filename', 'balanced_train_segments',
@@ -62,6 +97,108 @@ flags.DEFINE_string('dest_dir',
                     'The location of the downloaded YouTube videos and the '
                     'outputted csv file containing the extracted features '
                     'and labels')
+flags.DEFINE_integer('download_workers', 1,
+                     'The number of YouTube videos to download at the same '
+                     'time', lower_bound=1)
+flags.DEFINE_integer('extract_workers', 1,
+                     'The number of processes extracting features from the '
+                     'downloaded audio', lower_bound=1)
+flags.DEFINE_integer('extract_chunksize', 16,
+                     'The number of audio clips handed to an extraction '
+                     'process at a time', lower_bound=1)
+flags.DEFINE_string('cache_dir', None,
+                    'The location of an on-disk cache of extracted features, '
+                    'keyed by the content of each audio clip. No cache is '
+                    'used if unset')
+flags.DEFINE_integer('cache_max_mb', 10240,
+                     'The size cap of the feature cache in megabytes, past '
+                     'which the least recently used features are evicted',
+                     lower_bound=1)
+flags.DEFINE_enum('output_format', 'dataframe',
+                  ['dataframe', 'shards', 'feature_store', 'tfrecord'],
+                  'Whether to print a single dataframe of every example, or '
+                  'to stream the examples to --output_dir as they are '
+                  'extracted, either as fixed-size shards, as a '
+                  'memory-mapped columnar feature store, or as compressed '
+                  'TFRecord shards of SequenceExamples for tf.data')
+flags.DEFINE_string('output_dir', None,
+                    'The location of the examples written with '
+                    '--output_format=shards, feature_store or tfrecord. '
+                    'Defaults to the examples directory in --dest_dir')
+flags.DEFINE_integer('shard_size', sharded_output.DEFAULT_SHARD_SIZE,
+                     'The number of examples in each shard', lower_bound=1)
+flags.DEFINE_integer('tfrecord_shard_mb',
+                     tfrecord_output.DEFAULT_MAX_SHARD_BYTES // 2 ** 20,
+                     'The size in megabytes of the records of a TFRecord '
+                     'shard, before compression, past which a new shard is '
+                     'started', lower_bound=1)
+flags.DEFINE_enum('tfrecord_compression', 'GZIP',
+                  list(tfrecord_output.COMPRESSION_TYPES),
+                  'The compression of the TFRecord shards')
+flags.DEFINE_integer('tfrecord_writers', tfrecord_output.DEFAULT_NUM_WRITERS,
+                     'The number of TFRecord shards compressed and written '
+                     'at the same time', lower_bound=1)
+flags.DEFINE_bool('manifest', False,
+                  'Whether to record the state of every segment in a SQLite '
+                  'manifest in --dest_dir, along with its features, so that '
+                  'an interrupted run resumes where it stopped')
+flags.DEFINE_bool('ranged_download', False,
+                  'Whether to fetch only the labelled window of each segment '
+                  'in the smallest audio-only format, instead of the whole '
+                  'video')
+flags.DEFINE_bool('pipeline', False,
+                  'Whether to extract features from the clips of downloaded '
+                  'videos while other videos are still downloading, rather '
+                  'than after every download is done. Examples are then '
+                  'output in the order they are extracted')
+flags.DEFINE_integer('num_shards', 1,
+                     'The number of shards to split the videos of the csv '
+                     'file into, by a stable hash of their video_id, so that '
+                     'each of several machines ingests one shard',
+                     lower_bound=1)
+flags.DEFINE_integer('shard_index', 0,
+                     'The shard of the csv file to ingest, from 0 to '
+                     '--num_shards - 1. --output_dir defaults to a directory '
+                     'of the shard in the examples directory in --dest_dir',
+                     lower_bound=0)
+flags.DEFINE_string('profile_dir', None,
+                    'The location to write a report of the latency of every '
+                    'stage of the run and of its throughput to, as '
+                    'profile.json and, in the Prometheus text format, as '
+                    'profile.prom. The report is only logged if unset')
+flags.DEFINE_bool('profile_clips', False,
+                  'Whether to list the latencies of every clip in '
+                  'profile.json, rather than only their percentiles')
+flags.DEFINE_integer('sample_rate', feature_extraction.SAMPLING_RATE,
+                     'The sampling rate clips are chopped and decoded at',
+                     lower_bound=1)
+flags.DEFINE_enum('res_type', feature_extraction.RES_TYPE,
+                  feature_extraction.RES_TYPES,
+                  'The resampler clips are chopped and decoded with. '
+                  'polyphase is several times faster than the default')
+flags.DEFINE_string('pcm_dir', None,
+                    'The location of a store of decoded and resampled clips, '
+                    'read by later runs instead of decoding the clips again. '
+                    'Clips are decoded on every run if unset')
+flags.DEFINE_enum('pcm_dtype', 'int16', pcm_store.DTYPES,
+                  'The dtype clips are kept as in --pcm_dir')
+flags.DEFINE_multi_string('feature_modules', [],
+                          'Modules to import before extracting, which '
+                          'register custom features that --features can '
+                          'name, see feature_extraction.register_feature')
+flags.DEFINE_multi_string('pool_statistics', [],
+                          'Statistics of each coefficient over the frames '
+                          'of a clip to reduce every feature to, out of '
+                          'mean, std, min, max, delta_mean, delta_std and '
+                          'pNN percentiles such as p90. Features are kept '
+                          'whole if unset')
+flags.register_multi_flags_validator(
+    ['num_shards', 'shard_index'],
+    lambda values: values['shard_index'] < values['num_shards'],
+    message='--shard_index must be less than --num_shards')
+flags.register_validator(
+    'pool_statistics', pooling.is_supported,
+    message='--pool_statistics must be statistics supported by pooling')
 
 def main(argv):
     """Configures the output location using command line arguments.
@@ -69,85 +206,244 @@ def main(argv):
     Uses command line arguments to configure this script to output a Dataframe
     based on specific source directory and a specified output directory. It also
     tells the script to redownload the YouTube videos based on the user input.
-    The script finally prints out the Dataframe object.
+    The script finally prints out the Dataframe object, or depending on
+    --output_format, streams the examples to shards, a feature store or
+    TFRecord shards on disk instead.
 
     Args:
         argv: A list containing the path this script after the build process.
     """
-    dataframe = output_df(
-        FLAGS.src_dir, FLAGS.dest_dir, FLAGS.filename, FLAGS.labels,
-        FLAGS.features, FLAGS.redo)
-    print(dataframe)
+    feature_extraction.import_feature_modules(FLAGS.feature_modules)
+    cache = None
+    if FLAGS.cache_dir:
+        cache = feature_cache.FeatureCache(FLAGS.cache_dir,
+                                           FLAGS.cache_max_mb * 2 ** 20)
+    profiler = profiling.Profiler(per_clip=FLAGS.profile_clips)
+    store = None
+    if FLAGS.pcm_dir:
+        store = pcm_store.PcmStore(FLAGS.pcm_dir, FLAGS.pcm_dtype)
+    loader = feature_extraction.ClipLoader(FLAGS.sample_rate, FLAGS.res_type,
+                                           store)
+    manifest = None
+    if FLAGS.manifest:
+        audioset_helper.check_dir(FLAGS.dest_dir)
+        manifest = ingest_manifest.IngestManifest(
+            join(FLAGS.dest_dir, ingest_manifest.MANIFEST_FILENAME))
+    args = (FLAGS.src_dir, FLAGS.dest_dir, FLAGS.filename, FLAGS.labels,
+            FLAGS.features, FLAGS.redo, FLAGS.download_workers,
+            FLAGS.extract_workers, FLAGS.extract_chunksize, cache, manifest,
+            FLAGS.ranged_download, FLAGS.pipeline, FLAGS.num_shards,
+            FLAGS.shard_index, profiler, loader, FLAGS.pool_statistics)
+    output_dir = FLAGS.output_dir or join(FLAGS.dest_dir, 'examples')
+    if FLAGS.num_shards > 1 and not FLAGS.output_dir:
+        output_dir = join(output_dir, audioset_helper.shard_name(
+            FLAGS.shard_index, FLAGS.num_shards))
+    try:
+        if FLAGS.output_format == 'shards':
+            output_shards(output_dir, *args, shard_size=FLAGS.shard_size)
+        elif FLAGS.output_format == 'feature_store':
+            output_feature_store(output_dir, *args)
+        elif FLAGS.output_format == 'tfrecord':
+            output_tfrecords(
+                output_dir, *args,
+                max_shard_bytes=FLAGS.tfrecord_shard_mb * 2 ** 20,
+                compression=FLAGS.tfrecord_compression,
+                num_writers=FLAGS.tfrecord_writers)
+        else:
+            dataframe = output_df(*args)
+            print(dataframe)
+    finally:
+        if manifest is not None:
+            manifest.close()
+        profiler.log_report()
+        if FLAGS.profile_dir:
+            profiler.write_reports(FLAGS.profile_dir)
 
 
-def extract_feature(dest_dir, video_id, feature):
-    """Extracts a feature from a specific audio file given a video_id.
+def extract_feature(dest_dir, clip_id, feature, cache=None, loader=None):
+    """Extracts a feature from a specific audio file given a clip_id.
 
-   Given a specific of video_id, it extracts features using the Librosa library
+   Given a specific of clip_id, it extracts features using the Librosa library
    from the corresponding audio file and stores the features in a dictionary
-   with a video_id, dictionary key-value pair, with the dictionary value being
+   with a clip_id, dictionary key-value pair, with the dictionary value being
    comprised of feature name, feature list key-value pairs. Using Librosa it
    extracts one of the following features: chroma_stft, chroma_cqt, chroma_cens,
    melspectogram, mfcc, rms, spectral_centroid, spectral_bandwidth,
    spectral_contrast, spectral_flatness, spectral_rolloff, poly_features,
-   tonnetz, zero_crossing_rate
+   tonnetz, zero_crossing_rate, or a custom feature registered with
+   feature_extraction.register_feature.
 
    Args:
        dest_dir: Path to the parent directory where the downloaded videos are
            stored.
-       video_id: The video_id of specific audio file from which features are to
-           be extracted.
-       feature: A dictionary with video_id, dictionary pairs with the
+       clip_id: The clip_id of specific audio file from which features are to
+           be extracted, see audioset_helper.clip_id.
+       feature: A dictionary with clip_id, dictionary pairs with the
            dictionary values being feature name, feature list key-value pairs.
+       cache: A FeatureCache consulted before extracting the feature, or None.
+       loader: The feature_extraction.ClipLoader decoding the audio file, or
+           None for the default sampling rate and resampler.
 
    Returns:
-       A boolean of whether the extracting features was successful
+       A numpy array holding the feature, or None if the audio file is missing
+       or could not be decoded.
 
    Raises: ValueError: A feature not supported by Librosa has been inputted.
    """
-    path = join(dest_dir, 'yt_videos', 'sliced_' + video_id + '.wav')
+    extracted_features = extract_features(dest_dir, clip_id, [feature],
+                                          cache, loader=loader)
+    if extracted_features is None:
+        return None
+    return extracted_features[feature]
+
+
+def extract_features(dest_dir, clip_id, features, cache=None,
+                     features_path=None, loader=None, timings=None):
+    """Extracts several features from a specific audio file given a clip_id.
+
+    The audio file is decoded once, and every feature is derived from the
+    intermediates, such as the spectrogram, that the features share. If a cache
+    is given, features already cached for the content of the audio file are
+    read from it, and only the missing features are extracted and cached.
+    If a features_path is given, features saved there by an earlier run are
+    loaded without reading the audio file, and the features are saved there.
+
+    Args:
+        dest_dir: Path to the parent directory where the downloaded videos are
+            stored.
+        clip_id: The clip_id of specific audio file from which features are to
+            be extracted, see audioset_helper.clip_id.
+        features: A list of feature names to extract.
+        cache: A FeatureCache, or None.
+        features_path: Path to a .npz file of saved features, see
+            ingest_manifest.features_path, or None.
+        loader: The feature_extraction.ClipLoader decoding the audio file, or
+            None for the default sampling rate and resampler. Cached features
+            are only used if they were extracted at the same sampling rate.
+        timings: A dictionary to add the seconds spent in each stage to, see
+            profiling, or None.
+
+    Returns:
+        A dictionary with feature name, numpy array key-value pairs, or None if
+        the audio file is missing or could not be decoded.
+
+    Raises: ValueError: A feature not supported by Librosa has been inputted.
+    """
+    feature_extraction.check_features(features)
+    extracted_features = {}
+    if features_path is not None:
+        with profiling.stage_timer(timings, 'load_saved'):
+            extracted_features = ingest_manifest.load_features(features_path,
+                                                               features)
+        if len(extracted_features) == len(features):
+            return extracted_features
+    path = downloader.clip_path(dest_dir, clip_id)
     if not isfile(path):
         return None
+    if cache is not None:
+        with profiling.stage_timer(timings, 'cache'):
+            content_hash = feature_cache.hash_file(path)
+            params = {feature: feature_extraction.extraction_params(loader,
+                                                                    feature)
+                      for feature in features}
+            for feature in features:
+                if feature in extracted_features:
+                    continue
+                cached_feature = cache.get(content_hash, feature,
+                                           params[feature])
+                if cached_feature is not None:
+                    extracted_features[feature] = cached_feature
+    missing_features = [feature for feature in features
+                        if feature not in extracted_features]
+    if missing_features:
+        try:
+            new_features = feature_extraction.extract_features(
+                path, missing_features, timings, loader)
+        except ValueError as error:
+            logging.error(error)
+            return None
+        if cache is not None:
+            for feature, extracted_feature in new_features.items():
+                cache.put(content_hash, feature, params[feature],
+                          extracted_feature)
+        extracted_features.update(new_features)
+        logging.info('extracted features')
+    if features_path is not None:
+        ingest_manifest.save_features(features_path, extracted_features)
+    return extracted_features
+
+
+def extract_example(dest_dir, clip_id, features_to_extract, cache=None,
+                    features_path=None, loader=None, statistics=None,
+                    timings=None):
+    """Extracts a list of features from the audio file of a clip_id.
+
+    Features that could not be extracted are left out of the returned list.
+    With statistics, each feature is pooled into a fixed-length vector once
+    it is extracted, see pooling.pool, while the cache and the saved features
+    keep the whole features.
+
+    Args:
+        dest_dir: Path to the parent directory where the downloaded videos are
+            stored.
+        clip_id: The clip_id of specific audio file from which features are to
+            be extracted, see audioset_helper.clip_id.
+        features_to_extract: A list of features to extract.
+        cache: A FeatureCache, or None.
+        features_path: Path to a .npz file of saved features, or None, see
+            extract_features.
+        loader: The feature_extraction.ClipLoader decoding the audio file, or
+            None.
+        statistics: A list of the statistics to pool each feature into, or
+            None to keep the whole features.
+        timings: A dictionary to add the seconds spent in each stage to, see
+            profiling, or None.
+
+    Returns:
+        A list of the extracted features, in the order of features_to_extract.
+    """
+    extracted_features = extract_features(dest_dir, clip_id,
+                                          features_to_extract, cache,
+                                          features_path, loader, timings)
+    if extracted_features is None:
+        return []
+    if statistics:
+        with profiling.stage_timer(timings, 'pool'):
+            extracted_features = pooling.pool_features(extracted_features,
+                                                       statistics)
+    return [extracted_features[feature] for feature in features_to_extract]
+
+
+def _extract_example_or_none(args):
+    """Calls extract_example, logging and returning None on any error.
+
+    Module-level so that it can be sent to the processes of a process pool.
+
+    Args:
+        args: A tuple of the arguments of extract_example.
+
+    Returns:
+        A tuple of the list returned by extract_example, or None if
+        extraction failed, and a dictionary with the seconds spent in each
+        stage, see profiling.
+    """
+    clip_id = args[1]
+    timings = {}
     try:
-        # get audio and sampling rate
-        audio, sampling_rate = librosa.load(
-            dest_dir + '/yt_videos/sliced_' + video_id + '.wav')
-    except ValueError as error:
-        logging.error(error)
-        return None
-    feature_name_dict = {
-        'chroma_stft': librosa.feature.chroma_stft,
-        'chroma_cqt': librosa.feature.chroma_cqt,
-        'chroma_cens': librosa.feature.chroma_cens,
-        'melspectrogram': librosa.feature.melspectrogram,
-        'mfcc': librosa.feature.mfcc,
-        'rms': librosa.feature.rms,
-        'spectral_centroid': librosa.feature.spectral_centroid,
-        'spectral_bandwidth': librosa.feature.spectral_bandwidth,
-        'spectral_contrast': librosa.feature.spectral_contrast,
-        'spectral_flatness': librosa.feature.spectral_flatness,
-        'spectral_rolloff': librosa.feature.spectral_rolloff,
-        'poly_features': librosa.feature.poly_features,
-        'tonnetz': librosa.feature.tonnetz,
-        'zero_crossing_rate': librosa.feature.zero_crossing_rate
-    }
-    sample_rate_void_feature_names = {'rms', 'spectral_flatness'}
-    feature_extraction_func = feature_name_dict.get(feature)
-    if feature_extraction_func is None:
-        raise ValueError
-    if feature in sample_rate_void_feature_names:
-        extracted_feature = feature_extraction_func(audio)
-    else:
-        extracted_feature = feature_extraction_func(audio, sampling_rate)
-    logging.info('extracted features')
-    return extracted_feature
+        with profiling.stage_timer(timings, 'extract'):
+            return extract_example(*args, timings=timings), timings
+    except Exception as error:  # pylint: disable=broad-except
+        logging.error('Failed to extract features from {}: {!r}'.format(
+            clip_id, error))
+        return None, timings
 
 
 def is_positive_example(labels_list, labels_set):
     """Returns a 1 if any label in the labels_list is in labels_set else a 0.
 
     Iterates through the labels_list and returns a 1 if any label is in the
-    labels_set, and returns a 0 otherwise.
+    labels_set, and returns a 0 otherwise. To label many segments at once, use
+    audioset_helper.SegmentTable.select_positive instead.
 
     Args:
         labels_list: a list of labels in the format found in the audioset csv
@@ -161,7 +457,7 @@ def is_positive_example(labels_list, labels_set):
     for label in labels_list:
         if label in labels_set:
             return True
-        return False
+    return False
 
 
 def print_flags():
@@ -177,19 +473,56 @@ def print_flags():
     print(FLAGS.src_dir)
     print(FLAGS.dest_dir)
     print(FLAGS.features)
+    print(FLAGS.download_workers)
+    print(FLAGS.extract_workers)
+    print(FLAGS.cache_dir)
+    print(FLAGS.output_format)
+    print(FLAGS.manifest)
+    print(FLAGS.ranged_download)
+    print(FLAGS.pipeline)
+    print(FLAGS.profile_dir)
+    print(FLAGS.num_shards)
+    print(FLAGS.shard_index)
+    print(FLAGS.sample_rate)
+    print(FLAGS.res_type)
+    print(FLAGS.pcm_dir)
+    print(FLAGS.feature_modules)
+    print(FLAGS.pool_statistics)
 
 
-def output_df(src_dir, dest_dir, filename, labels, features_to_extract,
-              redo=False):
-    """Creates dataframe object from inputted csv files, features, and labels.
+def generate_examples(src_dir, dest_dir, filename, labels,
+                      features_to_extract, redo=False, download_workers=1,
+                      extract_workers=1, extract_chunksize=16, cache=None,
+                      manifest=None, ranged_download=False, pipelined=False,
+                      num_shards=1, shard_index=0, profiler=None,
+                      loader=None, statistics=None):
+    """Yields a labelled example for every clip of an audioset csv file.
 
         Parses through a csv file and extracts all the metadata from it. Then
-        iterates through the list of metadata confirming that each video
-        associated with every video_id is downloaded and attempt to download if
+        iterates through the list of metadata confirming that the clip of each
+        labelled segment is downloaded and attempt to download if
         the video is missing. The specified features are then extracted from the
-        downloaded videos, and the features are then put into a dataframe with
-        a label of 1 or 0 depending on if the video's label is in the list of
-        labels passed in.
+        downloaded videos, and each example is labelled 1 or 0 depending on if
+        the video's label is in the list of labels passed in.
+
+        Examples are yielded as soon as they are extracted, and at most a
+        bounded number of clips are being extracted at any time, so memory
+        does not grow with the number of examples.
+
+        Unless pipelined is True, every video is downloaded before the first
+        feature is extracted. With pipelined, clips are extracted by
+        extract_workers processes as soon as their video is downloaded, see
+        pipeline.run_stages, and examples are yielded in the order they are
+        extracted rather than in the order of the csv file.
+
+        With a manifest, a restarted run resumes where the last one stopped:
+        the clips of segments recorded as chopped are not checked again,
+        failed segments are skipped, and the features of extracted segments
+        are loaded from the files they were saved to rather than extracted.
+
+        With num_shards, only the segments of the videos in shard shard_index
+        are ingested, see audioset_helper.shard_of, so that running every
+        shard index ingests every segment exactly once.
 
         Args:
             src_dir: Path to where all the input files are expected to be.
@@ -198,6 +531,265 @@ def output_df(src_dir, dest_dir, filename, labels, features_to_extract,
             labels: A list of labels to treat as positive examples.
             features_to_extract: A list of features to extract.
             redo: A boolean on whether to re-download all the videos.
+            download_workers: The number of videos to download at the same
+                time.
+            extract_workers: The number of processes extracting features. With
+                more than one, clips are spread across a process pool in
+                chunks of extract_chunksize clips. Unless pipelined,
+                examples keep the order of the csv file either way, and a clip
+                whose extraction fails is skipped.
+            extract_chunksize: The number of clips handed to a process at a
+                time.
+            cache: A FeatureCache of previously extracted features, or None.
+            manifest: An ingest_manifest.IngestManifest recording the state
+                of every segment, or None. With redo, every segment of the
+                csv file is reset to pending.
+            ranged_download: Whether to download only the labelled window of
+                each segment rather than whole videos.
+            pipelined: Whether to extract features while videos are still
+                downloading.
+            num_shards: The number of shards the videos are split into.
+            shard_index: The index of the shard to ingest, from 0 to
+                num_shards - 1.
+            profiler: A profiling.Profiler recording the latency of every
+                stage, including those run in the extraction processes, and
+                counting the examples. Defaults to a new profiler, whose
+                report is logged once every example is generated.
+            loader: The feature_extraction.ClipLoader setting the sampling
+                rate and resampler clips are chopped and decoded with, and
+                the pcm_store.PcmStore they are kept in. Defaults to a
+                ClipLoader with the default sampling rate and resampler.
+            statistics: A list of the statistics, see pooling, to pool each
+                feature into a fixed-length vector, or None to keep the
+                whole [coefficients, frames] features.
+
+        Yields:
+            A tuple of the clip_id of a segment and its example, a list
+            holding the label followed by the extracted features.
+        """
+    feature_extraction.check_features(features_to_extract)
+    if statistics:
+        statistics = pooling.check_statistics(statistics)
+    if loader is None:
+        loader = feature_extraction.ClipLoader()
+    log_report = profiler is None
+    if profiler is None:
+        profiler = profiling.Profiler()
+    with profiler.timer('parse'):
+        ontology = ontology_index.load_ontology_index(src_dir)
+        table = audioset_helper.parse_segments(
+            join(src_dir, filename + '.csv'), ontology.label_ids)
+        is_positive = table.select_positive(ontology.expand_indices(labels))
+        in_shard = table.select_shard(num_shards, shard_index)
+    audio_dict = {}
+    positive_keys = set()
+    for entry, positive, selected in zip(table.entries(), is_positive.tolist(),
+                                         in_shard.tolist()):
+        if not selected:
+            continue
+        audio_dict[entry.key] = entry
+        if positive:
+            positive_keys.add(entry.key)
+    if num_shards > 1:
+        logging.info('Shard {} of {} holds {} of the {} segments'.format(
+            shard_index, num_shards, len(audio_dict), len(table)))
+    logging.info('The set has {} examples'.format(len(audio_dict)))
+    if manifest is not None:
+        manifest.add_segments(audio_dict.values())
+        if redo:
+            manifest.reset(entry.clip_id for entry in audio_dict.values())
+    count = 0
+    extracted_clip_ids = set()
+    if manifest is not None:
+        extracted_clip_ids = manifest.clip_ids(ingest_manifest.EXTRACTED)
+        logging.info('{} examples already extracted'.format(
+            len(extracted_clip_ids)))
+
+    def make_job(entry):
+        features_path = None
+        if manifest is not None:
+            features_path = ingest_manifest.features_path(dest_dir,
+                                                          entry.clip_id)
+        return (dest_dir, entry.clip_id, features_to_extract, cache,
+                features_path, loader, statistics)
+
+    if pipelined:
+        extracted_examples = _download_and_extract_pipelined(
+            dest_dir, audio_dict, redo, make_job, download_workers,
+            extract_workers, manifest, ranged_download, profiler, loader)
+    else:
+        extracted_examples = _download_then_extract(
+            dest_dir, audio_dict, redo, make_job, download_workers,
+            extract_workers, extract_chunksize, manifest, ranged_download,
+            profiler, loader)
+    for entry, (extracted, timings) in extracted_examples:
+        profiler.record_all(timings, entry.clip_id)
+        if manifest is not None and entry.clip_id not in extracted_clip_ids:
+            _record_extraction(manifest, dest_dir, entry.clip_id, extracted,
+                               len(features_to_extract))
+        if extracted is None:
+            continue
+        example = [1 if entry.key in positive_keys else 0]
+        count += 1 if example[0] == 1 else 0
+        example.extend(extracted)
+        profiler.count_clip()
+        logging.info('Example {} of {} after {:.1f} seconds'.format(
+            profiler.num_clips, len(audio_dict), profiler.wall_seconds))
+        yield entry.clip_id, example
+    logging.info('There are {} positive examples'.format(count))
+    if log_report:
+        profiler.log_report()
+
+
+def _download_then_extract(dest_dir, audio_dict, redo, make_job,
+                           download_workers, extract_workers,
+                           extract_chunksize, manifest, ranged_download,
+                           profiler, loader):
+    """Downloads every video, then extracts the clips in csv order.
+
+    See generate_examples for the arguments.
+
+    Yields:
+        A tuple of an AudioSetEntry and the tuple returned by
+        _extract_example_or_none for it.
+    """
+    with profiler.timer('download_phase'):
+        downloader.download_from_list(dest_dir, audio_dict, redo,
+                                      num_workers=download_workers,
+                                      manifest=manifest,
+                                      ranged=ranged_download,
+                                      profiler=profiler,
+                                      sample_rate=loader.sampling_rate,
+                                      res_type=loader.res_type)
+    jobs = (make_job(entry) for entry in audio_dict.values())
+    executor = None
+    if extract_workers > 1:
+        executor = futures.ProcessPoolExecutor(
+            max_workers=extract_workers,
+            initializer=feature_extraction.import_feature_modules,
+            initargs=(feature_extraction.feature_modules(),))
+        extracted_examples = _ordered_map(
+            executor, _extract_example_or_none, jobs, extract_chunksize,
+            max_pending_chunks=2 * extract_workers)
+    else:
+        extracted_examples = map(_extract_example_or_none, jobs)
+    try:
+        yield from zip(audio_dict.values(), extracted_examples)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def _download_and_extract_pipelined(dest_dir, audio_dict, redo, make_job,
+                                    download_workers, extract_workers,
+                                    manifest, ranged_download, profiler,
+                                    loader):
+    """Extracts the clips of each video as soon as it is downloaded.
+
+    See generate_examples for the arguments.
+
+    Yields:
+        A tuple of an AudioSetEntry and the tuple returned by
+        _extract_example_or_none for it, in the order the extractions
+        complete.
+    """
+    audioset_helper.check_dir(dest_dir)
+    failures = failure_store.open_store(dest_dir)
+    segments_by_video, chopped_entries, _ = downloader.plan_downloads(
+        dest_dir, audio_dict, redo, manifest, failures)
+    entries_by_clip_id = {entry.clip_id: entry
+                          for entry in audio_dict.values()}
+    clip_index = downloader.ClipIndex(dest_dir)
+
+    def download(video_id, entries):
+        available = downloader.download_and_chop(
+            dest_dir, video_id, entries, redo, manifest=manifest,
+            ranged=ranged_download, failures=failures, clip_index=clip_index,
+            profiler=profiler, sample_rate=loader.sampling_rate,
+            res_type=loader.res_type)
+        return [make_job(entry) for entry in available]
+
+    try:
+        for job, extracted in pipeline.run_stages(
+                segments_by_video.items(), download, _extract_example_or_none,
+                ready_items=(make_job(entry) for entry in chopped_entries),
+                download_workers=download_workers,
+                extract_workers=extract_workers,
+                extract_initializer=feature_extraction.import_feature_modules,
+                extract_initargs=(feature_extraction.feature_modules(),)):
+            yield entries_by_clip_id[job[1]], extracted
+    finally:
+        downloader.remove_tmp_dir(dest_dir)
+        failures.close()
+
+
+def _record_extraction(manifest, dest_dir, clip_id, extracted, num_features):
+    """Records the outcome of extracting the features of a clip.
+
+    Args:
+        manifest: The ingest_manifest.IngestManifest to record it in.
+        dest_dir: Path to the parent directory where the downloaded videos are
+            stored.
+        clip_id: The clip_id of the segment.
+        extracted: The list returned by extract_example, or None.
+        num_features: The number of features that were to be extracted.
+    """
+    if extracted is None:
+        manifest.set_state([clip_id], ingest_manifest.FAILED,
+                           error='extraction failed')
+    elif len(extracted) == num_features:
+        manifest.set_state([clip_id], ingest_manifest.EXTRACTED,
+                           output=ingest_manifest.features_path(dest_dir,
+                                                                clip_id))
+
+
+def _extract_chunk(function, chunk):
+    """Applies a function to each item of a chunk, in a pool process."""
+    return [function(item) for item in chunk]
+
+
+def _ordered_map(executor, function, items, chunksize, max_pending_chunks):
+    """Maps a function over items on an executor, in order and bounded.
+
+    Unlike executor.map, which submits every item up front, at most
+    max_pending_chunks chunks are submitted but not yet consumed at a time.
+
+    Args:
+        executor: The concurrent.futures executor running the function.
+        function: A picklable function taking a single item.
+        items: An iterable of items.
+        chunksize: The number of items sent to the executor at a time.
+        max_pending_chunks: The number of chunks to keep in flight.
+
+    Yields:
+        The result of the function for each item, in the order of items.
+    """
+    pending = collections.deque()
+    items = iter(items)
+    while True:
+        while len(pending) < max_pending_chunks:
+            chunk = list(itertools.islice(items, chunksize))
+            if not chunk:
+                break
+            pending.append(executor.submit(_extract_chunk, function, chunk))
+        if not pending:
+            return
+        for result in pending.popleft().result():
+            yield result
+
+
+def output_df(src_dir, dest_dir, filename, labels, features_to_extract,
+              redo=False, download_workers=1, extract_workers=1,
+              extract_chunksize=16, cache=None, manifest=None,
+              ranged_download=False, pipelined=False, num_shards=1,
+              shard_index=0, profiler=None, loader=None, statistics=None):
+    """Creates dataframe object from inputted csv files, features, and labels.
+
+        Collects every example yielded by generate_examples into a single
+        dataframe with a label of 1 or 0 depending on if the video's label is
+        in the list of labels passed in. The time to build the dataframe is
+        recorded by the profiler as the dataframe stage. See
+        generate_examples for the arguments.
 
         Returns:
             A pandas dataframe object with the following format:
@@ -207,48 +799,167 @@ def output_df(src_dir, dest_dir, filename, labels, features_to_extract,
             1       [1, 1, 5]  [4, 4, 5]  ...
             0       [1, 3, 5]  [1, 4, 5]  ...
         """
-    begin_time = datetime.datetime.now()
-    dataset = []
-    label_dict = audioset_helper.get_label_dict(src_dir)
-    labels_set = audioset_helper.label_list_to_set(labels, label_dict)
-    audio_dict = audioset_helper.parse_metadata(src_dir, filename)
-    count = 0
-    vid_count = 0
-    downloader.download_from_list(dest_dir, audio_dict, redo)
-    download_finish_time = datetime.datetime.now()
-    download_duration = download_finish_time - begin_time
-    logging.info(
-        'Time to download: {}'.format(download_duration.total_seconds()))
-    for video_id, entry in audio_dict.items():
-        example = [1 if is_positive_example(entry.labels, labels_set) else 0]
-        count += 1 if example[0] == 1 else 0
-        for feature in features_to_extract:
-            extracted_feature = extract_feature(
-                dest_dir, video_id, feature)
-            if extracted_feature is None:
-                continue
-            example.append(extracted_feature)
-        elapsed_seconds = (datetime.datetime.now() - begin_time).total_seconds()
-        logging.info((vid_count, elapsed_seconds))
-        vid_count += 1
-        dataset.append(example)
-    logging.info('There are {} positive examples'.format(count))
-    feature_extraction_finish_time = datetime.datetime.now()
-    feature_extract_duration = (feature_extraction_finish_time -
-                                download_finish_time)
-    logging.info('Time to extract features: {}'.format(
-        feature_extract_duration.total_seconds()))
+    log_report = profiler is None
+    if profiler is None:
+        profiler = profiling.Profiler()
+    dataset = [example for _, example in generate_examples(
+        src_dir, dest_dir, filename, labels, features_to_extract, redo,
+        download_workers, extract_workers, extract_chunksize, cache,
+        manifest, ranged_download, pipelined, num_shards, shard_index,
+        profiler, loader, statistics)]
     columns = ['label'] + features_to_extract
-    datasetdf = pd.DataFrame(dataset, columns=columns)
-    dataframe_finish_time = datetime.datetime.now()
-    dateframe_duration = (dataframe_finish_time - feature_extract_duration)
-    logging.info('Time to create dataframe: {}'.format(
-        dateframe_duration.total_seconds()))
-    end_time = datetime.datetime.now()
-    logging.info('Total time to produce dataframe: {}'.format(
-        (end_time - begin_time).total_seconds()))
+    with profiler.timer('dataframe'):
+        datasetdf = pd.DataFrame(dataset, columns=columns)
+    if log_report:
+        profiler.log_report()
     return datasetdf
 
 
+def write_examples(writer, src_dir, dest_dir, filename, labels,
+                   features_to_extract, redo=False, download_workers=1,
+                   extract_workers=1, extract_chunksize=16, cache=None,
+                   manifest=None, ranged_download=False, pipelined=False,
+                   num_shards=1, shard_index=0, profiler=None,
+                   loader=None, statistics=None):
+    """Streams labelled examples to a writer as soon as they are extracted.
+
+        Passes every example yielded by generate_examples to the writer, then
+        closes it. The time of each write is recorded by the profiler as the
+        write stage. See generate_examples for the other arguments.
+
+        Args:
+            writer: An object with write(clip_id, example) and close()
+                methods and a num_examples attribute, such as a
+                sharded_output.ShardWriter, a
+                feature_store.FeatureStoreWriter or a
+                tfrecord_output.TFRecordShardWriter.
+
+        Returns:
+            The number of examples written.
+        """
+    log_report = profiler is None
+    if profiler is None:
+        profiler = profiling.Profiler()
+    with writer:
+        for clip_id, example in generate_examples(
+                src_dir, dest_dir, filename, labels, features_to_extract,
+                redo, download_workers, extract_workers, extract_chunksize,
+                cache, manifest, ranged_download, pipelined, num_shards,
+                shard_index, profiler, loader, statistics):
+            with profiler.timer('write', clip_id):
+                writer.write(clip_id, example)
+    if log_report:
+        profiler.log_report()
+    return writer.num_examples
+
+
+def output_shards(output_dir, src_dir, dest_dir, filename, labels,
+                  features_to_extract, redo=False, download_workers=1,
+                  extract_workers=1, extract_chunksize=16, cache=None,
+                  manifest=None, ranged_download=False, pipelined=False,
+                  num_shards=1, shard_index=0, profiler=None, loader=None,
+                  statistics=None,
+                  shard_size=sharded_output.DEFAULT_SHARD_SIZE):
+    """Streams labelled examples to fixed-size shards on disk.
+
+        Writes every example yielded by generate_examples to output_dir as
+        soon as it is extracted, in shards of shard_size examples with the
+        columns of the dataframe returned by output_df, along with an index of
+        the shard and row of every clip_id. See generate_examples for the
+        other arguments.
+
+        Args:
+            output_dir: Path to the directory where the shards are written.
+            shard_size: The number of examples in each shard.
+
+        Returns:
+            The number of examples written.
+        """
+    columns = ['label'] + features_to_extract
+    writer = sharded_output.ShardWriter(output_dir, columns, shard_size)
+    num_examples = write_examples(
+        writer, src_dir, dest_dir, filename, labels, features_to_extract,
+        redo, download_workers, extract_workers, extract_chunksize, cache,
+        manifest, ranged_download, pipelined, num_shards, shard_index,
+        profiler, loader, statistics)
+    logging.info('Wrote {} examples in {} shards to {}'.format(
+        num_examples, writer.num_shards, output_dir))
+    return num_examples
+
+
+def output_feature_store(output_dir, src_dir, dest_dir, filename, labels,
+                         features_to_extract, redo=False, download_workers=1,
+                         extract_workers=1, extract_chunksize=16, cache=None,
+                         manifest=None, ranged_download=False,
+                         pipelined=False, num_shards=1, shard_index=0,
+                         profiler=None, loader=None, statistics=None):
+    """Streams labelled examples to a memory-mapped columnar feature store.
+
+        Writes every example yielded by generate_examples to a
+        feature_store.FeatureStoreWriter in output_dir, which training code
+        can open with feature_store.FeatureStore. See generate_examples for
+        the other arguments.
+
+        Args:
+            output_dir: Path to the directory of the feature store.
+
+        Returns:
+            The number of examples written.
+        """
+    writer = feature_store.FeatureStoreWriter(output_dir, features_to_extract)
+    num_examples = write_examples(
+        writer, src_dir, dest_dir, filename, labels, features_to_extract,
+        redo, download_workers, extract_workers, extract_chunksize, cache,
+        manifest, ranged_download, pipelined, num_shards, shard_index,
+        profiler, loader, statistics)
+    logging.info('Wrote {} examples to the feature store in {}'.format(
+        num_examples, output_dir))
+    return num_examples
+
+
+def output_tfrecords(output_dir, src_dir, dest_dir, filename, labels,
+                     features_to_extract, redo=False, download_workers=1,
+                     extract_workers=1, extract_chunksize=16, cache=None,
+                     manifest=None, ranged_download=False, pipelined=False,
+                     num_shards=1, shard_index=0, profiler=None, loader=None,
+                     statistics=None,
+                     max_shard_bytes=tfrecord_output.DEFAULT_MAX_SHARD_BYTES,
+                     compression='GZIP',
+                     num_writers=tfrecord_output.DEFAULT_NUM_WRITERS):
+    """Streams labelled examples to compressed TFRecord shards on disk.
+
+        Writes every example yielded by generate_examples to output_dir as a
+        SequenceExample as soon as it is extracted, in shards of bounded size
+        written in parallel, along with a manifest of the examples in each
+        shard, see tfrecord_output. Requires TensorFlow. See
+        generate_examples for the other arguments.
+
+        Args:
+            output_dir: Path to the directory where the shards are written.
+            max_shard_bytes: The size of the records of a shard, before
+                compression, past which a new shard is started.
+            compression: The compression of the shards, one of
+                tfrecord_output.COMPRESSION_TYPES.
+            num_writers: The number of shards written at the same time.
+
+        Returns:
+            The number of examples written.
+
+        Raises:
+            ImportError: TensorFlow is not installed.
+        """
+    writer = tfrecord_output.TFRecordShardWriter(
+        output_dir, features_to_extract, max_shard_bytes, compression,
+        num_writers)
+    num_examples = write_examples(
+        writer, src_dir, dest_dir, filename, labels, features_to_extract,
+        redo, download_workers, extract_workers, extract_chunksize, cache,
+        manifest, ranged_download, pipelined, num_shards, shard_index,
+        profiler, loader, statistics)
+    logging.info('Wrote {} examples in {} TFRecord shards to {}'.format(
+        num_examples, writer.num_shards, output_dir))
+    return num_examples
+
+
 if __name__ == "__main__":
     app.run(main)
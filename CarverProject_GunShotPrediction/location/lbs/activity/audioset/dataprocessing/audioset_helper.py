@@ -5,17 +5,87 @@ YouTube ID, start_seconds, end_seconds, positive_labels
 
 The file contains functions and classes to parse for the video_id,
 start_time_seconds, end_time_seconds, and labels, representing each row and its
-metadata as an AudioSetEntry and its labels as Label objects.
+metadata as an AudioSetEntry and its labels as Label objects. A video can have
+several labelled segments, so each segment is identified by its video_id and
+start_time, and its audio clip by a clip_id built from both.
+
+parse_segments parses a whole csv file in bulk into a SegmentTable of columns,
+with each segment's labels encoded as compact integer ids. The table can turn
+those into a sparse multi-hot label matrix, so that selecting the positive
+segments of any set of labels is a single vectorized operation.
+
+shard_of assigns every video to one of num_shards shards by a stable hash of
+its video_id, so that several machines can each ingest a disjoint part of the
+same csv file, with every segment of a video in the same shard.
 
 This file also contains other helper methods to confirm and create directories,
 and build sets of labels and video_id to Label lists key-value containing
 dictionaries.
 """
-import csv
 import json
 import os
 from os.path import isdir, join
+import zlib
 from absl import logging
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def clip_id(video_id, start_time):
+    """Returns the id of the audio clip of a labelled segment.
+
+    Args:
+        video_id: video id of the YouTube video.
+        start_time: start time in seconds of the labelled segment.
+
+    Returns:
+        A string of the video_id followed by the start time in milliseconds,
+        e.g. --PJHxphWEs_30000.
+    """
+    return '{}_{}'.format(video_id, int(round(start_time * 1000)))
+
+
+def split_clip_id(clip_id):
+    """Splits a clip_id into the video_id and start_time it was built from.
+
+    Args:
+        clip_id: The id of the audio clip of a labelled segment.
+
+    Returns:
+        A tuple of the video_id and the start time in seconds.
+    """
+    video_id, start_millis = clip_id.rsplit('_', 1)
+    return video_id, int(start_millis) / 1000
+
+
+def shard_of(video_id, num_shards):
+    """Returns the shard a video belongs to.
+
+    Uses the CRC-32 of the video_id rather than hash(), which is salted per
+    process, so that every machine and every run agrees on the shard.
+
+    Args:
+        video_id: video id of the YouTube video.
+        num_shards: The number of shards the dataset is split into.
+
+    Returns:
+        An integer from 0 to num_shards - 1.
+    """
+    return zlib.crc32(video_id.encode('utf-8')) % num_shards
+
+
+def shard_name(shard_index, num_shards):
+    """Returns the name of the output directory of a shard.
+
+    Args:
+        shard_index: The index of the shard, from 0 to num_shards - 1.
+        num_shards: The number of shards the dataset is split into.
+
+    Returns:
+        A string such as shard-00003-of-00008.
+    """
+    return 'shard-{:05d}-of-{:05d}'.format(shard_index, num_shards)
 
 
 class AudioSetEntry:
@@ -35,6 +105,124 @@ class AudioSetEntry:
         self.end_time = end_time
         self.labels = labels
 
+    @property
+    def key(self):
+        """The (video_id, start_time) tuple identifying the segment."""
+        return self.video_id, self.start_time
+
+    @property
+    def clip_id(self):
+        """The id of the audio clip of the segment, see clip_id."""
+        return clip_id(self.video_id, self.start_time)
+
+
+class SegmentTable:
+    """Columnar metadata of every segment of an AudioSet csv file.
+
+    The labels of all segments are stored in compressed sparse row form: the
+    integer label ids of segment i are
+    label_indices[label_indptr[i]:label_indptr[i + 1]], and integer id j
+    stands for the label id label_vocab[j], e.g. /m/032s66.
+
+    Attributes:
+        video_ids: A numpy array of the video id of each segment.
+        start_times: A float64 numpy array of the start time of each segment.
+        end_times: A float64 numpy array of the end time of each segment.
+        label_indptr: An int64 numpy array of offsets into label_indices.
+        label_indices: An int32 numpy array of integer label ids.
+        label_vocab: A list of label ids, indexed by integer label id.
+    """
+
+    def __init__(self, video_ids, start_times, end_times, label_indptr,
+                 label_indices, label_vocab):
+        """Inits SegmentTable with its columns."""
+        self.video_ids = video_ids
+        self.start_times = start_times
+        self.end_times = end_times
+        self.label_indptr = label_indptr
+        self.label_indices = label_indices
+        self.label_vocab = label_vocab
+        self._label_matrix = None
+
+    def __len__(self):
+        return len(self.video_ids)
+
+    def label_ids(self, i):
+        """Returns the integer label ids of segment i."""
+        return self.label_indices[self.label_indptr[i]:
+                                  self.label_indptr[i + 1]]
+
+    def label_matrix(self):
+        """Returns the sparse multi-hot label matrix of the segments.
+
+        Returns:
+            A scipy.sparse.csr_matrix of shape [segments, len(label_vocab)],
+            holding a 1 where a segment is labelled with a label.
+        """
+        if self._label_matrix is None:
+            data = np.ones(len(self.label_indices), dtype=np.int8)
+            self._label_matrix = sparse.csr_matrix(
+                (data, self.label_indices, self.label_indptr),
+                shape=(len(self), len(self.label_vocab)))
+        return self._label_matrix
+
+    def select_positives(self, label_index_sets):
+        """Selects the positive segments of several label definitions at once.
+
+        Args:
+            label_index_sets: A list of label definitions, each an iterable of
+                integer label ids, e.g. from OntologyIndex.expand_indices.
+
+        Returns:
+            A boolean numpy array of shape [segments, definitions], True where
+            a segment has any label of a definition.
+        """
+        definitions = np.zeros((len(self.label_vocab), len(label_index_sets)),
+                               dtype=np.int32)
+        for column, label_indices in enumerate(label_index_sets):
+            definitions[np.asarray(list(label_indices), dtype=np.int64),
+                        column] = 1
+        return np.asarray(self.label_matrix() @ definitions) > 0
+
+    def select_positive(self, label_indices):
+        """Returns a boolean array of the segments with any of the labels.
+
+        Args:
+            label_indices: An iterable of integer label ids.
+        """
+        return self.select_positives([label_indices])[:, 0]
+
+    def select_shard(self, num_shards, shard_index):
+        """Returns a boolean array of the segments in a shard, see shard_of.
+
+        Args:
+            num_shards: The number of shards the dataset is split into.
+            shard_index: The index of the shard, from 0 to num_shards - 1.
+
+        Raises:
+            ValueError: shard_index is not from 0 to num_shards - 1.
+        """
+        if not 0 <= shard_index < num_shards:
+            raise ValueError('shard_index must be from 0 to {}, got {}'.format(
+                num_shards - 1, shard_index))
+        unique_video_ids, inverse = np.unique(self.video_ids,
+                                              return_inverse=True)
+        shards = np.fromiter(
+            (shard_of(video_id, num_shards)
+             for video_id in unique_video_ids.tolist()),
+            dtype=np.int64, count=len(unique_video_ids))
+        return shards[inverse.reshape(-1)] == shard_index
+
+    def entries(self):
+        """Yields an AudioSetEntry per segment, with labels as label ids."""
+        all_labels = [self.label_vocab[j] for j in self.label_indices.tolist()]
+        label_indptr = self.label_indptr.tolist()
+        for i, (video_id, start_time, end_time) in enumerate(zip(
+                self.video_ids.tolist(), self.start_times.tolist(),
+                self.end_times.tolist())):
+            labels = all_labels[label_indptr[i]:label_indptr[i + 1]]
+            yield AudioSetEntry(video_id, start_time, end_time, labels)
+
 
 class Label:
     """Class to hold the metadata of each label in the dataset.
@@ -54,12 +242,72 @@ class Label:
         self.child_ids = child_ids
 
 
+def parse_segments(csv_path, label_vocab=None):
+    """Parses every segment of an audioset csv file in bulk.
+
+    Uses the C parser of pandas and encodes all labels with vectorized
+    operations, so that even unbalanced_train_segments.csv, with millions of
+    rows, is parsed in seconds.
+
+    Args:
+        csv_path: Path to the audioset csv file.
+        label_vocab: A list of label ids to encode labels with, e.g. every id
+            in the ontology, so that tables of different csv files share
+            integer ids. Labels missing from it are dropped with a warning. If
+            None, the vocabulary is built from the labels of the file in order
+            of first appearance.
+
+    Returns:
+        A SegmentTable of the segments in the file.
+    """
+    frame = pd.read_csv(
+        csv_path, comment='#', header=None, skipinitialspace=True,
+        names=['video_id', 'start_time', 'end_time', 'labels'],
+        dtype={'video_id': str, 'start_time': np.float64,
+               'end_time': np.float64, 'labels': str},
+        engine='c')
+    label_column = frame['labels'].fillna('')
+    # Splitting the joined column once is much faster than splitting each row.
+    # Each row splits into one more token than it has commas, and the row of
+    # every token goes through the same masks as the tokens, so that empty
+    # tokens, of an empty field or a stray comma, are dropped consistently.
+    tokens = np.array(
+        ','.join(label_column.tolist()).replace(' ', '').split(','),
+        dtype=object)
+    rows = np.repeat(np.arange(len(frame)),
+                     label_column.str.count(',').to_numpy(dtype=np.int64) + 1)
+    nonempty = tokens != ''
+    all_labels = tokens[nonempty]
+    rows = rows[nonempty]
+    if label_vocab is None:
+        codes, uniques = pd.factorize(all_labels)
+        label_vocab = list(uniques)
+    else:
+        codes = pd.Index(label_vocab).get_indexer(all_labels)
+        known = codes >= 0
+        if not known.all():
+            logging.warning('Dropping {} labels missing from the vocabulary: '
+                            '{}'.format((~known).sum(),
+                                        sorted(set(all_labels[~known]))))
+            rows = rows[known]
+            codes = codes[known]
+    label_counts = np.bincount(rows, minlength=len(frame))
+    label_indptr = np.zeros(len(frame) + 1, dtype=np.int64)
+    np.cumsum(label_counts, out=label_indptr[1:])
+    return SegmentTable(
+        frame['video_id'].to_numpy(), frame['start_time'].to_numpy(),
+        frame['end_time'].to_numpy(), label_indptr,
+        np.asarray(codes, dtype=np.int32), label_vocab)
+
+
 def parse_metadata(src_dir, filename):
     """Parses metadata and labels from the audioset csv.
 
-    Iterates through the csv files from audioset and extracts the metadata:
-    video_id, start_time, end_time, and labels, creating an AudioSetEntry object
-    with the metadata as instance data.
+    Parses the csv files from audioset with parse_segments and extracts the
+    metadata: video_id, start_time, end_time, and labels, creating an
+    AudioSetEntry object with the metadata as instance data. Each segment is
+    keyed by its video_id and start_time, so that several segments of the same
+    video are all kept.
 
     Args:
         src_dir: Path to a directory where the audioset csv file is expected to
@@ -67,25 +315,11 @@ def parse_metadata(src_dir, filename):
         filename: A csv file without the .csv file extension
 
     Returns:
-        A dictionary with video_id, AudioSetEntry key-value pairs.
+        A dictionary with (video_id, start_time), AudioSetEntry key-value
+        pairs.
     """
-    csv_path = join(src_dir, filename + '.csv')
-    audio_dict = {}
-    with open(csv_path) as csv_file:
-        fieldnames = ['video_id', 'start_time', 'end_time']
-        csv_rows = csv.DictReader(filter(lambda row: row[0] != '#', csv_file),
-                                  fieldnames=fieldnames)
-        for row in csv_rows:
-            label_list = []
-            video_id = row.get('video_id')
-            start_time = float(row.get('start_time').strip())
-            end_time = float(row.get('end_time').strip())
-            for label in row.get(None):
-                label = label.strip()
-                label = label.replace('"', '')
-                label_list.append(label)
-            audio_dict[video_id] = AudioSetEntry(
-                video_id, start_time, end_time, label_list)
+    table = parse_segments(join(src_dir, filename + '.csv'))
+    audio_dict = {entry.key: entry for entry in table.entries()}
     logging.info('The set has {} examples'.format(len(audio_dict)))
     return audio_dict
 
@@ -116,8 +350,10 @@ def label_list_to_set(labels_list, label_dict):
     """Converts a list of labels to a set of labels.
 
     Translates a list of plain English labels names into label ids and adds the
-    child_ids of each label to the list. Then, converts the list of label ids
-    to a set of labels ids and returns that set.
+    ids of every descendant of each label, i.e. its children, their children
+    and so on, to the list. Then, converts the list of label ids to a set of
+    labels ids and returns that set. ontology_index.OntologyIndex.expand does
+    the same with precomputed descendants.
 
     Args:
         labels_list: a list of label names passed in as command line arguments.
@@ -126,12 +362,17 @@ def label_list_to_set(labels_list, label_dict):
     Returns:
         A set of labels in the format found in the audioset csv
     """
-    translated_labels_list = []
-    for name in labels_list:
-        translated_labels_list.append(label_dict.get(name).label_id)
-        for label_id in label_dict.get(name).child_ids:
-            translated_labels_list.append(label_id)
-    labels_set = set(translated_labels_list)
+    children = {label.label_id: label.child_ids
+                for label in label_dict.values()}
+    translated_labels_list = [label_dict.get(name).label_id
+                              for name in labels_list]
+    labels_set = set()
+    while translated_labels_list:
+        label_id = translated_labels_list.pop()
+        if label_id in labels_set:
+            continue
+        labels_set.add(label_id)
+        translated_labels_list.extend(children.get(label_id, []))
     return labels_set
 
 
@@ -0,0 +1,378 @@
+"""
+Script to benchmark the ingestion pipeline offline, on synthetic data.
+
+Generates an AudioSet csv file, an ontology.json file and an audio file per
+video, of configurable sizes, in a work directory, then runs each step of the
+ingestion on them and reports its throughput and peak memory:
+
+ontology          compiling the ontology index, per label.
+parse_segments    parsing the csv file into a SegmentTable, per segment.
+parse_metadata    parsing the csv file into AudioSetEntry objects, per segment.
+download          downloading and chopping every video with a
+                  LocalFileFetcher standing in for YouTube, per segment.
+chop              chopping every segment out of its audio file, per segment.
+feature:NAME      decoding a clip and extracting one feature, per clip.
+features:all      decoding a clip and extracting every feature, per clip.
+batch:NAME        decoding clips and extracting one feature from all of them
+                  at once, see feature_extraction.extract_batch, per clip.
+
+No network access is needed, so the benchmark can be run before and after a
+change to measure it, and regressions can be caught offline. Peak memory is
+the peak of the memory allocated through Python, including numpy arrays, as
+traced by tracemalloc, which slows down steps that allocate many small
+objects.
+
+Usage
+Standalone script:
+python benchmark.py
+    --num_videos NUMBER OF SYNTHETIC VIDEOS
+    --segments_per_video NUMBER OF LABELLED SEGMENTS OF EACH VIDEO
+    --video_seconds LENGTH OF EACH SYNTHETIC VIDEO
+    --benchmark_features FEATURE TO BENCHMARK, REPEATED FOR EACH FEATURE
+    --report_path PATH TO WRITE THE REPORT TO AS JSON
+
+Example:
+python benchmark.py --num_videos 200 --video_seconds 30
+    --benchmark_features mfcc --report_path benchmark.json
+"""
+import json
+import os
+from os.path import join
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from absl import app
+from absl import flags
+from absl import logging
+import numpy as np
+import soundfile
+import audioset_helper
+import downloader
+import feature_extraction
+import ontology_index
+
+CSV_NAME = 'benchmark_segments'
+SEGMENT_SECONDS = 10
+
+FLAGS = flags.FLAGS
+flags.DEFINE_integer('num_videos', 100,
+                     'The number of synthetic videos to generate',
+                     lower_bound=1)
+flags.DEFINE_integer('segments_per_video', 1,
+                     'The number of labelled 10-second segments of each '
+                     'video', lower_bound=1)
+flags.DEFINE_integer('video_seconds', 30,
+                     'The length in seconds of the audio of each video',
+                     lower_bound=SEGMENT_SECONDS)
+flags.DEFINE_integer('source_sample_rate', 44100,
+                     'The sampling rate of the synthetic audio files',
+                     lower_bound=1)
+flags.DEFINE_integer('channels', 2,
+                     'The number of channels of the synthetic audio files',
+                     lower_bound=1)
+flags.DEFINE_integer('num_labels', 100,
+                     'The number of labels of the synthetic ontology',
+                     lower_bound=1)
+flags.DEFINE_string('ontology_path', None,
+                    'An ontology.json file to take the first --num_labels '
+                    'labels of, rather than generating synthetic labels')
+flags.DEFINE_multi_string('benchmark_features',
+                          list(feature_extraction.FEATURES),
+                          'The features to benchmark the extraction of')
+flags.DEFINE_integer('feature_clips', 20,
+                     'The number of clips to extract each feature from',
+                     lower_bound=1)
+flags.DEFINE_integer('fetch_workers', 1,
+                     'The number of videos to download at the same time',
+                     lower_bound=1)
+flags.DEFINE_integer('seed', 0, 'The seed of the synthetic data')
+flags.DEFINE_string('work_dir', None,
+                    'The location of the synthetic data and of the clips. '
+                    'Defaults to a temporary directory, removed afterwards')
+flags.DEFINE_string('report_path', None,
+                    'The location to write the results to as JSON. The '
+                    'results are only logged if unset')
+
+
+def main(argv):
+    """Generates the synthetic data, runs the benchmarks and reports them.
+
+    Args:
+        argv: A list containing the path this script after the build process.
+    """
+    work_dir = FLAGS.work_dir or tempfile.mkdtemp(prefix='audioset-bench-')
+    try:
+        generate_dataset(work_dir, FLAGS.num_videos, FLAGS.segments_per_video,
+                         FLAGS.video_seconds, FLAGS.source_sample_rate,
+                         FLAGS.channels, FLAGS.num_labels, FLAGS.seed,
+                         FLAGS.ontology_path)
+        results = run_benchmarks(work_dir, FLAGS.benchmark_features,
+                                 FLAGS.feature_clips, FLAGS.fetch_workers)
+    finally:
+        if not FLAGS.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    log_results(results)
+    if FLAGS.report_path:
+        with open(FLAGS.report_path, 'w') as report_file:
+            json.dump({'results': results,
+                       'max_rss_mb': max_rss_mb()}, report_file, indent=2)
+
+
+def generate_dataset(work_dir, num_videos, segments_per_video, video_seconds,
+                     sample_rate, channels, num_labels, seed=0,
+                     ontology_path=None):
+    """Writes a synthetic AudioSet dataset to a work directory.
+
+    Layout:
+    WORK_DIR/src/ontology.json
+    WORK_DIR/src/benchmark_segments.csv
+    WORK_DIR/audio/VIDEO_ID.wav
+
+    Args:
+        work_dir: Path to the work directory.
+        num_videos: The number of videos.
+        segments_per_video: The number of labelled segments of each video.
+        video_seconds: The length in seconds of the audio of each video.
+        sample_rate: The sampling rate of the audio files.
+        channels: The number of channels of the audio files.
+        num_labels: The number of labels of the ontology.
+        seed: The seed of the random labels and audio.
+        ontology_path: Path to an ontology.json file to take the first
+            num_labels labels of, or None to generate them.
+
+    Raises:
+        ValueError: The segments of a video do not fit in video_seconds.
+    """
+    if segments_per_video * SEGMENT_SECONDS > video_seconds:
+        raise ValueError('{} segments of {} seconds do not fit in {} '
+                         'seconds'.format(segments_per_video, SEGMENT_SECONDS,
+                                          video_seconds))
+    rng = np.random.RandomState(seed)
+    src_dir = join(work_dir, 'src')
+    audio_dir = join(work_dir, 'audio')
+    os.makedirs(src_dir, exist_ok=True)
+    os.makedirs(audio_dir, exist_ok=True)
+    labels = write_ontology(join(src_dir, ontology_index.ONTOLOGY_FILENAME),
+                            num_labels, ontology_path)
+    video_ids = ['bench{:07d}'.format(i) for i in range(num_videos)]
+    write_segments_csv(join(src_dir, CSV_NAME + '.csv'), video_ids,
+                       segments_per_video, [label['id'] for label in labels],
+                       rng)
+    for video_id in video_ids:
+        write_audio(join(audio_dir, video_id + '.wav'), video_seconds,
+                    sample_rate, channels, rng)
+    logging.info('Generated {} videos in {}'.format(num_videos, work_dir))
+
+
+def write_ontology(path, num_labels, ontology_path=None):
+    """Writes an ontology.json file of num_labels labels.
+
+    Args:
+        path: Path to the ontology.json file to write.
+        num_labels: The number of labels.
+        ontology_path: Path to an ontology.json file to take the first
+            num_labels labels of, dropping the children not among them, or
+            None to generate a binary tree of labels.
+
+    Returns:
+        The list of labels written, as dictionaries.
+    """
+    if ontology_path is not None:
+        with open(ontology_path) as ontology_file:
+            labels = json.load(ontology_file)[:num_labels]
+        kept_ids = {label['id'] for label in labels}
+        for label in labels:
+            label['child_ids'] = [child_id for child_id in label['child_ids']
+                                  if child_id in kept_ids]
+    else:
+        labels = [{
+            'id': '/t/bench{:05d}'.format(i),
+            'name': 'Benchmark label {}'.format(i),
+            'description': '',
+            'child_ids': ['/t/bench{:05d}'.format(child)
+                          for child in (2 * i + 1, 2 * i + 2)
+                          if child < num_labels],
+        } for i in range(num_labels)]
+    with open(path, 'w') as ontology_file:
+        json.dump(labels, ontology_file)
+    return labels
+
+
+def write_segments_csv(path, video_ids, segments_per_video, label_ids, rng):
+    """Writes an AudioSet csv file of consecutive segments of each video.
+
+    Args:
+        path: Path to the csv file to write.
+        video_ids: A list of the video ids.
+        segments_per_video: The number of labelled segments of each video.
+        label_ids: A list of label ids to draw one to three labels from for
+            each segment.
+        rng: A numpy RandomState.
+    """
+    with open(path, 'w') as csv_file:
+        csv_file.write('# Segments csv created for benchmarking\n')
+        csv_file.write('# num_ytids={}, num_segs={}\n'.format(
+            len(video_ids), len(video_ids) * segments_per_video))
+        csv_file.write('# YTID, start_seconds, end_seconds, '
+                       'positive_labels\n')
+        for video_id in video_ids:
+            for segment in range(segments_per_video):
+                start_time = segment * SEGMENT_SECONDS
+                labels = rng.choice(label_ids, replace=False, size=min(
+                    len(label_ids), rng.randint(1, 4)))
+                csv_file.write('{}, {:.3f}, {:.3f}, "{}"\n'.format(
+                    video_id, start_time, start_time + SEGMENT_SECONDS,
+                    ','.join(labels)))
+
+
+def write_audio(path, seconds, sample_rate, channels, rng):
+    """Writes a 16-bit wav file of noise and a tone of random pitch.
+
+    Args:
+        path: Path to the wav file to write.
+        seconds: The length of the audio in seconds.
+        sample_rate: The sampling rate of the audio.
+        channels: The number of channels of the audio.
+        rng: A numpy RandomState.
+    """
+    times = np.arange(seconds * sample_rate) / sample_rate
+    tone = np.sin(2 * np.pi * rng.uniform(100, 2000) * times)
+    noise = rng.standard_normal((len(times), channels))
+    audio = 0.5 * tone[:, np.newaxis] + 0.1 * noise
+    soundfile.write(path, np.clip(audio, -1, 1).astype(np.float32),
+                    sample_rate, subtype='PCM_16')
+
+
+def measure(name, num_items, function, *args, **kwargs):
+    """Runs a function and measures its throughput and peak memory.
+
+    Args:
+        name: The name of the benchmark.
+        num_items: The number of items the function processes, or a
+            function taking the value returned by the function and returning
+            that number.
+        function: The function to run.
+        *args: The positional arguments of the function.
+        **kwargs: The keyword arguments of the function.
+
+    Returns:
+        A tuple of the value returned by the function and a dictionary of
+        the results of the benchmark.
+    """
+    tracemalloc.start()
+    begin = time.perf_counter()
+    try:
+        value = function(*args, **kwargs)
+        seconds = time.perf_counter() - begin
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    if callable(num_items):
+        num_items = num_items(value)
+    return value, {
+        'name': name,
+        'items': num_items,
+        'seconds': seconds,
+        'items_per_second': num_items / seconds if seconds > 0 else 0.0,
+        'peak_mb': peak / 2 ** 20,
+    }
+
+
+def run_benchmarks(work_dir, features, feature_clips, fetch_workers=1):
+    """Runs every benchmark on the dataset generated in a work directory.
+
+    Args:
+        work_dir: Path to the work directory, see generate_dataset.
+        features: A list of the features to benchmark the extraction of.
+        feature_clips: The number of clips to extract each feature from.
+        fetch_workers: The number of videos to download at the same time.
+
+    Returns:
+        A list of the results of each benchmark, see measure.
+    """
+    feature_extraction.check_features(features)
+    src_dir = join(work_dir, 'src')
+    audio_dir = join(work_dir, 'audio')
+    results = []
+    ontology, result = measure(
+        'ontology', lambda ontology: len(ontology.label_ids),
+        ontology_index.compile_ontology,
+        join(src_dir, ontology_index.ONTOLOGY_FILENAME))
+    results.append(result)
+    table, result = measure('parse_segments', len,
+                            audioset_helper.parse_segments,
+                            join(src_dir, CSV_NAME + '.csv'),
+                            ontology.label_ids)
+    num_segments = len(table)
+    results.append(result)
+    audio_dict, result = measure('parse_metadata', num_segments,
+                                 audioset_helper.parse_metadata, src_dir,
+                                 CSV_NAME)
+    results.append(result)
+
+    download_dir = join(work_dir, 'download')
+    _, result = measure('download', num_segments,
+                        downloader.download_from_list, download_dir,
+                        dict(audio_dict), False, num_workers=fetch_workers,
+                        fetcher=downloader.LocalFileFetcher(audio_dir))
+    results.append(result)
+
+    chop_dir = join(work_dir, 'chop')
+    audioset_helper.check_dir(chop_dir)
+    audioset_helper.check_dir(join(chop_dir, 'yt_videos'))
+    _, result = measure('chop', num_segments, _chop_every_segment, chop_dir,
+                        audio_dict.values(), audio_dir)
+    results.append(result)
+
+    clip_paths = [downloader.clip_path(chop_dir, entry.clip_id)
+                  for entry in list(audio_dict.values())[:feature_clips]]
+    for feature in features:
+        _, result = measure('feature:' + feature, len(clip_paths),
+                            _extract_every_clip, clip_paths, [feature])
+        results.append(result)
+    _, result = measure('features:all', len(clip_paths), _extract_every_clip,
+                        clip_paths, list(features))
+    results.append(result)
+    for feature in features:
+        if feature in feature_extraction.BATCH_FEATURES:
+            _, result = measure('batch:' + feature, len(clip_paths),
+                                feature_extraction.extract_batch, clip_paths,
+                                [feature])
+            results.append(result)
+    return results
+
+
+def _chop_every_segment(dest_dir, entries, audio_dir):
+    # The audio files are chopped where they were generated, as if they had
+    # been downloaded there, and kept for the segments that follow.
+    for entry in entries:
+        downloader.chop_audio(dest_dir, entry.video_id, entry.start_time,
+                              entry.end_time, remove_source=False,
+                              tmp_path=audio_dir)
+
+
+def _extract_every_clip(clip_paths, features):
+    for path in clip_paths:
+        feature_extraction.extract_features(path, features)
+
+
+def max_rss_mb():
+    """Returns the peak resident memory of this process in megabytes."""
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def log_results(results):
+    """Logs the results of every benchmark, one per line."""
+    for result in results:
+        logging.info('{:<28} {:>8} items {:>10.3f} s {:>12.2f} items/s '
+                     '{:>10.1f} MB peak'.format(
+                         result['name'], result['items'], result['seconds'],
+                         result['items_per_second'], result['peak_mb']))
+    logging.info('Peak resident memory: {:.1f} MB'.format(max_rss_mb()))
+
+
+if __name__ == "__main__":
+    app.run(main)
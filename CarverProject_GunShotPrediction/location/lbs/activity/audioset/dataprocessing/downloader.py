@@ -3,55 +3,674 @@
 The functions in this script utilize youtube-dl to download videos from YouTube,
 convert them into audio files, and chop them into segments based on specific
 start and end times in seconds from the AudioSet csv file.
+
+Downloads are performed by a fetch backend. YoutubeDLFetcher is used by
+default, and LocalFileFetcher can stand in for YouTube in tests by copying
+audio files from a local directory.
+
+In ranged mode, only the labelled window of each segment is fetched rather
+than the whole video, through the fetch_range method of the backend, which
+returns the time in the video at which the fetched file starts. HttpRangeFetcher
+serves as a stand-in for ranged downloads of wav files from an HTTP server.
+
+Segments are cut from a downloaded file by seeking to their start time and
+decoding only their duration, straight to mono 16-bit PCM at the sampling
+rate features are extracted at, so that a clip is never decoded or resampled
+twice and a long video is never decoded in full.
+
+Each segment is chopped to yt_videos/sliced_CLIP_ID.wav, see clip_path.
+Earlier versions kept a single clip per video, sliced_VIDEO_ID.wav, at the
+sampling rate of the video. Those clips are not reused: the segments of
+their videos are downloaded and chopped again, and the old clips can be
+deleted.
 """
-import youtube_dl
-from pydub import AudioSegment
+import collections
+from concurrent import futures
+import contextlib
 import os
 from os.path import join, isfile, isdir
 import shutil
-from os import listdir
+import struct
+import subprocess
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import wave
+import librosa
+import numpy as np
+import soundfile
+import youtube_dl
 from absl import logging
 from audioset_helper import check_dir
+from audioset_helper import clip_id
+import failure_store
+import feature_extraction
+import ingest_manifest
+import profiling
+
+AUDIO_EXTENSIONS = ('m4a', 'opus', 'ogg', 'webm', 'wav')
+# The size of the first request of a wav file, expected to hold its header.
+WAV_HEADER_BYTES = 2 ** 16
+
+
+class DownloadError(Exception):
+    """Raised by a fetch backend when a video could not be fetched.
+
+    Attributes:
+        permanent: Whether retrying cannot succeed, or None to let
+            failure_store.classify_error tell from the message.
+    """
+
+    def __init__(self, message, permanent=None):
+        """Inits DownloadError with a message and whether it is permanent."""
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class YoutubeDLFetcher:
+    """Fetch backend that downloads the audio of YouTube videos.
+
+    Uses youtube-dl to download the best available audio of a video and
+    convert it into an audio file named after the video_id.
+
+    Attributes:
+        min_sample_rate: The lowest sampling rate of the audio formats
+            fetch_range picks from.
+    """
+
+    def __init__(self, min_sample_rate=feature_extraction.SAMPLING_RATE):
+        """Inits YoutubeDLFetcher with the sampling rate clips need."""
+        self.min_sample_rate = min_sample_rate
+
+    def fetch(self, video_id, tmp_path):
+        """Downloads the audio of a YouTube video into tmp_path.
+
+        Args:
+            video_id: the video_id of the YouTube video to be downloaded.
+            tmp_path: Path to the directory where the audio file is written.
+
+        Raises:
+            DownloadError: The video is unavailable or could not be downloaded.
+        """
+        ydl_opts = {
+            'format': 'bestaudio/best',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredquality': '192',
+            }],
+            # Force the file naming of outputs.
+            'outtmpl': join(tmp_path, video_id + '.%(ext)s')
+        }
+        with youtube_dl.YoutubeDL(ydl_opts) as ydl:
+            try:
+                ydl.download(['https://www.youtube.com/watch?v=' + video_id])
+            except youtube_dl.DownloadError as error:
+                raise DownloadError(str(error))
+
+    def fetch_range(self, video_id, tmp_path, start_time, end_time):
+        """Downloads the audio of a window of a YouTube video into tmp_path.
+
+        Picks the smallest audio-only format with a sampling rate of at least
+        min_sample_rate, falling back to the best audio if none qualifies,
+        and has ffmpeg copy only the window out of it, without re-encoding.
+
+        Args:
+            video_id: the video_id of the YouTube video to be downloaded.
+            tmp_path: Path to the directory where the audio file is written.
+            start_time: The start time in seconds of the window.
+            end_time: The end time in seconds of the window.
+
+        Returns:
+            The time in seconds in the video at which the audio file starts.
+
+        Raises:
+            DownloadError: The video is unavailable or could not be downloaded.
+        """
+        ydl_opts = {
+            'format': 'worstaudio[asr>={}]/bestaudio/best'.format(
+                self.min_sample_rate),
+            'external_downloader': 'ffmpeg',
+            # Seeking in the input makes ffmpeg request only the byte ranges
+            # of the window from the server.
+            'external_downloader_args': ['-ss', str(start_time),
+                                         '-t', str(end_time - start_time)],
+            # Force the file naming of outputs.
+            'outtmpl': join(tmp_path, video_id + '.%(ext)s')
+        }
+        with youtube_dl.YoutubeDL(ydl_opts) as ydl:
+            try:
+                ydl.download(['https://www.youtube.com/watch?v=' + video_id])
+            except youtube_dl.DownloadError as error:
+                raise DownloadError(str(error))
+        return start_time
+
+
+class LocalFileFetcher:
+    """Fetch backend that copies audio files from a local directory.
+
+    Stands in for YouTube in tests and benchmarks. The audio of a video_id is
+    expected to be found in src_dir as video_id.EXT, where EXT is one of
+    AUDIO_EXTENSIONS.
+
+    Attributes:
+        src_dir: Path to the directory holding the audio files.
+    """
+
+    def __init__(self, src_dir):
+        """Inits LocalFileFetcher with the directory to serve files from."""
+        self.src_dir = src_dir
+
+    def fetch(self, video_id, tmp_path):
+        """Copies the audio file of a video_id into tmp_path.
+
+        Args:
+            video_id: the video_id of the audio file to be copied.
+            tmp_path: Path to the directory where the audio file is written.
+
+        Raises:
+            DownloadError: No audio file exists for the video_id.
+        """
+        for extension in AUDIO_EXTENSIONS:
+            src_path = join(self.src_dir, video_id + '.' + extension)
+            if isfile(src_path):
+                shutil.copyfile(src_path, join(tmp_path, video_id + '.' +
+                                               extension))
+                return
+        raise DownloadError('No audio file for {}'.format(video_id),
+                            permanent=True)
+
+    def fetch_range(self, video_id, tmp_path, start_time, end_time):
+        """Copies the whole audio file of a video_id into tmp_path.
+
+        Returns:
+            0, as the audio file starts at the start of the video.
+
+        Raises:
+            DownloadError: No audio file exists for the video_id.
+        """
+        self.fetch(video_id, tmp_path)
+        return 0.0
+
+
+class HttpRangeFetcher:
+    """Fetch backend that downloads windows of wav files over HTTP.
+
+    Stands in for ranged downloads from YouTube in tests and benchmarks. The
+    audio of a video_id is expected to be served at base_url/video_id.wav, as
+    uncompressed PCM, by a server that supports range requests. Only the
+    header and the frames of the requested window are transferred.
+
+    Attributes:
+        base_url: The URL of the directory serving the wav files.
+        timeout: The timeout of each request in seconds.
+    """
+
+    def __init__(self, base_url, timeout=30):
+        """Inits HttpRangeFetcher with the URL to serve files from."""
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
 
+    def fetch(self, video_id, tmp_path):
+        """Downloads the whole wav file of a video_id into tmp_path.
 
-def download_from_list(dest_dir, audio_dict, redo):
+        Raises:
+            DownloadError: The file could not be downloaded.
+        """
+        data = self._get(video_id, None)
+        with open(join(tmp_path, video_id + '.wav'), 'wb') as file:
+            file.write(data)
+
+    def fetch_range(self, video_id, tmp_path, start_time, end_time):
+        """Downloads a window of the wav file of a video_id into tmp_path.
+
+        Args:
+            video_id: the video_id of the wav file to be downloaded.
+            tmp_path: Path to the directory where the wav file is written.
+            start_time: The start time in seconds of the window.
+            end_time: The end time in seconds of the window.
+
+        Returns:
+            The time in seconds in the original file at which the written
+            wav file starts.
+
+        Raises:
+            DownloadError: The file could not be downloaded, the server does
+                not support range requests, or the file is not PCM wav.
+        """
+        header = self._get(video_id, (0, WAV_HEADER_BYTES - 1))
+        params, data_offset, data_size = _parse_wav_header(header)
+        num_channels, sample_rate, sample_width = params
+        frame_size = num_channels * sample_width
+        num_frames = data_size // frame_size
+        start_frame = min(int(start_time * sample_rate), num_frames)
+        end_frame = min(int(end_time * sample_rate), num_frames)
+        frames = b''
+        if end_frame > start_frame:
+            frames = self._get(video_id, (
+                data_offset + start_frame * frame_size,
+                data_offset + end_frame * frame_size - 1))
+        with wave.open(join(tmp_path, video_id + '.wav'), 'wb') as wav_file:
+            wav_file.setnchannels(num_channels)
+            wav_file.setsampwidth(sample_width)
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(frames)
+        return start_frame / sample_rate
+
+    def _get(self, video_id, byte_range):
+        request = urllib.request.Request(
+            '{}/{}.wav'.format(self.base_url, video_id))
+        if byte_range is not None:
+            request.add_header('Range', 'bytes={}-{}'.format(*byte_range))
+        try:
+            with urllib.request.urlopen(request,
+                                        timeout=self.timeout) as response:
+                if byte_range is not None and response.status != 206:
+                    raise DownloadError(
+                        'Range requests are not supported by {}'.format(
+                            self.base_url))
+                return response.read()
+        except urllib.error.HTTPError as error:
+            raise DownloadError(str(error),
+                                permanent=error.code in (404, 410))
+        except (urllib.error.URLError, OSError) as error:
+            raise DownloadError(str(error))
+
+
+def _parse_wav_header(header):
+    """Finds the format and data chunk of the first bytes of a PCM wav file.
+
+    Args:
+        header: The first bytes of the wav file.
+
+    Returns:
+        A tuple of a (channels, sampling rate, sample width in bytes) tuple,
+        the offset of the frames in the file, and their size in bytes.
+
+    Raises:
+        DownloadError: The header is not the header of a PCM wav file.
+    """
+    if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        raise DownloadError('Not a wav file', permanent=True)
+    params = None
+    offset = 12
+    while offset + 8 <= len(header):
+        chunk_id = header[offset:offset + 4]
+        chunk_size, = struct.unpack('<I', header[offset + 4:offset + 8])
+        offset += 8
+        if chunk_id == b'fmt ':
+            audio_format, num_channels, sample_rate, _, _, bits = (
+                struct.unpack('<HHIIHH', header[offset:offset + 16]))
+            if audio_format != 1:
+                raise DownloadError('Not a PCM wav file', permanent=True)
+            params = (num_channels, sample_rate, bits // 8)
+        elif chunk_id == b'data':
+            if params is None:
+                break
+            return params, offset, chunk_size
+        offset += chunk_size + chunk_size % 2
+    raise DownloadError('No wav header in the first {} bytes'.format(
+        len(header)), permanent=True)
+
+
+class ClipIndex:
+    """In-memory index of the clips in dest_dir, built with one scan.
+
+    Checking whether each of millions of segments has been chopped with a
+    stat call each is slow, especially on network filesystems. The index reads
+    the yt_videos directory once with os.scandir, and is updated as clips are
+    chopped, so that each check is a set lookup. Safe to share between the
+    threads of a process.
+    """
+
+    def __init__(self, dest_dir):
+        """Inits ClipIndex with the clips found in dest_dir."""
+        self._clip_ids = set()
+        with os.scandir(join(dest_dir, 'yt_videos')) as dir_entries:
+            for dir_entry in dir_entries:
+                name = dir_entry.name
+                if name.startswith('sliced_') and name.endswith('.wav'):
+                    self._clip_ids.add(name[len('sliced_'):-len('.wav')])
+
+    def __contains__(self, clip_id):
+        return clip_id in self._clip_ids
+
+    def __len__(self):
+        return len(self._clip_ids)
+
+    def add(self, clip_id):
+        """Records that the clip of a segment has been chopped."""
+        self._clip_ids.add(clip_id)
+
+
+def clip_path(dest_dir, clip_id):
+    """Returns the path of the chopped audio clip of a labelled segment.
+
+    Args:
+        dest_dir: Path to the parent directory where the downloaded videos are
+            stored.
+        clip_id: The clip_id of the segment, see audioset_helper.clip_id.
+    """
+    return join(dest_dir, 'yt_videos', 'sliced_' + clip_id + '.wav')
+
+
+def download_from_list(dest_dir, audio_dict, redo, num_workers=1,
+                       fetcher=None, manifest=None,
+                       sample_rate=feature_extraction.SAMPLING_RATE,
+                       ranged=False, failures=None, clip_index=None,
+                       profiler=None, res_type=feature_extraction.RES_TYPE):
     """Downloads and trims YouTube audio to the label start and end time.
 
-    Iterates through the key-value pairs in the dictionary and downloads each
-    YouTube video unless the video is unavailable or made private. In those
-    cases, it skips over the failed download. For each failed download, the
-    video_id is stored in a list, failed_downloads. Then each video_id is
-    removed from the audio_dict dictionary.
+    Iterates through the videos of the segments in the dictionary and
+    downloads each YouTube video unless the video is unavailable or made
+    private. In those cases, it skips over the failed download. Each failure
+    is recorded in the failure store of dest_dir, see failure_store, and
+    videos whose failure is permanent or whose retry is not yet due are not
+    downloaded again. Then every segment of the videos that failed is removed
+    from the audio_dict dictionary.
+
+    A video with several labelled segments is downloaded once and chopped
+    into a clip per segment. Up to num_workers videos are downloaded and
+    chopped at the same time by a pool of threads, since each download mostly
+    waits on the network. Which clips are already on disk is read once into a
+    ClipIndex rather than checked file by file.
+
+    If a manifest is given, segments it records as chopped or extracted are
+    trusted to be on disk without checking their clips, and segments it
+    records as failed are removed from the audio_dict, unless redo is True.
 
     Args:
         dest_dir: Path to the parent directory where the downloaded videos are
             to be stored.
-        audio_dict: A dictionary with video_id, AudioSetEntry key-value pairs
+        audio_dict: A dictionary with (video_id, start_time), AudioSetEntry
+            key-value pairs
         redo: A boolean of specifying whether to re-download all the YouTube
             videos.
+        num_workers: The number of downloads to keep in flight.
+        fetcher: The fetch backend used to download videos. Defaults to a
+            YoutubeDLFetcher.
+        manifest: An ingest_manifest.IngestManifest recording the state of
+            every segment, or None.
+        sample_rate: The sampling rate of the chopped clips.
+        ranged: Whether to fetch only the window of each segment rather than
+            the whole video, see download_and_chop.
+        failures: The failure_store.FailureStore recording failed downloads.
+            Defaults to the store of dest_dir.
+        clip_index: The ClipIndex of dest_dir. Defaults to a new index.
+        profiler: A profiling.Profiler recording the time of each download
+            and chop, or None.
+        res_type: The resampler of the chopped clips, one of
+            feature_extraction.RES_TYPES.
     """
-    failed_download_set = get_failed_downloads(dest_dir)
-    failed_downloads = []
-    for video_id, entry in audio_dict.items():
-        if video_id in failed_download_set and not redo:
-            failed_downloads.append(video_id)
-            continue
-        success = download(dest_dir, video_id, failed_downloads, redo)
-        start_time = entry.start_time
-        end_time = entry.end_time
-        if success:
-            chop_audio(dest_dir, video_id, start_time, end_time)
-    for video_id in failed_downloads:
-        del audio_dict[video_id]
+    check_dir(dest_dir)
+    check_dir(join(dest_dir, 'yt_videos'))
+    if clip_index is None:
+        clip_index = ClipIndex(dest_dir)
+    with _open_failures(dest_dir, failures) as failures:
+        _download_videos(dest_dir, audio_dict, redo, num_workers, fetcher,
+                         manifest, sample_rate, ranged, failures, clip_index,
+                         profiler, res_type)
     logging.info('{} examples successfully downloaded'.format(len(audio_dict)))
 
 
-def download(dest_dir, video_id, failed_downloads, redo):
+def _download_videos(dest_dir, audio_dict, redo, num_workers, fetcher,
+                     manifest, sample_rate, ranged, failures, clip_index,
+                     profiler, res_type):
+    segments_by_video, _, failed_entries = plan_downloads(
+        dest_dir, audio_dict, redo, manifest, failures)
+    pending = {}
+
+    def record(done):
+        for future in done:
+            video_id = pending.pop(future)
+            available = future.result()
+            failed_entries.extend(entry for entry in
+                                  segments_by_video[video_id]
+                                  if entry not in available)
+
+    with futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        for video_id, entries in segments_by_video.items():
+            if len(pending) >= num_workers:
+                done, _ = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED)
+                record(done)
+            future = executor.submit(download_and_chop, dest_dir, video_id,
+                                     entries, redo, fetcher, manifest,
+                                     sample_rate, ranged, failures,
+                                     clip_index, profiler, res_type)
+            pending[future] = video_id
+        record(futures.as_completed(list(pending)))
+    remove_tmp_dir(dest_dir)
+    for entry in failed_entries:
+        del audio_dict[entry.key]
+
+
+@contextlib.contextmanager
+def _open_failures(dest_dir, failures):
+    """Yields failures, or the failure store of dest_dir, closed on exit."""
+    if failures is not None:
+        yield failures
+        return
+    check_dir(dest_dir)
+    with failure_store.open_store(dest_dir) as store:
+        yield store
+
+
+def plan_downloads(dest_dir, audio_dict, redo, manifest=None, failures=None):
+    """Groups the segments still to be downloaded by their video.
+
+    Unless redo is True, a segment is left out if the failure store blocks
+    its video, if the manifest records it as failed and its video is not due
+    for a retry, and if the manifest records it as chopped or extracted.
+
+    Args:
+        dest_dir: Path to the parent directory where the downloaded videos are
+            to be stored.
+        audio_dict: A dictionary with (video_id, start_time), AudioSetEntry
+            key-value pairs
+        redo: A boolean of specifying whether to re-download all the YouTube
+            videos.
+        manifest: An ingest_manifest.IngestManifest recording the state of
+            every segment, or None.
+        failures: The failure_store.FailureStore of failed downloads.
+            Defaults to the store of dest_dir.
+
+    Returns:
+        A tuple of an ordered dictionary with video_id, list of AudioSetEntry
+        key-value pairs of the videos to download, a list of the entries
+        already chopped, and a list of the entries that failed.
+    """
+    check_dir(dest_dir)
+    check_dir(join(dest_dir, 'yt_videos'))
+    blocked = set()
+    retryable = set()
+    if not redo:
+        with _open_failures(dest_dir, failures) as store:
+            blocked = store.blocked()
+            retryable = store.retryable()
+    states = manifest.states() if manifest is not None and not redo else {}
+    segments_by_video = collections.OrderedDict()
+    chopped_entries = []
+    failed_entries = []
+    for entry in audio_dict.values():
+        state = states.get(entry.clip_id)
+        if (entry.video_id in blocked or
+                (state == ingest_manifest.FAILED and
+                 entry.video_id not in retryable)):
+            failed_entries.append(entry)
+        elif state in (ingest_manifest.CHOPPED, ingest_manifest.EXTRACTED):
+            chopped_entries.append(entry)
+        else:
+            segments_by_video.setdefault(entry.video_id, []).append(entry)
+    return segments_by_video, chopped_entries, failed_entries
+
+
+def remove_tmp_dir(dest_dir):
+    """Removes the tmp directory of dest_dir unless a download is using it.
+
+    Each download writes to its own directory in tmp, see download_and_chop,
+    which may belong to another process sharing dest_dir, so tmp is only
+    removed once it is empty.
+
+    Args:
+        dest_dir: Path to the parent directory where the downloaded videos are
+            stored.
+    """
+    try:
+        os.rmdir(join(dest_dir, 'tmp'))
+    except OSError:
+        pass
+
+
+def download_and_chop(dest_dir, video_id, entries, redo, fetcher=None,
+                      manifest=None,
+                      sample_rate=feature_extraction.SAMPLING_RATE,
+                      ranged=False, failures=None, clip_index=None,
+                      profiler=None, res_type=feature_extraction.RES_TYPE):
+    """Downloads a YouTube video and chops it to its labelled segments.
+
+    The video is only downloaded if the clip of one of its segments is
+    missing, or if redo is True. In ranged mode, the window of each missing
+    segment is fetched on its own instead of the whole video, which is much
+    less to transfer and decode for a long video with a few segments.
+
+    The video is downloaded into a directory of its own in the tmp directory,
+    removed once its segments are chopped, so that concurrent downloads in
+    this or other processes never see each other's files.
+
+    Args:
+        dest_dir: Path to the parent directory where the downloaded videos are
+            to be stored.
+        video_id: the video_id of the YouTube video to be downloaded.
+        entries: A list of the AudioSetEntry objects of the labelled segments
+            of the video.
+        redo: A boolean of specifying whether to re-download all the YouTube
+            videos.
+        fetcher: The fetch backend used to download the video.
+        manifest: An ingest_manifest.IngestManifest to record the state of
+            the segments in, or None.
+        sample_rate: The sampling rate of the chopped clips.
+        ranged: Whether to fetch the window of each segment rather than the
+            whole video.
+        failures: The failure_store.FailureStore recording failed downloads.
+            Defaults to the store of dest_dir.
+        clip_index: The ClipIndex of dest_dir, updated as clips are chopped,
+            or None to check for each clip on disk.
+        profiler: A profiling.Profiler recording the time of each download
+            and chop, or None.
+        res_type: The resampler of the chopped clips, one of
+            feature_extraction.RES_TYPES.
+
+    Returns:
+        A list of the entries whose clip is available, which leaves out only
+        the entries whose download failed. In ranged mode, the segments
+        chopped before a window failed are kept.
+    """
+    # check to see if the segments have already been downloaded and skip the
+    # download if they are already downloaded unless the -r, --redo flag has
+    # been passed
+    missing_entries = []
+    for entry in entries:
+        path = clip_path(dest_dir, entry.clip_id)
+        if clip_index is not None:
+            exists = entry.clip_id in clip_index
+        else:
+            exists = isfile(path)
+        if redo or not exists:
+            missing_entries.append(entry)
+        elif manifest is not None:
+            manifest.set_state([entry.clip_id], ingest_manifest.CHOPPED,
+                               output=path)
+    if not missing_entries:
+        logging.info('Already Downloaded')
+        return list(entries)
+    check_dir(join(dest_dir, 'tmp'))
+    tmp_path = tempfile.mkdtemp(prefix=video_id + '-',
+                                dir=join(dest_dir, 'tmp'))
+    try:
+        failed_entries = _download_and_chop_missing(
+            dest_dir, video_id, missing_entries, tmp_path, fetcher, manifest,
+            sample_rate, ranged, failures, clip_index, profiler, res_type)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return [entry for entry in entries if entry not in failed_entries]
+
+
+def _download_and_chop_missing(dest_dir, video_id, missing_entries, tmp_path,
+                               fetcher, manifest, sample_rate, ranged,
+                               failures, clip_index, profiler, res_type):
+    """Downloads a video into tmp_path and chops its missing segments.
+
+    Returns:
+        A list of the missing entries whose download failed, which are
+        marked as failed in the manifest.
+    """
+
+    def chopped(entry, path):
+        if path is None:
+            return
+        if clip_index is not None:
+            clip_index.add(entry.clip_id)
+        if manifest is not None:
+            manifest.set_state([entry.clip_id], ingest_manifest.CHOPPED,
+                               output=path)
+
+    def failed(failed_entries):
+        if failed_entries and manifest is not None:
+            manifest.set_state([entry.clip_id for entry in failed_entries],
+                               ingest_manifest.FAILED,
+                               error='download failed')
+        return failed_entries
+
+    failed_downloads = []
+    missing_clip_ids = [entry.clip_id for entry in missing_entries]
+    if ranged:
+        for i, entry in enumerate(missing_entries):
+            with profiling.timer(profiler, 'download', entry.clip_id):
+                source_offset = download_range(
+                    dest_dir, video_id, entry.start_time, entry.end_time,
+                    failed_downloads, fetcher, failures, tmp_path)
+            if source_offset is None:
+                # The windows after a failed one are not attempted, as the
+                # video is recorded as failed.
+                return failed(missing_entries[i:])
+            if manifest is not None:
+                manifest.set_state([entry.clip_id],
+                                   ingest_manifest.DOWNLOADED)
+            with profiling.timer(profiler, 'chop', entry.clip_id):
+                path = chop_audio(dest_dir, video_id, entry.start_time,
+                                  entry.end_time, sample_rate=sample_rate,
+                                  source_offset=source_offset,
+                                  tmp_path=tmp_path, res_type=res_type)
+            chopped(entry, path)
+        return []
+    with profiling.timer(profiler, 'download', missing_clip_ids):
+        downloaded = download(dest_dir, video_id, failed_downloads, fetcher,
+                              failures, tmp_path)
+    if downloaded:
+        if manifest is not None:
+            manifest.set_state(missing_clip_ids, ingest_manifest.DOWNLOADED)
+        for i, entry in enumerate(missing_entries):
+            with profiling.timer(profiler, 'chop', entry.clip_id):
+                path = chop_audio(
+                    dest_dir, video_id, entry.start_time, entry.end_time,
+                    remove_source=(i == len(missing_entries) - 1),
+                    sample_rate=sample_rate, tmp_path=tmp_path,
+                    res_type=res_type)
+            chopped(entry, path)
+        return []
+    return failed(missing_entries)
+
+
+def download(dest_dir, video_id, failed_downloads, fetcher=None,
+             failures=None, tmp_path=None):
     """Downloads a YouTube video using its video_id
 
-    Calls the youtube-dl tool to download a YouTube video by its video_id and
-    convert the video into an audio file. If the download is successful,
-    it stores the video_id in a list, downloaded_video.
+    Calls the fetch backend to download a YouTube video by its video_id and
+    convert the video into an audio file in the tmp directory. A transient
+    failure is retried after its backoff if the backoff is short enough, see
+    failure_store. If the download fails, it stores the video_id in a list,
+    failed_downloads.
 
     Args:
         dest_dir: Path to the parent directory where the downloaded videos are
@@ -59,50 +678,108 @@ def download(dest_dir, video_id, failed_downloads, redo):
         video_id: the video_id of the YouTube video to be downloaded.
         failed_downloads: a list where failed downloaded YouTube videos'
             video_id will be stored.
-        redo: A boolean of specifying whether to re-download all the YouTube
-            videos.
+        fetcher: The fetch backend used to download the video. Defaults to a
+            YoutubeDLFetcher.
+        failures: The failure_store.FailureStore recording failed downloads.
+            Defaults to the store of dest_dir.
+        tmp_path: Path to the directory to download into. Defaults to the tmp
+            directory of dest_dir.
 
     Returns:
-        A boolean of whether the download was successful or not. Returns false
-        if the video was already downloaded and redo is False.
+        A boolean of whether the download was successful or not.
     """
     check_dir(dest_dir)
-    # check to see if the video_id has already been downloaded and skip the
-    # download if it is already downloaded unless the -r, --redo flag has been
-    # passed
-    video_path = join(dest_dir, 'yt_videos', 'sliced_' + video_id + '.wav')
-    already_downloaded = isfile(video_path)
-    if already_downloaded and not redo:
-        logging.info('Already Downloaded')
-        return False
-
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredquality': '192',
-        }],
-        # Force the file naming of outputs.
-        'outtmpl': join(dest_dir, 'tmp', video_id + '.%(ext)s')
-    }
+    if fetcher is None:
+        fetcher = YoutubeDLFetcher()
+    if tmp_path is None:
+        tmp_path = join(dest_dir, 'tmp')
+    os.makedirs(tmp_path, exist_ok=True)
     print('downloading video')
-    with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-        try:
-            ydl.download(['https://www.youtube.com/watch?v=' + video_id])
-            logging.info('Download Complete')
-            return True
-        except youtube_dl.DownloadError:
-            store_failed_download(dest_dir, video_id)
-            failed_downloads.append(video_id)
-            logging.info('Downloading Failed.')
-            return False
+    succeeded, _ = _fetch_with_retries(
+        lambda: fetcher.fetch(video_id, tmp_path), dest_dir, video_id,
+        failed_downloads, failures)
+    return succeeded
+
+
+def download_range(dest_dir, video_id, start_time, end_time, failed_downloads,
+                   fetcher=None, failures=None, tmp_path=None):
+    """Downloads a window of a YouTube video using its video_id.
+
+    Like download, but calls the fetch_range method of the fetch backend to
+    only download the audio between start_time and end_time.
+
+    Args:
+        dest_dir: Path to the parent directory where the downloaded videos are
+            to be stored.
+        video_id: the video_id of the YouTube video to be downloaded.
+        start_time: The start time in seconds of the window.
+        end_time: The end time in seconds of the window.
+        failed_downloads: a list where failed downloaded YouTube videos'
+            video_id will be stored.
+        fetcher: The fetch backend used to download the window. Defaults to a
+            YoutubeDLFetcher.
+        failures: The failure_store.FailureStore recording failed downloads.
+            Defaults to the store of dest_dir.
+        tmp_path: Path to the directory to download into. Defaults to the tmp
+            directory of dest_dir.
+
+    Returns:
+        The time in seconds in the video at which the downloaded audio file
+        starts, or None if the download failed.
+    """
+    if fetcher is None:
+        fetcher = YoutubeDLFetcher()
+    if tmp_path is None:
+        tmp_path = join(dest_dir, 'tmp')
+    os.makedirs(tmp_path, exist_ok=True)
+    _, source_offset = _fetch_with_retries(
+        lambda: fetcher.fetch_range(video_id, tmp_path, start_time, end_time),
+        dest_dir, video_id, failed_downloads, failures)
+    return source_offset
+
+
+def _fetch_with_retries(fetch, dest_dir, video_id, failed_downloads,
+                        failures):
+    """Calls fetch, retrying transient failures with exponential backoff.
+
+    Every failure is recorded in the failure store, which tells how long to
+    wait before retrying. Backoffs longer than its max_inline_delay, and
+    permanent failures, end the attempts of this run.
+
+    Returns:
+        A tuple of a boolean of whether the fetch succeeded and the value it
+        returned.
+    """
+    with _open_failures(dest_dir, failures) as failures:
+        while True:
+            try:
+                result = fetch()
+            except DownloadError as error:
+                delay = failures.record_failure(video_id, error)
+                if delay is None or delay > failures.max_inline_delay:
+                    failed_downloads.append(video_id)
+                    logging.info('Downloading Failed.')
+                    return False, None
+                logging.info('Retrying {} in {} seconds: {}'.format(
+                    video_id, delay, error))
+                time.sleep(delay)
+            else:
+                failures.record_success(video_id)
+                logging.info('Download Complete')
+                return True, result
 
 
-def chop_audio(dest_dir, video_id, start_time, end_time):
+def chop_audio(dest_dir, video_id, start_time, end_time, remove_source=True,
+               sample_rate=feature_extraction.SAMPLING_RATE,
+               source_offset=0.0, tmp_path=None,
+               res_type=feature_extraction.RES_TYPE):
     """Chops an audio file into a segment by a given start_time and end_time.
 
-    Using a specific start_time and end_time in seconds, it chops the audio file
-    from the downloaded YouTube video, and then removes the original audio file.
+    Using a specific start_time and end_time in seconds, it cuts the clip of
+    the labelled segment out of the audio file from the downloaded YouTube
+    video, and then removes the original audio file unless remove_source is
+    False. The directory it was downloaded to is left in place. See
+    extract_segment for how the clip is decoded.
 
     Args:
         dest_dir: Path to the parent directory where the downloaded videos are
@@ -110,72 +787,143 @@ def chop_audio(dest_dir, video_id, start_time, end_time):
         video_id: The video_id of the audio from the downloaded YouTube video.
         start_time: The start time in seconds of the labelled video segment.
         end_time: The end time in seconds of the labelled video segment.
+        remove_source: Whether to remove the downloaded audio file, which
+            should only be kept while other segments are still to be chopped
+            from it.
+        sample_rate: The sampling rate of the clip.
+        source_offset: The time in seconds in the video at which the audio
+            file starts, which is not 0 if only a window was downloaded.
+        tmp_path: Path to the directory the video was downloaded to.
+            Defaults to the tmp directory of dest_dir.
+        res_type: The resampler of the clip, one of
+            feature_extraction.RES_TYPES.
+
+    Returns:
+        The path of the clip, or None if there was no audio file to chop or
+        it could not be decoded.
     """
-    tmp_path = join(dest_dir, 'tmp')
-    if isdir(tmp_path):
-        length = len(listdir(tmp_path))
-        m4a_path = join(tmp_path, video_id + '.m4a')
-        opus_path = join(tmp_path, video_id + '.opus')
-        ogg_path = join(tmp_path, video_id + '.ogg')
-        wav_path = join(dest_dir, 'yt_videos', 'sliced_' + video_id + '.wav')
-        if isfile(m4a_path):
-            video = AudioSegment.from_file(m4a_path)
-            temp_path = m4a_path
-        elif isfile(opus_path):
-            video = AudioSegment.from_file(opus_path)
-            temp_path = opus_path
-        elif isfile(ogg_path):
-            video = AudioSegment.from_file(ogg_path)
-            temp_path = ogg_path
-        else:
-            if length == 0:
-                shutil.rmtree(tmp_path)
-            return None
-        sliced = video[start_time * 1000: end_time * 1000]
-        sliced.export(wav_path, format='wav')
+    if tmp_path is None:
+        tmp_path = join(dest_dir, 'tmp')
+    temp_path = _find_download(tmp_path, video_id)
+    if temp_path is None:
+        return None
+    wav_path = clip_path(dest_dir, clip_id(video_id, start_time))
+    try:
+        extract_segment(temp_path, wav_path, start_time - source_offset,
+                        end_time - source_offset, sample_rate, res_type)
+    except (RuntimeError, OSError, subprocess.CalledProcessError) as error:
+        logging.error('Failed to chop {}: {}'.format(temp_path, error))
+        wav_path = None
+    if remove_source:
         os.remove(temp_path)
-        if length <= 1:
-            shutil.rmtree(tmp_path)
-        logging.info('chopped_audio')
+    logging.info('chopped_audio')
+    return wav_path
+
+
+def _find_download(tmp_path, video_id):
+    """Returns the path of the audio file of a video in tmp_path, or None."""
+    if not isdir(tmp_path):
+        return None
+    names = set(os.listdir(tmp_path))
+    for extension in AUDIO_EXTENSIONS:
+        name = video_id + '.' + extension
+        if name in names:
+            return join(tmp_path, name)
+    return None
+
+
+def extract_segment(src_path, wav_path, start_time, end_time, sample_rate,
+                    res_type=feature_extraction.RES_TYPE):
+    """Decodes a segment of an audio file into a mono 16-bit PCM wav file.
+
+    Only the frames between start_time and end_time are decoded. Formats
+    libsndfile can seek in, such as wav, flac and ogg, are read directly and
+    resampled to sample_rate with res_type. Others, such as m4a and opus,
+    are cut by ffmpeg, which seeks in the input before decoding and
+    resamples in the same pass.
+    The clip is written to a temporary file renamed into place, so that a
+    clip on disk is always complete.
+
+    Args:
+        src_path: Path to the audio file.
+        wav_path: Path to the wav file to write.
+        start_time: The start time in seconds of the segment.
+        end_time: The end time in seconds of the segment.
+        sample_rate: The sampling rate of the wav file.
+        res_type: The resampler, one of feature_extraction.RES_TYPES, of
+            the formats read by libsndfile.
+
+    Raises:
+        RuntimeError: libsndfile could not write the clip.
+        OSError: ffmpeg is not installed.
+        subprocess.CalledProcessError: ffmpeg could not decode the file.
+    """
+    tmp_wav_path = wav_path + '.part'
+    try:
+        try:
+            with soundfile.SoundFile(src_path) as audio_file:
+                source_rate = audio_file.samplerate
+                audio_file.seek(min(int(start_time * source_rate),
+                                    audio_file.frames))
+                audio = audio_file.read(
+                    int((end_time - start_time) * source_rate),
+                    dtype='float32', always_2d=True)
+        except soundfile.LibsndfileError:
+            _ffmpeg_segment(src_path, tmp_wav_path, start_time, end_time,
+                            sample_rate)
+        else:
+            audio = np.mean(audio, axis=1)
+            if source_rate != sample_rate:
+                audio = librosa.resample(audio, orig_sr=source_rate,
+                                         target_sr=sample_rate,
+                                         res_type=res_type)
+            soundfile.write(tmp_wav_path, audio, sample_rate,
+                            subtype='PCM_16', format='WAV')
+        os.replace(tmp_wav_path, wav_path)
+    finally:
+        if isfile(tmp_wav_path):
+            os.remove(tmp_wav_path)
+
+
+def _ffmpeg_segment(src_path, wav_path, start_time, end_time, sample_rate):
+    # -ss before -i seeks in the input rather than decoding up to start_time.
+    subprocess.run(
+        ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+         '-ss', str(start_time), '-t', str(end_time - start_time),
+         '-i', src_path, '-vn', '-ac', '1', '-ar', str(sample_rate),
+         '-c:a', 'pcm_s16le', '-f', 'wav', wav_path],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
 
 
 def get_failed_downloads(dest_dir):
-    """Converts file with a list of video_ids that failed to download to a set.
+    """Returns the set of video_ids that are not to be downloaded now.
 
-    Reads through a failed_downloads.txt and converts the list of videos_ids of
-    YouTube videos that failed to download into a set.
+    Queries the failure store of dest_dir for the YouTube videos that failed to
+    download permanently, or whose retry is not yet due.
 
     Args:
-        dest_dir: Path to a directory where the failed_downloads.txt is expected
+        dest_dir: Path to a directory where the failure store is expected
             to be
 
     Returns:
         A set of video_ids that failed to download.
     """
-    check_dir(dest_dir)
-    failed_download_set = set()
-    path = join(dest_dir, 'failed_downloads.txt')
-    if isfile(path):
-        with open(path, 'r') as file:
-            for line in file:
-                video_id = line.strip()
-                failed_download_set.add(video_id)
-    return failed_download_set
-
+    with _open_failures(dest_dir, None) as failures:
+        return failures.blocked()
 
-def store_failed_download(dest_dir, video_id):
-    """Stores the video_id of a YouTube video that failed to download in a file.
 
-    Finds or creates a text file dubbed failed_downloads.txt and writes a line
-    containing the video_id of a YouTube video that failed to download.
+def store_failed_download(dest_dir, video_id, error):
+    """Records a failed download of a YouTube video in the failure store.
 
     Args:
-        dest_dir: Path to a directory where the failed_downloads.txt is expected
+        dest_dir: Path to a directory where the failure store is expected
             to be.
         video_id: The video_id of a YouTube video that failed to download.
+        error: The DownloadError the download failed with.
+
+    Returns:
+        The number of seconds until the download may be retried, or None
+        if it is not to be retried.
     """
-    check_dir(dest_dir)
-    path = join(dest_dir, 'failed_downloads.txt')
-    with open(path, "a") as file:
-        file.write(video_id)
-        file.write('\n')
+    with _open_failures(dest_dir, None) as failures:
+        return failures.record_failure(video_id, error)
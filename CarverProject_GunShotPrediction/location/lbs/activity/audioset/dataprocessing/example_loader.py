@@ -0,0 +1,262 @@
+"""Iterates over shuffled, fixed-size batches of the examples of an ingestion.
+
+ExampleLoader reads the output audio_processing.py writes with
+--output_format=shards or feature_store, and yields batches of stacked numpy
+arrays for training, without ever loading the whole dataset:
+
+1. The output is split into chunks: a shard of examples, or a run of
+   consecutive examples of a feature store, which is read sequentially.
+   The chunks are visited in a new random order every epoch.
+2. A pool of threads reads and decodes chunks ahead of the training loop,
+   at most prefetch_chunks at a time, copying each example out of its shard
+   or memory-mapped store.
+3. Examples pass through a shuffle buffer, which emits a random example of
+   the last shuffle_buffer ones read, so that examples of a chunk are spread
+   across batches.
+4. Examples are stacked into batches of batch_size. Features whose number of
+   frames varies between clips are padded with zeros or trimmed to
+   num_frames.
+
+At most shuffle_buffer + (prefetch_chunks + 1) * chunk examples are held in
+memory at a time, whatever the size of the dataset. Examples missing a
+feature are skipped.
+
+Typical usage example:
+
+loader = ExampleLoader('examples', ['mfcc'], batch_size=64, num_frames=431,
+                       num_epochs=None, seed=0)
+for batch, labels in loader:
+    model.train_on_batch(batch['mfcc'], labels)
+"""
+import collections
+from concurrent import futures
+from os.path import isfile, join
+import numpy as np
+import pandas as pd
+import feature_store
+import sharded_output
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_SHUFFLE_BUFFER = 1024
+DEFAULT_NUM_WORKERS = 4
+DEFAULT_PREFETCH_CHUNKS = 8
+# The number of consecutive examples of a feature store read as a chunk.
+DEFAULT_CHUNK_SIZE = 64
+
+
+class ExampleLoader:
+    """Iterates over batches of the examples of an ingestion output.
+
+    Every iteration starts over, from the same seed.
+
+    Attributes:
+        output_dir: Path to the directory of the shards or feature store.
+        features: The names of the features of each batch.
+        batch_size: The number of examples of each batch.
+        shuffle_buffer: The number of examples shuffled together. With 1 or
+            less, examples are neither shuffled nor are chunks.
+        num_frames: The number of frames every feature is padded or trimmed
+            to, or None to stack features as they are, which requires them
+            to have the same shape in every example.
+        drop_remainder: Whether to drop the last batch of an iteration if it
+            has fewer than batch_size examples.
+        num_epochs: The number of passes over the examples, or None to
+            repeat them forever.
+        seed: The seed of the shuffling, or None for a random seed.
+        num_workers: The number of threads reading chunks.
+        prefetch_chunks: The number of chunks read ahead of the batches.
+    """
+
+    def __init__(self, output_dir, features=None,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 shuffle_buffer=DEFAULT_SHUFFLE_BUFFER, num_frames=None,
+                 drop_remainder=True, num_epochs=1, seed=None,
+                 num_workers=DEFAULT_NUM_WORKERS,
+                 prefetch_chunks=DEFAULT_PREFETCH_CHUNKS,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        """Inits ExampleLoader, detecting the format of output_dir.
+
+        Args:
+            chunk_size: The number of consecutive examples of a feature
+                store read as a chunk. A chunk of shards is a shard.
+
+        Raises:
+            ValueError: output_dir holds neither shards nor a feature store,
+                or a feature is not in it.
+        """
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.shuffle_buffer = shuffle_buffer
+        self.num_frames = num_frames
+        self.drop_remainder = drop_remainder
+        self.num_epochs = num_epochs
+        self.seed = seed
+        self.num_workers = num_workers
+        self.prefetch_chunks = prefetch_chunks
+        if isfile(join(output_dir, feature_store.META_FILENAME)):
+            self._store = feature_store.FeatureStore(output_dir)
+            available_features = self._store.features
+            num_examples = len(self._store)
+            self._chunks = [range(start, min(start + chunk_size,
+                                             num_examples))
+                            for start in range(0, num_examples, chunk_size)]
+        elif isfile(join(output_dir, sharded_output.INDEX_FILENAME)):
+            self._store = None
+            self._chunks = sharded_output.shard_paths(output_dir)
+            available_features = []
+            if self._chunks:
+                available_features = list(
+                    pd.read_pickle(self._chunks[0]).columns[1:])
+        else:
+            raise ValueError('{} holds neither shards nor a feature '
+                             'store'.format(output_dir))
+        if features is None:
+            features = available_features
+        elif self._chunks:
+            missing = [feature for feature in features
+                       if feature not in available_features]
+            if missing:
+                raise ValueError('{} holds no {}'.format(
+                    output_dir, ', '.join(missing)))
+        self.features = list(features)
+
+    def __iter__(self):
+        """Yields batches of examples.
+
+        Yields:
+            A tuple of a dictionary with feature name, float32 numpy array of
+            shape [batch_size, ...] key-value pairs, and an int8 numpy array
+            of the labels.
+
+        Raises:
+            ValueError: A feature has different shapes in the examples of a
+                batch, and num_frames is None.
+        """
+        rng = np.random.default_rng(self.seed)
+        examples = self._read_chunks(self._chunk_order(rng))
+        if self.shuffle_buffer > 1:
+            examples = shuffle(examples, self.shuffle_buffer, rng)
+        batch = []
+        for example in examples:
+            batch.append(example)
+            if len(batch) == self.batch_size:
+                yield self._stack(batch)
+                batch = []
+        if batch and not self.drop_remainder:
+            yield self._stack(batch)
+
+    def _chunk_order(self, rng):
+        epoch = 0
+        while self._chunks and (self.num_epochs is None or
+                                epoch < self.num_epochs):
+            order = np.arange(len(self._chunks))
+            if self.shuffle_buffer > 1:
+                rng.shuffle(order)
+            for i in order:
+                yield self._chunks[i]
+            epoch += 1
+
+    def _read_chunks(self, chunks):
+        """Reads chunks in a thread pool, in order, prefetch_chunks ahead.
+
+        Yields:
+            A tuple of the label and the list of features of each example.
+        """
+        pending = collections.deque()
+        with futures.ThreadPoolExecutor(
+                max_workers=self.num_workers) as executor:
+            try:
+                while True:
+                    while len(pending) < self.prefetch_chunks:
+                        chunk = next(chunks, None)
+                        if chunk is None:
+                            break
+                        pending.append(executor.submit(self._read_chunk,
+                                                       chunk))
+                    if not pending:
+                        return
+                    yield from pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _read_chunk(self, chunk):
+        """Reads and decodes the complete examples of a chunk."""
+        if self._store is not None:
+            rows = ((self._store.labels[i],
+                     [self._store.get(feature, i)
+                      for feature in self.features]) for i in chunk)
+        else:
+            shard = pd.read_pickle(chunk)
+            rows = zip(shard['label'].tolist(),
+                       zip(*[shard[feature].tolist()
+                             for feature in self.features]))
+        examples = []
+        for label, extracted_features in rows:
+            if not all(isinstance(extracted_feature, np.ndarray) and
+                       extracted_feature.size
+                       for extracted_feature in extracted_features):
+                continue
+            examples.append((label, [
+                fit_frames(extracted_feature, self.num_frames)
+                for extracted_feature in extracted_features]))
+        return examples
+
+    def _stack(self, batch):
+        stacked = {}
+        for i, feature in enumerate(self.features):
+            try:
+                stacked[feature] = np.stack(
+                    [extracted_features[i] for _, extracted_features
+                     in batch])
+            except ValueError:
+                raise ValueError('{} has different shapes in a batch, see '
+                                 'num_frames'.format(feature))
+        labels = np.array([label for label, _ in batch], dtype=np.int8)
+        return stacked, labels
+
+
+def shuffle(items, buffer_size, rng):
+    """Shuffles a stream of items through a buffer of bounded size.
+
+    Once the buffer is full, each new item replaces a random item of the
+    buffer, which is yielded, and the buffer is yielded in random order once
+    the items run out.
+
+    Args:
+        items: An iterable of items.
+        buffer_size: The number of items in the buffer.
+        rng: A numpy.random.Generator.
+
+    Yields:
+        The items, in a random order.
+    """
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        i = rng.integers(buffer_size)
+        yield buffer[i]
+        buffer[i] = item
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def fit_frames(feature, num_frames=None):
+    """Copies a feature to float32, padding or trimming its frames.
+
+    Args:
+        feature: A numpy array whose last axis is its frames.
+        num_frames: The number of frames to pad with zeros or trim to, or
+            None to keep the frames of the feature.
+
+    Returns:
+        A float32 numpy array that shares no memory with feature.
+    """
+    if num_frames is None:
+        return np.array(feature, dtype=np.float32)
+    fitted = np.zeros(feature.shape[:-1] + (num_frames,), dtype=np.float32)
+    num_kept = min(num_frames, feature.shape[-1])
+    fitted[..., :num_kept] = feature[..., :num_kept]
+    return fitted
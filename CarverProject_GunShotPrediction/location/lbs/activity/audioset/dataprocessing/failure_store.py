@@ -0,0 +1,250 @@
+"""Indexed store of failed downloads, with their reasons and retry schedule.
+
+The store is a SQLite database in dest_dir with a row per video whose last
+download failed, keyed by its video_id, holding the class of the error, the
+number of attempts, and when the download may next be retried.
+
+Errors are classified from their message. A video that is private, removed,
+blocked on copyright grounds, or otherwise unavailable is a permanent failure
+and never retried. Any other error, such as a timeout or a rate limit, is
+transient, and the video is retried after an exponential backoff of
+base_delay * 2 ** (attempts - 1) seconds, capped at max_delay, until
+max_attempts attempts have failed. Short backoffs are waited out by the
+downloader in the same run, longer ones are left to a later run.
+
+Typical usage example:
+
+with open_store(dest_dir) as failures:
+    skipped_video_ids = failures.blocked()
+    delay = failures.record_failure('VIDEO_ID', error)
+"""
+import os
+from os.path import isfile, join
+import sqlite3
+import threading
+import time
+
+FAILURES_FILENAME = 'failures.sqlite'
+# The list of failed video_ids kept by earlier versions, imported on opening.
+LEGACY_FILENAME = 'failed_downloads.txt'
+
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 7 * 24 * 3600.0
+DEFAULT_MAX_ATTEMPTS = 10
+# Backoffs up to this many seconds are waited out by the downloader in the
+# same run rather than left to the next one.
+DEFAULT_MAX_INLINE_DELAY = 8.0
+
+# Error classes of permanent failures, each with the lowercase fragments of
+# the youtube-dl error messages that identify it.
+PERMANENT_ERRORS = (
+    ('private', ('private video',)),
+    ('removed', ('has been removed', 'has been terminated',
+                 'no longer available')),
+    ('copyright', ('copyright',)),
+    ('age_restricted', ('confirm your age', 'age-restricted')),
+    ('unavailable', ('video unavailable', 'this video is unavailable',
+                     'not available in your country',
+                     'not made this video available')),
+)
+RATE_LIMITED_ERRORS = ('http error 429', 'too many requests')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS failures (
+    video_id TEXT PRIMARY KEY,
+    error_class TEXT NOT NULL,
+    message TEXT,
+    permanent INTEGER NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_attempt REAL NOT NULL,
+    next_retry REAL
+);
+CREATE INDEX IF NOT EXISTS failures_by_next_retry ON failures (next_retry);
+"""
+
+
+def classify_error(error):
+    """Returns the error class of a failed download and if it is permanent.
+
+    Args:
+        error: The exception raised by the fetch backend, whose permanent
+            attribute, if not None, overrides the classification by message.
+
+    Returns:
+        A tuple of the error class and a boolean of whether it is permanent.
+    """
+    message = str(error).lower()
+    permanent = getattr(error, 'permanent', None)
+    for error_class, fragments in PERMANENT_ERRORS:
+        if any(fragment in message for fragment in fragments):
+            return error_class, permanent is not False
+    if permanent:
+        return 'not_found', True
+    if any(fragment in message for fragment in RATE_LIMITED_ERRORS):
+        return 'rate_limited', False
+    return 'transient', False
+
+
+class FailureStore:
+    """SQLite store of failed downloads, safe for concurrent writers.
+
+    Safe to share between the threads of a process, and between processes,
+    which wait on each other's transactions.
+
+    Attributes:
+        path: Path to the SQLite database.
+        base_delay: The backoff in seconds after the first transient failure.
+        max_delay: The longest backoff in seconds.
+        max_attempts: The number of failed attempts after which a video is no
+            longer retried.
+        max_inline_delay: The longest backoff in seconds waited out in the
+            same run.
+    """
+
+    def __init__(self, path, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 max_inline_delay=DEFAULT_MAX_INLINE_DELAY):
+        """Opens the store at path, creating it if it does not exist."""
+        self.path = path
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.max_inline_delay = max_inline_delay
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60,
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the database."""
+        with self._lock:
+            self._connection.close()
+
+    def record_failure(self, video_id, error, now=None):
+        """Records a failed download attempt and schedules its retry.
+
+        Args:
+            video_id: The video_id of the video that failed to download.
+            error: The exception raised by the fetch backend.
+            now: The time of the attempt in seconds since the epoch, defaults
+                to the current time.
+
+        Returns:
+            The number of seconds until the download may be retried, or None
+            if it is not to be retried.
+        """
+        now = time.time() if now is None else now
+        error_class, permanent = classify_error(error)
+        with self._lock, self._connection:
+            # Takes the write lock before reading the attempts, so that no
+            # other process records an attempt in between.
+            self._connection.execute('BEGIN IMMEDIATE')
+            row = self._connection.execute(
+                'SELECT attempts FROM failures WHERE video_id = ?',
+                (video_id,)).fetchone()
+            attempts = 1 if row is None else row[0] + 1
+            delay = None
+            if not permanent and attempts < self.max_attempts:
+                delay = min(self.base_delay * 2 ** (attempts - 1),
+                            self.max_delay)
+            self._connection.execute(
+                'INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (video_id, error_class, str(error), int(delay is None),
+                 attempts, now, None if delay is None else now + delay))
+        return delay
+
+    def record_success(self, video_id):
+        """Forgets the failures of a video that has now been downloaded."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                'DELETE FROM failures WHERE video_id = ?', (video_id,))
+
+    def get(self, video_id):
+        """Returns the failure record of a video as a dictionary, or None."""
+        with self._lock:
+            cursor = self._connection.execute(
+                'SELECT * FROM failures WHERE video_id = ?', (video_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description],
+                            row))
+
+    def blocked(self, now=None):
+        """Returns the set of video_ids not to be downloaded at a time.
+
+        Args:
+            now: The time in seconds since the epoch, defaults to the current
+                time.
+
+        Returns:
+            The video_ids of permanent failures and of transient failures
+            whose backoff has not expired.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            return {video_id for video_id, in self._connection.execute(
+                'SELECT video_id FROM failures '
+                'WHERE permanent = 1 OR next_retry > ?', (now,))}
+
+    def retryable(self, now=None):
+        """Returns the set of video_ids of failures due for a retry.
+
+        Args:
+            now: The time in seconds since the epoch, defaults to the current
+                time.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            return {video_id for video_id, in self._connection.execute(
+                'SELECT video_id FROM failures '
+                'WHERE permanent = 0 AND next_retry <= ?', (now,))}
+
+    def import_legacy(self, path, now=None):
+        """Imports a list of failed video_ids kept by earlier versions.
+
+        The reason of these failures is unknown, so each is retried once to
+        classify it. The file is renamed with a .migrated suffix so that it
+        is only imported once.
+
+        Args:
+            path: Path to a text file with a video_id per line.
+            now: The time in seconds since the epoch, defaults to the current
+                time.
+        """
+        now = time.time() if now is None else now
+        with open(path) as file:
+            video_ids = {line.strip() for line in file if line.strip()}
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO failures VALUES '
+                '(?, \'legacy\', NULL, 0, 1, ?, ?)',
+                ((video_id, now, now) for video_id in video_ids))
+        os.replace(path, path + '.migrated')
+
+
+def open_store(dest_dir, **kwargs):
+    """Opens the failure store of a dest_dir, importing any legacy list.
+
+    Args:
+        dest_dir: Path to the directory of the store.
+        **kwargs: The backoff parameters of FailureStore.
+
+    Returns:
+        A FailureStore.
+    """
+    store = FailureStore(join(dest_dir, FAILURES_FILENAME), **kwargs)
+    legacy_path = join(dest_dir, LEGACY_FILENAME)
+    if isfile(legacy_path):
+        store.import_legacy(legacy_path)
+    return store
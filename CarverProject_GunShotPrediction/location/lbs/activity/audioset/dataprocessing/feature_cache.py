@@ -0,0 +1,168 @@
+"""On-disk cache of extracted features, keyed by the content of each clip.
+
+Each cached feature is stored as a .npy file named after a hash of the clip's
+content hash, the feature name, and the parameters the feature was extracted
+with, including the version of Librosa. A clip that is downloaded again, or a
+change to the extraction parameters, therefore never returns a stale feature.
+
+The cache is bounded by a size cap. Reading a feature marks it as recently
+used, and once the cap is exceeded the least recently used features are
+evicted until the cache is back under 90% of the cap. Each process scans the
+cache directory for its size once, and then keeps an estimate updated by its
+own writes and evictions, shared by every FeatureCache of the directory in
+the process, such as the copies unpickled from the jobs of a worker.
+
+Typical usage example:
+
+cache = FeatureCache('/tmp/feature_cache', max_bytes=10 * 2 ** 30)
+content_hash = hash_file('sliced_VIDEO_ID.wav')
+mfcc = cache.get(content_hash, 'mfcc', params)
+if mfcc is None:
+    mfcc = ...
+    cache.put(content_hash, 'mfcc', params, mfcc)
+"""
+import hashlib
+import json
+import os
+from os.path import join
+import tempfile
+import threading
+from absl import logging
+import numpy as np
+
+DEFAULT_MAX_BYTES = 10 * 2 ** 30
+# Fraction of the size cap that eviction brings the cache down to, so that
+# evictions do not happen on every write once the cache is full.
+_EVICTION_TARGET = 0.9
+_READ_SIZE = 2 ** 20
+
+# The estimated size in bytes of each cache directory in this process, by
+# its absolute path.
+_sizes = {}
+_sizes_lock = threading.Lock()
+
+
+def hash_file(path):
+    """Returns the SHA-1 hex digest of the content of a file.
+
+    Args:
+        path: Path to the file.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(_READ_SIZE), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class FeatureCache:
+    """Size-capped, least recently used cache of features on disk.
+
+    Safe to share between processes: features are written to a temporary file
+    and renamed into place, and each process evicts based on the files it
+    finds on disk.
+
+    Attributes:
+        cache_dir: Path to the directory holding the cached features.
+        max_bytes: The size cap of the cache in bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        """Inits FeatureCache, creating cache_dir if it does not exist."""
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, content_hash, feature, params):
+        key = json.dumps([content_hash, feature, params], sort_keys=True)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return join(self.cache_dir, digest[:2], digest + '.npy')
+
+    def get(self, content_hash, feature, params):
+        """Returns a cached feature, or None if it is not cached.
+
+        Args:
+            content_hash: The hash of the content of the clip.
+            feature: The name of the feature.
+            params: A dictionary of the parameters the feature was extracted
+                with.
+        """
+        path = self._path(content_hash, feature, params)
+        try:
+            extracted_feature = np.load(path)
+        except (IOError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return extracted_feature
+
+    def put(self, content_hash, feature, params, extracted_feature):
+        """Stores a feature in the cache, evicting features if it is full.
+
+        Args:
+            content_hash: The hash of the content of the clip.
+            feature: The name of the feature.
+            params: A dictionary of the parameters the feature was extracted
+                with.
+            extracted_feature: A numpy array holding the feature.
+        """
+        path = self._path(content_hash, feature, params)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                np.save(file, extracted_feature)
+            try:
+                replaced_size = os.path.getsize(path)
+            except OSError:
+                replaced_size = 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        key = os.path.abspath(self.cache_dir)
+        with _sizes_lock:
+            if key not in _sizes:
+                _sizes[key] = self._scan_size()
+            else:
+                _sizes[key] += os.path.getsize(path) - replaced_size
+            full = _sizes[key] > self.max_bytes
+        if full:
+            self.evict()
+
+    def _entries(self):
+        for subdir in os.scandir(self.cache_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith('.npy'):
+                    yield entry
+
+    def _scan_size(self):
+        return sum(entry.stat().st_size for entry in self._entries())
+
+    def evict(self):
+        """Removes the least recently used features until under the cap."""
+        target_bytes = self.max_bytes * _EVICTION_TARGET
+        entries = []
+        for entry in self._entries():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        evicted = 0
+        for _, entry_size, path in entries:
+            if size <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+            evicted += 1
+        with _sizes_lock:
+            _sizes[os.path.abspath(self.cache_dir)] = size
+        logging.info('Evicted {} features from the cache'.format(evicted))
@@ -0,0 +1,258 @@
+"""Columnar, memory-mapped store of extracted features and labels.
+
+Each feature is written as one contiguous file of float32 values, holding the
+features of every example back to back, along with an index of the offset and
+shape of each example's array. Labels and clip_ids are stored as separate
+columns. A FeatureStore opens these files with np.memmap, so reading an
+example is a zero-copy view into the file, and random batches can be read
+without deserializing the whole dataset.
+
+merge_stores concatenates the stores written by several runs, such as the
+shards of a dataset ingested on several machines, into one.
+
+Store layout:
+STORE_DIR/meta.json           feature names, number of examples
+STORE_DIR/clip_ids.txt        one clip_id per line
+STORE_DIR/labels.i1           int8 labels
+STORE_DIR/FEATURE.f32         float32 values of every example
+STORE_DIR/FEATURE.index.i8    int64 rows of offset followed by the shape
+
+Typical usage example:
+
+store = FeatureStore('examples_store')
+mfcc = store.get('mfcc', 0)
+batch = store.batch([3, 14, 15], stack=True)
+"""
+import json
+import os
+from os.path import join
+import shutil
+import numpy as np
+
+META_FILENAME = 'meta.json'
+CLIP_IDS_FILENAME = 'clip_ids.txt'
+LABELS_FILENAME = 'labels.i1'
+DATA_SUFFIX = '.f32'
+INDEX_SUFFIX = '.index.i8'
+# Every Librosa feature is a [coefficients, frames] matrix.
+FEATURE_NDIM = 2
+
+
+class FeatureStoreWriter:
+    """Appends examples to a feature store as they are produced.
+
+    Has the same interface as sharded_output.ShardWriter, and keeps no
+    examples in memory.
+
+    Attributes:
+        output_dir: Path to the directory of the store.
+        features: The names of the features of each example.
+        num_examples: The number of examples written so far.
+    """
+
+    def __init__(self, output_dir, features):
+        """Inits FeatureStoreWriter, creating output_dir if it does not exist.
+        """
+        self.output_dir = output_dir
+        self.features = list(features)
+        self.num_examples = 0
+        os.makedirs(output_dir, exist_ok=True)
+        self._clip_ids = open(join(output_dir, CLIP_IDS_FILENAME), 'w')
+        self._labels = open(join(output_dir, LABELS_FILENAME), 'wb')
+        self._data = {}
+        self._index = {}
+        self._offsets = {}
+        for feature in self.features:
+            self._data[feature] = open(
+                join(output_dir, feature + DATA_SUFFIX), 'wb')
+            self._index[feature] = open(
+                join(output_dir, feature + INDEX_SUFFIX), 'wb')
+            self._offsets[feature] = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, clip_id, example):
+        """Appends an example to the store.
+
+        Args:
+            clip_id: The clip_id of the example.
+            example: A list holding the label followed by one array per
+                feature. A missing feature is stored as an empty array.
+
+        Raises:
+            ValueError: A feature has more than FEATURE_NDIM dimensions. The
+                example is not written.
+        """
+        arrays = []
+        extracted_features = example[1:]
+        for i, feature in enumerate(self.features):
+            if i < len(extracted_features):
+                array = np.asarray(extracted_features[i], dtype=np.float32)
+                if array.ndim > FEATURE_NDIM:
+                    raise ValueError(
+                        '{} of {} has {} dimensions, a feature store holds '
+                        'at most {}'.format(feature, clip_id, array.ndim,
+                                            FEATURE_NDIM))
+                array = array.reshape((1,) * (FEATURE_NDIM - array.ndim) +
+                                      array.shape)
+            else:
+                array = np.zeros((0,) * FEATURE_NDIM, dtype=np.float32)
+            arrays.append(array)
+        self._clip_ids.write(clip_id + '\n')
+        self._labels.write(np.int8(example[0]).tobytes())
+        for feature, array in zip(self.features, arrays):
+            self._data[feature].write(np.ascontiguousarray(array).tobytes())
+            row = np.array((self._offsets[feature],) + array.shape,
+                           dtype=np.int64)
+            self._index[feature].write(row.tobytes())
+            self._offsets[feature] += array.size
+        self.num_examples += 1
+
+    def close(self):
+        """Closes the files of the store and writes its metadata."""
+        self._clip_ids.close()
+        self._labels.close()
+        for feature in self.features:
+            self._data[feature].close()
+            self._index[feature].close()
+        meta = {'features': self.features, 'num_examples': self.num_examples}
+        with open(join(self.output_dir, META_FILENAME), 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+
+def _memmap(path, dtype, shape=None):
+    # np.memmap cannot map an empty file.
+    if os.path.getsize(path) == 0:
+        return np.zeros(shape or (0,), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+class FeatureStore:
+    """Reads a feature store written by FeatureStoreWriter.
+
+    Attributes:
+        store_dir: Path to the directory of the store.
+        features: The names of the features in the store.
+        labels: A memory-mapped int8 array of the label of every example.
+        clip_ids: A numpy array of the clip_id of every example.
+    """
+
+    def __init__(self, store_dir):
+        """Inits FeatureStore, memory-mapping the files in store_dir."""
+        self.store_dir = store_dir
+        with open(join(store_dir, META_FILENAME)) as meta_file:
+            meta = json.load(meta_file)
+        self.features = meta['features']
+        num_examples = meta['num_examples']
+        self.labels = _memmap(join(store_dir, LABELS_FILENAME), np.int8,
+                              (num_examples,))
+        with open(join(store_dir, CLIP_IDS_FILENAME)) as clip_ids_file:
+            self.clip_ids = np.array(clip_ids_file.read().splitlines())
+        self._data = {}
+        self._index = {}
+        for feature in self.features:
+            self._data[feature] = _memmap(
+                join(store_dir, feature + DATA_SUFFIX), np.float32)
+            self._index[feature] = _memmap(
+                join(store_dir, feature + INDEX_SUFFIX), np.int64,
+                (num_examples, 1 + FEATURE_NDIM))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get(self, feature, i):
+        """Returns a read-only view of one example's feature.
+
+        Args:
+            feature: The name of the feature.
+            i: The position of the example in the store.
+        """
+        offset = self._index[feature][i, 0]
+        shape = tuple(self._index[feature][i, 1:])
+        size = int(np.prod(shape))
+        return self._data[feature][offset:offset + size].reshape(shape)
+
+    def shapes(self, feature):
+        """Returns an [examples, ndim] array of the shapes of a feature."""
+        return np.asarray(self._index[feature][:, 1:])
+
+    def batch(self, indices, features=None, stack=False):
+        """Reads the features and labels of a batch of examples.
+
+        Args:
+            indices: A list of positions of examples in the store.
+            features: The names of the features to read. Defaults to every
+                feature in the store.
+            stack: Whether to stack each feature into a single array, which
+                requires the feature to have the same shape in every example
+                of the batch.
+
+        Returns:
+            A tuple of a dictionary with feature name, list of arrays (or
+            stacked array) key-value pairs, and an array of the labels.
+        """
+        if features is None:
+            features = self.features
+        batch = {}
+        for feature in features:
+            arrays = [self.get(feature, i) for i in indices]
+            batch[feature] = np.stack(arrays) if stack else arrays
+        return batch, np.asarray(self.labels[indices])
+
+
+def merge_stores(input_dirs, output_dir):
+    """Concatenates several feature stores into one.
+
+    The files of each column are appended to each other without decoding the
+    features, and the offsets in the index of every feature are shifted past
+    the values of the previous stores.
+
+    Args:
+        input_dirs: A list of paths to the directories of the stores.
+        output_dir: Path to the directory of the merged store.
+
+    Returns:
+        The number of examples in the merged store.
+
+    Raises:
+        ValueError: The stores do not hold the same features.
+    """
+    metas = []
+    for input_dir in input_dirs:
+        with open(join(input_dir, META_FILENAME)) as meta_file:
+            metas.append(json.load(meta_file))
+    features = metas[0]['features'] if metas else []
+    for input_dir, meta in zip(input_dirs, metas):
+        if meta['features'] != features:
+            raise ValueError('{} holds features {}, expected {}'.format(
+                input_dir, meta['features'], features))
+    os.makedirs(output_dir, exist_ok=True)
+    filenames = [CLIP_IDS_FILENAME, LABELS_FILENAME]
+    filenames.extend(feature + DATA_SUFFIX for feature in features)
+    for filename in filenames:
+        with open(join(output_dir, filename), 'wb') as output_file:
+            for input_dir in input_dirs:
+                with open(join(input_dir, filename), 'rb') as input_file:
+                    shutil.copyfileobj(input_file, output_file)
+    for feature in features:
+        offset = 0
+        with open(join(output_dir, feature + INDEX_SUFFIX),
+                  'wb') as index_file:
+            for input_dir in input_dirs:
+                index = np.fromfile(join(input_dir, feature + INDEX_SUFFIX),
+                                    dtype=np.int64).reshape(
+                                        -1, 1 + FEATURE_NDIM)
+                index[:, 0] += offset
+                index_file.write(index.tobytes())
+                offset += os.path.getsize(
+                    join(input_dir, feature + DATA_SUFFIX)) // np.dtype(
+                        np.float32).itemsize
+    num_examples = sum(meta['num_examples'] for meta in metas)
+    meta = {'features': features, 'num_examples': num_examples}
+    with open(join(output_dir, META_FILENAME), 'w') as meta_file:
+        json.dump(meta, meta_file)
+    return num_examples
@@ -0,0 +1,225 @@
+"""Crash-safe manifest of the ingestion state of every labelled segment.
+
+The manifest is a SQLite database in dest_dir with a row per segment, keyed by
+its clip_id, holding the state the segment has reached and the location of
+its output:
+
+pending     the segment is known but nothing has been done for it yet.
+downloaded  the audio of its video has been fetched.
+chopped     its clip has been written, output is the path of the clip.
+extracted   its features have been saved, output is the path of a .npz file.
+failed      its video could not be downloaded, or its clip not decoded.
+
+Every update is committed in its own transaction, and the database is kept in
+write-ahead logging mode, so a run that is killed leaves the manifest as it
+was after the last completed step. A restarted run reads the states back
+instead of checking the files of every segment, downloads only the segments
+that were never chopped, and loads the saved features of extracted segments
+instead of extracting them again.
+
+Typical usage example:
+
+with IngestManifest(join(dest_dir, MANIFEST_FILENAME)) as manifest:
+    manifest.add_segments(audio_dict.values())
+    manifest.set_state(['VIDEO_ID_30000'], CHOPPED, output=path)
+    extracted_clip_ids = manifest.clip_ids(EXTRACTED)
+"""
+import os
+from os.path import isfile, join
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+import numpy as np
+
+MANIFEST_FILENAME = 'manifest.sqlite'
+FEATURES_DIRNAME = 'features'
+
+PENDING = 'pending'
+DOWNLOADED = 'downloaded'
+CHOPPED = 'chopped'
+EXTRACTED = 'extracted'
+FAILED = 'failed'
+STATES = (PENDING, DOWNLOADED, CHOPPED, EXTRACTED, FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    clip_id TEXT PRIMARY KEY,
+    video_id TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    state TEXT NOT NULL,
+    output TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_by_state ON segments (state);
+"""
+
+
+class IngestManifest:
+    """SQLite manifest of the state and output of every segment.
+
+    Safe to share between the threads of a process. Only the process running
+    the ingestion should write to it, the processes extracting features
+    return their results to it instead.
+
+    Attributes:
+        path: Path to the SQLite database.
+    """
+
+    def __init__(self, path):
+        """Opens the manifest at path, creating it if it does not exist."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        # A commit in write-ahead logging mode survives the process being
+        # killed, and NORMAL only gives up the last commits on a power loss.
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes the database."""
+        with self._lock:
+            self._connection.close()
+
+    def add_segments(self, entries):
+        """Adds segments as pending, leaving segments already known as is.
+
+        Args:
+            entries: An iterable of AudioSetEntry objects.
+        """
+        now = time.time()
+        rows = ((entry.clip_id, entry.video_id, entry.start_time,
+                 entry.end_time, PENDING, now) for entry in entries)
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO segments (clip_id, video_id, '
+                'start_time, end_time, state, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def set_state(self, clip_ids, state, output=None, error=None):
+        """Moves segments to a state in a single transaction.
+
+        Args:
+            clip_ids: An iterable of the clip_ids of the segments.
+            state: The new state, one of STATES.
+            output: The path of the output of the segments in that state, or
+                None.
+            error: A description of why the segments failed, or None.
+
+        Raises:
+            ValueError: The state is not one of STATES.
+        """
+        if state not in STATES:
+            raise ValueError('Unknown state: {}'.format(state))
+        now = time.time()
+        rows = ((state, output, error, now, clip_id) for clip_id in clip_ids)
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'UPDATE segments SET state = ?, output = ?, error = ?, '
+                'updated_at = ? WHERE clip_id = ?', rows)
+
+    def reset(self, clip_ids):
+        """Moves segments back to pending, deleting their saved features.
+
+        Args:
+            clip_ids: An iterable of the clip_ids of the segments.
+        """
+        clip_ids = list(clip_ids)
+        outputs = self.outputs(EXTRACTED)
+        for clip_id in clip_ids:
+            path = outputs.get(clip_id)
+            if path is not None and isfile(path):
+                os.remove(path)
+        self.set_state(clip_ids, PENDING)
+
+    def states(self):
+        """Returns a dictionary with clip_id, state key-value pairs."""
+        with self._lock:
+            return dict(self._connection.execute(
+                'SELECT clip_id, state FROM segments'))
+
+    def clip_ids(self, state):
+        """Returns the set of clip_ids of the segments in a state."""
+        with self._lock:
+            return {clip_id for clip_id, in self._connection.execute(
+                'SELECT clip_id FROM segments WHERE state = ?', (state,))}
+
+    def outputs(self, state):
+        """Returns a dictionary with clip_id, output key-value pairs.
+
+        Args:
+            state: The state of the segments to return the output of.
+        """
+        with self._lock:
+            return dict(self._connection.execute(
+                'SELECT clip_id, output FROM segments WHERE state = ?',
+                (state,)))
+
+    def counts(self):
+        """Returns a dictionary with state, number of segments pairs."""
+        with self._lock:
+            return dict(self._connection.execute(
+                'SELECT state, COUNT(*) FROM segments GROUP BY state'))
+
+
+def features_path(dest_dir, clip_id):
+    """Returns the path of the saved features of a labelled segment.
+
+    Args:
+        dest_dir: Path to the parent directory where the downloaded videos are
+            stored.
+        clip_id: The clip_id of the segment, see audioset_helper.clip_id.
+    """
+    return join(dest_dir, FEATURES_DIRNAME, clip_id + '.npz')
+
+
+def load_features(path, features):
+    """Loads the features saved in a .npz file.
+
+    Args:
+        path: Path to the .npz file.
+        features: A list of the names of the features to load.
+
+    Returns:
+        A dictionary with feature name, numpy array key-value pairs for the
+        features found in the file, which is empty if the file is missing or
+        unreadable.
+    """
+    if not isfile(path):
+        return {}
+    try:
+        with np.load(path) as saved:
+            return {feature: saved[feature] for feature in features
+                    if feature in saved.files}
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return {}
+
+
+def save_features(path, features):
+    """Saves features to a .npz file, replacing it atomically.
+
+    Args:
+        path: Path to the .npz file.
+        features: A dictionary with feature name, numpy array key-value pairs.
+    """
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            np.savez(file, **features)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,79 @@
+"""
+Script to merge the outputs of several shards of an ingestion into one dataset.
+
+audio_processing.py run with --num_shards and --shard_index ingests a single
+shard of a csv file, so that several machines can each ingest their own
+shard. Once every shard is done, this script concatenates their outputs,
+written with --output_format=shards, feature_store or tfrecord, and their
+indices into a single output directory. The format is detected from the
+first input.
+
+Usage
+Standalone script:
+python merge_outputs.py
+    --shard_dirs PATH TO THE OUTPUT OF A SHARD, REPEATED FOR EVERY SHARD
+    --merged_dir PATH TO THE MERGED OUTPUT
+
+Example:
+python merge_outputs.py
+    --shard_dirs example_dest_dir/examples/shard-00000-of-00002
+    --shard_dirs example_dest_dir/examples/shard-00001-of-00002
+    --merged_dir example_dest_dir/examples/merged
+"""
+from os.path import isfile, join
+from absl import app
+from absl import flags
+from absl import logging
+import feature_store
+import sharded_output
+import tfrecord_output
+
+FLAGS = flags.FLAGS
+flags.DEFINE_multi_string('shard_dirs', [],
+                          'The output directories of the shards, in the '
+                          'order their examples are to be merged')
+flags.DEFINE_string('merged_dir', None,
+                    'The location of the merged output')
+flags.mark_flag_as_required('merged_dir')
+
+
+def merge(input_dirs, output_dir):
+    """Merges the outputs of several shards, whichever their format.
+
+    Args:
+        input_dirs: A list of paths to the output directories of the shards,
+            all written with the same output format.
+        output_dir: Path to the directory of the merged output.
+
+    Returns:
+        The number of examples in the merged output.
+
+    Raises:
+        ValueError: No input directory was given, or the first is not the
+            output of audio_processing.py.
+    """
+    if not input_dirs:
+        raise ValueError('No input directories to merge')
+    if isfile(join(input_dirs[0], feature_store.META_FILENAME)):
+        return feature_store.merge_stores(input_dirs, output_dir)
+    if isfile(join(input_dirs[0], sharded_output.INDEX_FILENAME)):
+        return sharded_output.merge_outputs(input_dirs, output_dir)
+    if isfile(join(input_dirs[0], tfrecord_output.MANIFEST_FILENAME)):
+        return tfrecord_output.merge_tfrecords(input_dirs, output_dir)
+    raise ValueError('{} holds neither shards, a feature store nor TFRecord '
+                     'shards'.format(input_dirs[0]))
+
+
+def main(argv):
+    """Merges the directories of --shard_dirs into --merged_dir.
+
+    Args:
+        argv: A list containing the path this script after the build process.
+    """
+    num_examples = merge(FLAGS.shard_dirs, FLAGS.merged_dir)
+    logging.info('Merged {} examples of {} shards into {}'.format(
+        num_examples, len(FLAGS.shard_dirs), FLAGS.merged_dir))
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,199 @@
+"""Compiled index of the AudioSet ontology with transitive label closures.
+
+The ontology.json file describes every label by its id, name and the ids of
+its direct children. Expanding a label to everything it covers means walking
+its children, their children, and so on. OntologyIndex does that walk once
+for every label when the ontology is compiled, and maps each label between its
+name, its id (e.g. /m/032s66) and a compact integer index, the position of the
+label in ontology.json.
+
+The arrays of the compiled index are pickled next to ontology.json, as
+ontology.index.pkl, and reused for as long as ontology.json is unchanged, so
+loading it takes milliseconds instead of parsing the JSON file on every run.
+Only lists and numpy arrays are pickled, never an OntologyIndex, so the file
+stays readable whatever package this module is imported from.
+
+Typical usage example:
+
+ontology = load_ontology_index(src_dir)
+labels_set = ontology.expand(['Gunshot, gunfire'])
+"""
+import json
+import os
+from os.path import join
+import pickle
+import tempfile
+from absl import logging
+import numpy as np
+
+ONTOLOGY_FILENAME = 'ontology.json'
+INDEX_FILENAME = 'ontology.index.pkl'
+# Bumped whenever the pickled layout of the index changes.
+INDEX_VERSION = 2
+
+
+class OntologyIndex:
+    """Maps AudioSet labels between names, ids and integer indices.
+
+    Attributes:
+        names: A list of the name of each label, by integer index.
+        label_ids: A list of the id of each label, by integer index.
+        name_to_index: A dictionary with name, integer index key-value pairs.
+        id_to_index: A dictionary with label id, integer index key-value pairs.
+        descendant_indptr: An int64 numpy array of offsets into
+            descendant_indices, one more than the number of labels.
+        descendant_indices: An int32 numpy array holding, for each label, the
+            sorted integer indices of the label and all of its descendants.
+    """
+
+    def __init__(self, names, label_ids, descendant_indptr,
+                 descendant_indices):
+        """Inits OntologyIndex with the labels and their descendants."""
+        self.names = names
+        self.label_ids = label_ids
+        self.name_to_index = {name: i for i, name in enumerate(names)}
+        self.id_to_index = {label_id: i for i, label_id in enumerate(label_ids)}
+        self.descendant_indptr = descendant_indptr
+        self.descendant_indices = descendant_indices
+
+    def __len__(self):
+        return len(self.label_ids)
+
+    def index_of(self, label):
+        """Returns the integer index of a label given its name or id.
+
+        Raises:
+            ValueError: The label is not in the ontology.
+        """
+        if label in self.name_to_index:
+            return self.name_to_index[label]
+        if label in self.id_to_index:
+            return self.id_to_index[label]
+        raise ValueError('Label not in the ontology: {}'.format(label))
+
+    def descendants(self, index):
+        """Returns the integer indices of a label and all of its descendants.
+        """
+        return self.descendant_indices[self.descendant_indptr[index]:
+                                       self.descendant_indptr[index + 1]]
+
+    def expand_indices(self, labels):
+        """Returns the integer indices covered by a list of labels.
+
+        Args:
+            labels: A list of label names or ids.
+
+        Returns:
+            A sorted int32 numpy array of the integer indices of the labels and
+            all of their descendants.
+        """
+        if not labels:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate(
+            [self.descendants(self.index_of(label)) for label in labels]))
+
+    def expand(self, labels):
+        """Returns the set of label ids covered by a list of labels.
+
+        Args:
+            labels: A list of label names or ids.
+
+        Returns:
+            A set of the label ids of the labels and all of their descendants,
+            in the format found in the audioset csv.
+        """
+        return {self.label_ids[i] for i in self.expand_indices(labels)}
+
+    def to_arrays(self):
+        """Returns the lists and arrays OntologyIndex is built from."""
+        return (self.names, self.label_ids, self.descendant_indptr,
+                self.descendant_indices)
+
+
+def compile_ontology(ontology_path):
+    """Compiles an OntologyIndex from an ontology.json file.
+
+    Args:
+        ontology_path: Path to the ontology.json file.
+
+    Returns:
+        An OntologyIndex of every label in the file.
+    """
+    with open(ontology_path) as ontology_file:
+        label_json = json.load(ontology_file)
+    names = [label['name'] for label in label_json]
+    label_ids = [label['id'] for label in label_json]
+    id_to_index = {label_id: i for i, label_id in enumerate(label_ids)}
+    children = [[id_to_index[child_id] for child_id in label['child_ids']
+                 if child_id in id_to_index] for label in label_json]
+    closures = [None] * len(label_json)
+
+    def closure(index):
+        # The ontology is a shallow DAG, so recursion depth stays small.
+        if closures[index] is None:
+            covered = {index}
+            for child in children[index]:
+                covered.update(closure(child))
+            closures[index] = covered
+        return closures[index]
+
+    descendant_indptr = np.zeros(len(label_json) + 1, dtype=np.int64)
+    descendant_lists = []
+    for index in range(len(label_json)):
+        descendant_lists.append(sorted(closure(index)))
+        descendant_indptr[index + 1] = (descendant_indptr[index] +
+                                        len(descendant_lists[-1]))
+    descendant_indices = np.array(
+        [i for descendants in descendant_lists for i in descendants],
+        dtype=np.int32)
+    return OntologyIndex(names, label_ids, descendant_indptr,
+                         descendant_indices)
+
+
+def _source_signature(ontology_path):
+    stat = os.stat(ontology_path)
+    return INDEX_VERSION, stat.st_size, stat.st_mtime_ns
+
+
+def load_ontology_index(src_dir):
+    """Loads the compiled ontology index of src_dir, compiling it if needed.
+
+    The index is recompiled if ontology.index.pkl is missing, or if it was
+    compiled from a different version of ontology.json. A freshly compiled
+    index is written next to ontology.json, unless the directory is read-only.
+
+    Args:
+        src_dir: Path to a directory where the ontology.json is expected to be.
+
+    Returns:
+        An OntologyIndex.
+    """
+    ontology_path = join(src_dir, ONTOLOGY_FILENAME)
+    index_path = join(src_dir, INDEX_FILENAME)
+    signature = _source_signature(ontology_path)
+    try:
+        with open(index_path, 'rb') as index_file:
+            cached_signature, arrays = pickle.load(index_file)
+        if cached_signature == signature:
+            return OntologyIndex(*arrays)
+    except (IOError, EOFError, pickle.UnpicklingError, ValueError,
+            TypeError, ImportError, AttributeError):
+        # An index of an older layout may reference classes that cannot be
+        # imported anymore, and is compiled again.
+        pass
+    ontology = compile_ontology(ontology_path)
+    # Processes compiling the index at the same time each write a temporary
+    # file of their own, and the last one renamed into place wins.
+    try:
+        handle, tmp_path = tempfile.mkstemp(dir=src_dir, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as index_file:
+                pickle.dump((signature, ontology.to_arrays()), index_file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, index_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    except OSError as error:
+        logging.warning('Could not write the ontology index: {}'.format(error))
+    return ontology
@@ -0,0 +1,115 @@
+"""Memory-mapped store of decoded and resampled audio clips.
+
+Decoding a clip and resampling it to the sampling rate features are extracted
+at is repeated on every extraction run, even though its result only changes
+with the clip, the sampling rate and the resampler. PcmStore keeps that
+result as a compact .npy file per clip, of 16-bit integers or half floats,
+which later runs memory-map and convert to float32 instead of decoding the
+clip again.
+
+The files of each sampling rate and resampler are kept in a directory of
+their own, and a file is only used while it is newer than its clip, so a
+clip chopped again is decoded again. Files are written to a temporary file
+renamed into place, so that several extraction processes can share a store.
+
+Store layout:
+STORE_DIR/RATE-RES_TYPE/CLIP_NAME.DTYPE.npy
+
+Typical usage example:
+
+store = PcmStore('pcm_store')
+audio = store.get(path, 22050, 'soxr_hq')
+if audio is None:
+    audio, _ = librosa.load(path, sr=22050, res_type='soxr_hq')
+    store.put(path, 22050, 'soxr_hq', audio)
+"""
+import os
+from os.path import basename, join, splitext
+import tempfile
+import numpy as np
+
+DTYPES = ('int16', 'float16')
+# Full scale of 16-bit PCM, as decoded by libsndfile.
+INT16_SCALE = 32768.0
+
+
+class PcmStore:
+    """Store of decoded waveforms, one memory-mapped .npy file per clip.
+
+    Attributes:
+        store_dir: Path to the directory of the store.
+        dtype: The dtype the waveforms are stored as, one of DTYPES.
+    """
+
+    def __init__(self, store_dir, dtype='int16'):
+        """Inits PcmStore, creating store_dir if it does not exist.
+
+        Raises:
+            ValueError: dtype is not one of DTYPES.
+        """
+        if dtype not in DTYPES:
+            raise ValueError('Unsupported PCM dtype: {}'.format(dtype))
+        self.store_dir = store_dir
+        self.dtype = dtype
+        os.makedirs(store_dir, exist_ok=True)
+
+    def path(self, clip_path, sampling_rate, res_type):
+        """Returns the path of the stored waveform of a clip.
+
+        Args:
+            clip_path: Path to the audio file of the clip.
+            sampling_rate: The sampling rate of the waveform.
+            res_type: The resampler the waveform was resampled with.
+        """
+        name = splitext(basename(clip_path))[0]
+        return join(self.store_dir, '{}-{}'.format(sampling_rate, res_type),
+                    '{}.{}.npy'.format(name, self.dtype))
+
+    def get(self, clip_path, sampling_rate, res_type):
+        """Reads the stored waveform of a clip.
+
+        Args:
+            clip_path: Path to the audio file of the clip.
+            sampling_rate: The sampling rate of the waveform.
+            res_type: The resampler the waveform was resampled with.
+
+        Returns:
+            A float32 numpy array of the waveform, or None if it is not
+            stored, is older than the clip, or is unreadable.
+        """
+        path = self.path(clip_path, sampling_rate, res_type)
+        try:
+            if os.stat(path).st_mtime_ns < os.stat(clip_path).st_mtime_ns:
+                return None
+            samples = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if self.dtype == 'int16':
+            return samples.astype(np.float32) * np.float32(1 / INT16_SCALE)
+        return samples.astype(np.float32)
+
+    def put(self, clip_path, sampling_rate, res_type, audio):
+        """Stores the waveform of a clip, replacing it atomically.
+
+        Args:
+            clip_path: Path to the audio file of the clip.
+            sampling_rate: The sampling rate of the waveform.
+            res_type: The resampler the waveform was resampled with.
+            audio: A float numpy array of the waveform, in [-1, 1].
+        """
+        if self.dtype == 'int16':
+            samples = np.clip(np.round(audio * INT16_SCALE), -INT16_SCALE,
+                              INT16_SCALE - 1).astype(np.int16)
+        else:
+            samples = np.asarray(audio, dtype=np.float16)
+        path = self.path(clip_path, sampling_rate, res_type)
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                np.save(file, samples)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
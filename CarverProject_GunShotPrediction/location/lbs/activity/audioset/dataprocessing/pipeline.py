@@ -0,0 +1,98 @@
+"""Runs the download and the extraction of clips as overlapping stages.
+
+Downloading a video mostly waits on the network while extracting features from
+its clips mostly waits on the CPU, so running one phase to completion before
+the other takes the sum of their times. run_stages instead has a pool of
+threads download groups of items, such as the segments of a video, and hands
+every downloaded item over a bounded queue to a pool of processes extracting
+them, so that the first results come out as soon as the first video is
+downloaded and the wall time approaches the longer of the two phases.
+
+Both stages are bounded: at most download_workers groups are downloaded at a
+time, no new group is downloaded while queue_size items are waiting to be
+extracted, and at most two items per extraction process are submitted ahead,
+so memory does not grow with the number of items.
+
+Typical usage example:
+
+for job, result in run_stages(videos.items(), download_video, extract_clip,
+                              download_workers=8, extract_workers=4):
+    ...
+"""
+import collections
+from concurrent import futures
+
+DEFAULT_QUEUE_SIZE = 256
+
+
+def run_stages(groups, download, extract, ready_items=(), download_workers=1,
+               extract_workers=1, queue_size=DEFAULT_QUEUE_SIZE,
+               extract_initializer=None, extract_initargs=()):
+    """Downloads groups of items in threads and extracts them in processes.
+
+    Items already downloaded, passed as ready_items, are extracted whenever
+    there is no downloaded item waiting, so they fill the extraction workers
+    without holding up the downloads.
+
+    Args:
+        groups: An iterable of (key, items) tuples of items downloaded
+            together.
+        download: A function taking a key and its items, run in a thread,
+            returning the list of items that were downloaded and are ready to
+            be extracted.
+        extract: A picklable function taking a single item, run in a process.
+        ready_items: An iterable of items that need no download.
+        download_workers: The number of groups to download at the same time.
+        extract_workers: The number of processes extracting items.
+        queue_size: The number of downloaded items waiting to be extracted
+            past which no new download is started.
+        extract_initializer: A picklable function run at the start of each
+            extraction process, or None.
+        extract_initargs: A tuple of the arguments of extract_initializer.
+
+    Yields:
+        A tuple of an item and the result of extract for it, in the order the
+        extractions complete.
+    """
+    groups = iter(groups)
+    ready_items = iter(ready_items)
+    queue = collections.deque()
+    downloads = {}
+    extractions = {}
+    groups_left = True
+    download_executor = futures.ThreadPoolExecutor(
+        max_workers=download_workers)
+    extract_executor = futures.ProcessPoolExecutor(
+        max_workers=extract_workers, initializer=extract_initializer,
+        initargs=extract_initargs)
+    try:
+        while True:
+            while (groups_left and len(downloads) < download_workers and
+                   len(queue) < queue_size):
+                group = next(groups, None)
+                if group is None:
+                    groups_left = False
+                    break
+                downloads[download_executor.submit(download, *group)] = (
+                    group[0])
+            while len(extractions) < 2 * extract_workers:
+                if queue:
+                    item = queue.popleft()
+                else:
+                    item = next(ready_items, None)
+                    if item is None:
+                        break
+                extractions[extract_executor.submit(extract, item)] = item
+            if not downloads and not extractions:
+                return
+            done, _ = futures.wait(list(downloads) + list(extractions),
+                                   return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                if future in downloads:
+                    del downloads[future]
+                    queue.extend(future.result())
+                else:
+                    yield extractions.pop(future), future.result()
+    finally:
+        download_executor.shutdown(cancel_futures=True)
+        extract_executor.shutdown(cancel_futures=True)
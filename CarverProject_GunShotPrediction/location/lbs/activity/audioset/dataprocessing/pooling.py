@@ -0,0 +1,124 @@
+"""Pools extracted features over time into fixed-length vectors.
+
+Each extracted feature is a [coefficients, frames] matrix, but classifiers of
+10-second clips mostly consume summary statistics of each coefficient over
+the clip. pool reduces a feature to the statistics of each coefficient over
+its frames, concatenated into a vector whose length does not depend on the
+duration of the clip, which is orders of magnitude smaller than the feature.
+
+Every statistic is computed over the last axis of the array at once, so the
+features of a whole batch, of shape [batch, coefficients, frames], are pooled
+in a single vectorized pass, and all percentiles share one partial sort.
+
+Statistics:
+mean, std, min, max  of each coefficient over the frames.
+pNN                  the NNth percentile of each coefficient, e.g. p10, p90.
+delta_mean           the mean of the frame-to-frame difference of each
+delta_std            coefficient, and its standard deviation.
+
+Typical usage example:
+
+statistics = check_statistics(['mean', 'std', 'p90'])
+vector = pool(features['mfcc'], statistics)
+"""
+import re
+import numpy as np
+
+STATISTICS = ('mean', 'std', 'min', 'max', 'delta_mean', 'delta_std')
+DEFAULT_STATISTICS = ('mean', 'std')
+_PERCENTILE = re.compile(r'^p(\d{1,2}|100)$')
+
+
+def is_supported(statistics):
+    """Returns whether every statistic in a list is supported."""
+    return all(statistic in STATISTICS or _PERCENTILE.match(statistic)
+               for statistic in statistics)
+
+
+def check_statistics(statistics):
+    """Raises a ValueError if any of the statistics is not supported.
+
+    Args:
+        statistics: A list of statistic names, each one of STATISTICS or
+            pNN for a percentile NN from 0 to 100.
+
+    Returns:
+        The statistics, as a tuple.
+
+    Raises:
+        ValueError: A statistic is not supported.
+    """
+    unsupported = [statistic for statistic in statistics
+                   if not is_supported([statistic])]
+    if unsupported:
+        raise ValueError('Unsupported statistics: {}'.format(
+            ', '.join(unsupported)))
+    return tuple(statistics)
+
+
+def pool(feature, statistics=DEFAULT_STATISTICS):
+    """Reduces the frames of a feature to statistics of each coefficient.
+
+    Args:
+        feature: A numpy array of shape [..., coefficients, frames], e.g. the
+            feature of a clip or of a batch of clips.
+        statistics: A list of statistic names, see check_statistics.
+
+    Returns:
+        A float32 numpy array of shape
+        [..., len(statistics) * coefficients], holding the coefficients of
+        each statistic in turn, in the order of statistics.
+
+    Raises:
+        ValueError: A statistic is not supported.
+    """
+    check_statistics(statistics)
+    feature = np.asarray(feature, dtype=np.float32)
+    if feature.ndim == 1:
+        feature = feature[np.newaxis]
+    num_frames = feature.shape[-1]
+    if num_frames == 0:
+        return np.zeros(feature.shape[:-2] + (
+            len(statistics) * feature.shape[-2],), dtype=np.float32)
+    percentiles = [statistic for statistic in statistics
+                   if _PERCENTILE.match(statistic)]
+    pooled = {}
+    if percentiles:
+        values = np.percentile(feature, [int(statistic[1:])
+                                         for statistic in percentiles],
+                               axis=-1)
+        pooled.update(zip(percentiles, values))
+    if 'delta_mean' in statistics or 'delta_std' in statistics:
+        if num_frames > 1:
+            delta = np.diff(feature, axis=-1)
+        else:
+            delta = np.zeros_like(feature)
+    functions = {
+        'mean': lambda: feature.mean(axis=-1),
+        'std': lambda: feature.std(axis=-1),
+        'min': lambda: feature.min(axis=-1),
+        'max': lambda: feature.max(axis=-1),
+        'delta_mean': lambda: delta.mean(axis=-1),
+        'delta_std': lambda: delta.std(axis=-1),
+    }
+    vectors = []
+    for statistic in statistics:
+        if statistic not in pooled:
+            pooled[statistic] = functions[statistic]()
+        vectors.append(pooled[statistic])
+    return np.concatenate(vectors, axis=-1).astype(np.float32)
+
+
+def pool_features(extracted_features, statistics=DEFAULT_STATISTICS):
+    """Pools every feature of a dictionary of extracted features.
+
+    Args:
+        extracted_features: A dictionary with feature name, numpy array
+            key-value pairs.
+        statistics: A list of statistic names, see check_statistics.
+
+    Returns:
+        A dictionary with feature name, pooled float32 vector key-value pairs.
+    """
+    return {name: pool(feature, statistics)
+            for name, feature in extracted_features.items()}
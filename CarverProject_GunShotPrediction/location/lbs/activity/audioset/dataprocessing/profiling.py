@@ -0,0 +1,334 @@
+"""Records the latency of every stage of an ingestion run and reports on it.
+
+A Profiler collects a latency sample each time a stage runs, e.g. once per
+video for download and once per clip for chop, decode and every feature, and
+counts the clips that come out of the run. Its report aggregates the samples
+of each stage into percentiles and the run into clips per second, and can be
+written as JSON, for people, and in the Prometheus text exposition format, for
+the node exporter's textfile collector.
+
+The count, total and maximum of each stage are exact, and its percentiles are
+computed from a uniform sample of at most reservoir_size of its latencies, so
+that the memory of a profiler does not grow with the number of clips, unless
+per_clip latencies are kept.
+
+Stages that run in another process, such as feature extraction, time
+themselves into a dictionary of stage, seconds pairs, which is returned along
+with their result and recorded with record_all.
+
+Stages:
+parse           parsing the ontology and the csv file, once per run.
+download_phase  downloading every video before extracting any clip, once per
+                run unless the download and extraction are pipelined.
+download        fetching a video, or the window of a segment, once per fetch.
+chop            cutting and writing the clip of a segment.
+load_saved      loading the features saved by an earlier run of a clip.
+cache           looking up the features of a clip in the feature cache.
+decode          decoding and resampling a clip.
+feature:NAME    computing one feature of a clip, including the intermediates it
+                is the first to need.
+pool            pooling the features of a clip into fixed-length vectors.
+extract         everything done for a clip in the extraction process.
+write           handing an example to an output writer.
+dataframe       building the dataframe of every example, once per run.
+
+Typical usage example:
+
+profiler = Profiler()
+with profiler.timer('chop', clip_id):
+    chop_audio(...)
+profiler.write_json('profile.json')
+profiler.write_prometheus('profile.prom')
+"""
+import collections
+import contextlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from absl import logging
+import numpy as np
+
+JSON_FILENAME = 'profile.json'
+PROMETHEUS_FILENAME = 'profile.prom'
+PERCENTILES = (50, 90, 99)
+METRIC_PREFIX = 'audioset_ingest'
+# The number of latencies of a stage kept to compute its percentiles.
+RESERVOIR_SIZE = 10000
+
+
+class _StageLatencies:
+    """Count, total and maximum of the latencies of a stage.
+
+    Also keeps a uniform sample of at most reservoir_size of the latencies,
+    by reservoir sampling.
+    """
+
+    def __init__(self, reservoir_size, rng):
+        self.reservoir_size = reservoir_size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+        self._rng = rng
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < self.reservoir_size:
+            self.samples.append(seconds)
+        else:
+            i = self._rng.randrange(self.count)
+            if i < self.reservoir_size:
+                self.samples[i] = seconds
+
+
+class Profiler:
+    """Collects per-stage latencies and the number of clips of a run.
+
+    Safe to share between the threads of a process.
+
+    Attributes:
+        per_clip: Whether the latencies of every clip are kept, to be listed
+            in the JSON report, rather than only aggregated. Their memory
+            grows with the number of clips.
+        reservoir_size: The number of latencies of each stage kept to
+            compute its percentiles.
+        num_clips: The number of clips that came out of the run so far.
+    """
+
+    def __init__(self, per_clip=False, reservoir_size=RESERVOIR_SIZE):
+        """Inits Profiler, starting the clock of the run."""
+        self.per_clip = per_clip
+        self.reservoir_size = reservoir_size
+        self.num_clips = 0
+        self._lock = threading.Lock()
+        self._begin = time.perf_counter()
+        self._rng = random.Random(0)
+        self._latencies = {}
+        self._clips = collections.defaultdict(dict)
+
+    @property
+    def wall_seconds(self):
+        """The number of seconds since the profiler was created."""
+        return time.perf_counter() - self._begin
+
+    @contextlib.contextmanager
+    def timer(self, stage, clip_id=None):
+        """Records the time spent in the body of a with statement.
+
+        Args:
+            stage: The name of the stage.
+            clip_id: The clip_id of the clip the stage ran for, a list of
+                the clip_ids of the clips it ran for at once, or None.
+        """
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - begin, clip_id)
+
+    def record(self, stage, seconds, clip_id=None):
+        """Records one latency sample of a stage.
+
+        Args:
+            stage: The name of the stage.
+            seconds: The time the stage took.
+            clip_id: The clip_id of the clip the stage ran for, a list of
+                the clip_ids of the clips it ran for at once, or None.
+        """
+        if clip_id is None or not self.per_clip:
+            clip_ids = []
+        elif isinstance(clip_id, str):
+            clip_ids = [clip_id]
+        else:
+            clip_ids = clip_id
+        with self._lock:
+            if stage not in self._latencies:
+                self._latencies[stage] = _StageLatencies(self.reservoir_size,
+                                                         self._rng)
+            self._latencies[stage].add(seconds)
+            # A stage run once for several clips, such as the download of a
+            # whole video, is one sample, attributed in full to every clip.
+            for each_clip_id in clip_ids:
+                clip = self._clips[each_clip_id]
+                clip[stage] = clip.get(stage, 0.0) + seconds
+
+    def record_all(self, timings, clip_id=None):
+        """Records the samples of a dictionary with stage, seconds pairs.
+
+        Args:
+            timings: A dictionary filled by a stage run in another process.
+            clip_id: The clip_id of the clip the stages ran for, or None.
+        """
+        for stage, seconds in timings.items():
+            self.record(stage, seconds, clip_id)
+
+    def count_clip(self):
+        """Counts a clip that came out of the run."""
+        with self._lock:
+            self.num_clips += 1
+
+    def stage_summaries(self):
+        """Aggregates the latency samples of every stage.
+
+        Returns:
+            A dictionary with stage, summary key-value pairs, each summary a
+            dictionary of the count, total, mean, max and percentiles of the
+            latencies in seconds. Percentiles are estimated from a sample of
+            the latencies once a stage has more than reservoir_size.
+        """
+        with self._lock:
+            latencies = {stage: (stage_latencies.count,
+                                 stage_latencies.total, stage_latencies.max,
+                                 np.array(stage_latencies.samples))
+                         for stage, stage_latencies
+                         in self._latencies.items()}
+        summaries = {}
+        for stage, (count, total, maximum, samples) in sorted(
+                latencies.items()):
+            summary = {
+                'count': count,
+                'total_seconds': total,
+                'mean_seconds': total / count,
+                'max_seconds': maximum,
+            }
+            for percentile, value in zip(
+                    PERCENTILES, np.percentile(samples, PERCENTILES)):
+                summary['p{}_seconds'.format(percentile)] = float(value)
+            summaries[stage] = summary
+        return summaries
+
+    def report(self):
+        """Returns the report of the run as a JSON-serializable dictionary."""
+        wall_seconds = self.wall_seconds
+        report = {
+            'wall_seconds': wall_seconds,
+            'clips': self.num_clips,
+            'clips_per_second': (self.num_clips / wall_seconds
+                                 if wall_seconds > 0 else 0.0),
+            'stages': self.stage_summaries(),
+        }
+        if self.per_clip:
+            with self._lock:
+                report['per_clip'] = {clip_id: dict(stages) for clip_id,
+                                      stages in self._clips.items()}
+        return report
+
+    def log_report(self):
+        """Logs the throughput of the run and the latencies of every stage."""
+        report = self.report()
+        logging.info('{} clips in {:.1f} seconds, {:.2f} clips/sec'.format(
+            report['clips'], report['wall_seconds'],
+            report['clips_per_second']))
+        for stage, summary in report['stages'].items():
+            logging.info(
+                '{}: {} samples, {:.3f} s total, p50 {:.3f} s, p90 {:.3f} s, '
+                'p99 {:.3f} s, max {:.3f} s'.format(
+                    stage, summary['count'], summary['total_seconds'],
+                    summary['p50_seconds'], summary['p90_seconds'],
+                    summary['p99_seconds'], summary['max_seconds']))
+
+    def write_json(self, path):
+        """Writes the report of the run to a JSON file."""
+        _write_atomically(path, json.dumps(self.report(), indent=2,
+                                           sort_keys=True))
+
+    def write_prometheus(self, path):
+        """Writes the report of the run in the Prometheus text format.
+
+        Stage latencies are written as a summary with a stage label, and the
+        clips and throughput of the run as a counter and gauges.
+        """
+        report = self.report()
+        metric = METRIC_PREFIX + '_stage_seconds'
+        lines = [
+            '# HELP {} Latency of each stage of the ingestion.'.format(
+                metric),
+            '# TYPE {} summary'.format(metric),
+        ]
+        for stage, summary in report['stages'].items():
+            for percentile in PERCENTILES:
+                lines.append('{}{{stage="{}",quantile="{}"}} {!r}'.format(
+                    metric, stage, percentile / 100,
+                    summary['p{}_seconds'.format(percentile)]))
+            lines.append('{}_sum{{stage="{}"}} {!r}'.format(
+                metric, stage, summary['total_seconds']))
+            lines.append('{}_count{{stage="{}"}} {}'.format(
+                metric, stage, summary['count']))
+        for name, metric_type, help_text in (
+                ('clips_total', 'counter', 'Clips output by the ingestion.'),
+                ('wall_seconds', 'gauge', 'Wall time of the ingestion.'),
+                ('clips_per_second', 'gauge', 'Throughput of the ingestion.')):
+            metric = '{}_{}'.format(METRIC_PREFIX, name)
+            value = report['clips' if name == 'clips_total' else name]
+            lines.append('# HELP {} {}'.format(metric, help_text))
+            lines.append('# TYPE {} {}'.format(metric, metric_type))
+            lines.append('{} {!r}'.format(metric, value))
+        _write_atomically(path, '\n'.join(lines) + '\n')
+
+    def write_reports(self, output_dir):
+        """Writes the JSON and Prometheus reports of the run to a directory.
+
+        Args:
+            output_dir: Path to the directory, where the reports are written
+                to JSON_FILENAME and PROMETHEUS_FILENAME.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        self.write_json(os.path.join(output_dir, JSON_FILENAME))
+        self.write_prometheus(os.path.join(output_dir, PROMETHEUS_FILENAME))
+
+
+@contextlib.contextmanager
+def timer(profiler, stage, clip_id=None):
+    """Like Profiler.timer, but does nothing if profiler is None.
+
+    Args:
+        profiler: A Profiler, or None.
+        stage: The name of the stage.
+        clip_id: The clip_id of the clip the stage ran for, a list of the
+            clip_ids of the clips it ran for at once, or None.
+    """
+    if profiler is None:
+        yield
+        return
+    with profiler.timer(stage, clip_id):
+        yield
+
+
+@contextlib.contextmanager
+def stage_timer(timings, stage):
+    """Adds the time spent in a with statement to a dictionary of timings.
+
+    Used by stages that run in another process, whose timings are returned
+    to the profiler along with their result. Does nothing if timings is None.
+
+    Args:
+        timings: A dictionary with stage, seconds pairs, or None.
+        stage: The name of the stage.
+    """
+    if timings is None:
+        yield
+        return
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = (timings.get(stage, 0.0) +
+                          time.perf_counter() - begin)
+
+
+def _write_atomically(path, text):
+    """Writes text to path through a temporary file and a rename."""
+    dirname = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
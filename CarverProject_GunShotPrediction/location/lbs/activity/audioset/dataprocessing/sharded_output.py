@@ -0,0 +1,217 @@
+"""Writes labelled examples to fixed-size shards on disk as they are produced.
+
+Instead of holding every example in memory until the end of a run, a
+ShardWriter buffers at most shard_size examples and writes them out as a
+pickled pandas DataFrame, so memory stays constant regardless of the size of
+the dataset. Each shard has the same columns as the dataframe returned by
+audio_processing.output_df and is indexed by the clip_id of each example,
+which is made of its video_id and start time (see audioset_helper.clip_id).
+
+An index file, index.csv, records the video_id, clip_id, shard and row of
+every example, so that the examples of a video can be found without loading
+every shard.
+
+merge_outputs concatenates the output directories written by several runs,
+such as the shards of a dataset ingested on several machines, into one.
+
+Output layout:
+OUTPUT_DIR/examples-00000.pkl
+OUTPUT_DIR/examples-00001.pkl
+...
+OUTPUT_DIR/index.csv
+"""
+import csv
+import os
+from os.path import join
+import shutil
+from absl import logging
+import pandas as pd
+import audioset_helper
+
+DEFAULT_SHARD_SIZE = 1000
+SHARD_PATTERN = 'examples-{:05d}.pkl'
+INDEX_FILENAME = 'index.csv'
+INDEX_FIELDNAMES = ['video_id', 'clip_id', 'shard', 'row']
+
+
+class ShardWriter:
+    """Writes examples to shards of up to shard_size examples each.
+
+    Attributes:
+        output_dir: Path to the directory where the shards are written.
+        columns: The column names of each example, e.g. label and features.
+        shard_size: The number of examples in each full shard.
+        num_examples: The number of examples written so far.
+        num_shards: The number of shards written so far.
+    """
+
+    def __init__(self, output_dir, columns, shard_size=DEFAULT_SHARD_SIZE):
+        """Inits ShardWriter, creating output_dir if it does not exist."""
+        self.output_dir = output_dir
+        self.columns = list(columns)
+        self.shard_size = shard_size
+        self.num_examples = 0
+        self.num_shards = 0
+        self._clip_ids = []
+        self._examples = []
+        os.makedirs(output_dir, exist_ok=True)
+        self._index_file = open(join(output_dir, INDEX_FILENAME), 'w',
+                                newline='')
+        self._index = csv.writer(self._index_file)
+        self._index.writerow(INDEX_FIELDNAMES)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, clip_id, example):
+        """Adds an example, writing out a shard once shard_size are buffered.
+
+        Args:
+            clip_id: The clip_id of the example.
+            example: A list of values, one per column.
+        """
+        self._clip_ids.append(clip_id)
+        self._examples.append(example)
+        self.num_examples += 1
+        if len(self._examples) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered examples out as a shard."""
+        if not self._examples:
+            return
+        shard = SHARD_PATTERN.format(self.num_shards)
+        dataframe = pd.DataFrame(
+            self._examples, columns=self.columns,
+            index=pd.Index(self._clip_ids, name='clip_id'))
+        tmp_path = join(self.output_dir, shard + '.tmp')
+        dataframe.to_pickle(tmp_path)
+        os.replace(tmp_path, join(self.output_dir, shard))
+        for row, clip_id in enumerate(self._clip_ids):
+            video_id, _ = audioset_helper.split_clip_id(clip_id)
+            self._index.writerow([video_id, clip_id, shard, row])
+        self._index_file.flush()
+        logging.info('Wrote {} examples to {}'.format(len(self._examples),
+                                                      shard))
+        self.num_shards += 1
+        self._clip_ids = []
+        self._examples = []
+
+    def close(self):
+        """Writes out the last, possibly partial, shard and the index."""
+        self.flush()
+        self._index_file.close()
+
+
+def load_index(output_dir):
+    """Reads the index of a sharded output directory.
+
+    Args:
+        output_dir: Path to the directory holding the shards.
+
+    Returns:
+        A dictionary with video_id, list of (clip_id, shard filename, row)
+        key-value pairs.
+    """
+    index = {}
+    with open(join(output_dir, INDEX_FILENAME), newline='') as index_file:
+        for row in csv.DictReader(index_file):
+            index.setdefault(row['video_id'], []).append(
+                (row['clip_id'], row['shard'], int(row['row'])))
+    return index
+
+
+def read_examples(output_dir, video_id, index=None):
+    """Reads the examples of every segment of a video from their shards.
+
+    Args:
+        output_dir: Path to the directory holding the shards.
+        video_id: The video_id of the examples.
+        index: The dictionary returned by load_index, which is loaded if None.
+
+    Returns:
+        A dictionary with clip_id, pandas Series key-value pairs, each Series
+        holding the label and features of an example.
+
+    Raises:
+        KeyError: There is no example with the video_id.
+    """
+    if index is None:
+        index = load_index(output_dir)
+    examples = {}
+    for clip_id, shard, row in index[video_id]:
+        examples[clip_id] = pd.read_pickle(join(output_dir, shard)).iloc[row]
+    return examples
+
+
+def shard_paths(output_dir):
+    """Returns the paths of the shards of a sharded output directory in order.
+
+    Args:
+        output_dir: Path to the directory holding the shards.
+    """
+    paths = []
+    path = join(output_dir, SHARD_PATTERN.format(len(paths)))
+    while os.path.isfile(path):
+        paths.append(path)
+        path = join(output_dir, SHARD_PATTERN.format(len(paths)))
+    return paths
+
+
+def read_shards(output_dir):
+    """Yields the shards of a sharded output directory in order.
+
+    Args:
+        output_dir: Path to the directory holding the shards.
+
+    Yields:
+        A pandas DataFrame per shard, indexed by clip_id.
+    """
+    for path in shard_paths(output_dir):
+        yield pd.read_pickle(path)
+
+
+def merge_outputs(input_dirs, output_dir):
+    """Concatenates several sharded output directories into one.
+
+    The shards of each input directory are copied to output_dir in order,
+    renumbered to follow the shards of the previous input directories, and
+    their index entries are rewritten to match.
+
+    Args:
+        input_dirs: A list of paths to the directories holding the shards.
+        output_dir: Path to the directory where the merged shards are
+            written.
+
+    Returns:
+        The number of examples in the merged output.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    num_examples = 0
+    num_shards = 0
+    tmp_index_path = join(output_dir, INDEX_FILENAME + '.tmp')
+    with open(tmp_index_path, 'w', newline='') as index_file:
+        index = csv.writer(index_file)
+        index.writerow(INDEX_FIELDNAMES)
+        for input_dir in input_dirs:
+            shards = {}
+            with open(join(input_dir, INDEX_FILENAME),
+                      newline='') as input_index_file:
+                for row in csv.DictReader(input_index_file):
+                    if row['shard'] not in shards:
+                        shards[row['shard']] = SHARD_PATTERN.format(
+                            num_shards + len(shards))
+                    index.writerow([row['video_id'], row['clip_id'],
+                                    shards[row['shard']], row['row']])
+                    num_examples += 1
+            for shard, merged_shard in shards.items():
+                shutil.copyfile(join(input_dir, shard),
+                                join(output_dir, merged_shard))
+            num_shards += len(shards)
+            logging.info('Merged {} shards of {}'.format(len(shards),
+                                                         input_dir))
+    os.replace(tmp_index_path, join(output_dir, INDEX_FILENAME))
+    return num_examples
@@ -0,0 +1,316 @@
+"""Writes labelled examples to compressed TFRecord shards of bounded size.
+
+Training jobs read their data through tf.data, which streams TFRecord files
+at disk speed and interleaves several of them in parallel, rather than
+unpickling a dataframe. A TFRecordShardWriter serializes every example as a
+SequenceExample, in the layout vggish_inference_demo.py writes embeddings in
+and AudioSet releases its features in: the context holds the video_id, start
+time and label of the clip, and each feature is a feature list holding one
+float feature of its coefficients per frame. A pooled feature, see pooling,
+is a feature list of a single frame.
+
+Records are buffered until the next one would take a shard past
+max_shard_bytes, and the full shard is then compressed and written by a pool
+of threads, which TensorFlow's writer runs outside the GIL, while the next
+shard is filled. At most num_writers shards are waiting to be written at a
+time, so memory stays bounded. A manifest records the number of examples of
+every shard and the number of coefficients of every feature.
+
+merge_tfrecords concatenates the outputs of several runs, such as the shards
+of a dataset ingested on several machines, into one.
+
+TensorFlow is only needed to write the shards, and is imported if it is
+installed.
+
+Output layout:
+OUTPUT_DIR/examples-00000.tfrecord
+OUTPUT_DIR/examples-00001.tfrecord
+...
+OUTPUT_DIR/tfrecord_manifest.json
+
+Typical usage example (training):
+
+manifest = read_manifest(output_dir)
+dataset = tf.data.Dataset.from_tensor_slices(shard_paths(output_dir))
+dataset = dataset.interleave(
+    lambda path: tf.data.TFRecordDataset(
+        path, compression_type=manifest['compression_type']),
+    num_parallel_calls=tf.data.AUTOTUNE, deterministic=False)
+"""
+import collections
+from concurrent import futures
+import json
+import os
+from os.path import join
+import shutil
+from absl import logging
+import numpy as np
+import audioset_helper
+
+try:
+    import tensorflow as tf
+except ImportError:
+    tf = None
+
+SHARD_PATTERN = 'examples-{:05d}.tfrecord'
+MANIFEST_FILENAME = 'tfrecord_manifest.json'
+DEFAULT_MAX_SHARD_BYTES = 128 * 2 ** 20
+DEFAULT_NUM_WRITERS = 4
+# The compressions of TFRecord files, and the compression_type TensorFlow
+# readers and writers take for each.
+COMPRESSION_TYPES = {'GZIP': 'GZIP', 'ZLIB': 'ZLIB', 'NONE': ''}
+
+
+def _check_tensorflow():
+    if tf is None:
+        raise ImportError('Writing TFRecords requires tensorflow, which is '
+                          'not installed')
+
+
+def make_sequence_example(clip_id, example, features):
+    """Builds the SequenceExample of a labelled example.
+
+    Args:
+        clip_id: The clip_id of the example.
+        example: A list holding the label followed by one array per feature,
+            of shape [coefficients, frames], or a pooled vector. Missing
+            features are written as empty feature lists.
+        features: The names of the features of the example.
+
+    Returns:
+        A tf.train.SequenceExample.
+
+    Raises:
+        ImportError: TensorFlow is not installed.
+    """
+    _check_tensorflow()
+    video_id, start_time = audioset_helper.split_clip_id(clip_id)
+    context = tf.train.Features(feature={
+        'clip_id': tf.train.Feature(bytes_list=tf.train.BytesList(
+            value=[clip_id.encode('utf-8')])),
+        'video_id': tf.train.Feature(bytes_list=tf.train.BytesList(
+            value=[video_id.encode('utf-8')])),
+        'start_time_seconds': tf.train.Feature(
+            float_list=tf.train.FloatList(value=[start_time])),
+        'label': tf.train.Feature(int64_list=tf.train.Int64List(
+            value=[int(example[0])])),
+    })
+    feature_lists = {}
+    for i, feature in enumerate(features):
+        frames = []
+        if i + 1 < len(example):
+            frames = _frames(example[i + 1])
+        feature_lists[feature] = tf.train.FeatureList(feature=[
+            tf.train.Feature(float_list=tf.train.FloatList(value=frame))
+            for frame in frames])
+    return tf.train.SequenceExample(
+        context=context,
+        feature_lists=tf.train.FeatureLists(feature_list=feature_lists))
+
+
+def _frames(feature):
+    # A [frames, coefficients] view of a feature, with a pooled vector as a
+    # single frame.
+    array = np.asarray(feature, dtype=np.float32)
+    if array.ndim == 1:
+        return array[np.newaxis]
+    return array.T
+
+
+class TFRecordShardWriter:
+    """Writes examples to compressed TFRecord shards of bounded size.
+
+    Has the same interface as sharded_output.ShardWriter.
+
+    Attributes:
+        output_dir: Path to the directory where the shards are written.
+        features: The names of the features of each example.
+        max_shard_bytes: The size of the records of a shard, before
+            compression, past which a new shard is started. A record larger
+            than that is written to a shard of its own.
+        compression: The compression of the shards, one of COMPRESSION_TYPES.
+        num_writers: The number of shards written at the same time.
+        num_examples: The number of examples written so far.
+        num_shards: The number of shards written so far.
+    """
+
+    def __init__(self, output_dir, features,
+                 max_shard_bytes=DEFAULT_MAX_SHARD_BYTES, compression='GZIP',
+                 num_writers=DEFAULT_NUM_WRITERS):
+        """Inits TFRecordShardWriter, creating output_dir if it does not exist.
+
+        Raises:
+            ImportError: TensorFlow is not installed.
+            ValueError: The compression is not supported.
+        """
+        _check_tensorflow()
+        if compression not in COMPRESSION_TYPES:
+            raise ValueError('Unsupported compression: {}'.format(
+                compression))
+        self.output_dir = output_dir
+        self.features = list(features)
+        self.max_shard_bytes = max_shard_bytes
+        self.compression = compression
+        self.num_writers = num_writers
+        self.num_examples = 0
+        self.num_shards = 0
+        self._records = []
+        self._record_bytes = 0
+        self._shards = []
+        self._num_coefficients = {}
+        self._pending = collections.deque()
+        self._executor = futures.ThreadPoolExecutor(max_workers=num_writers)
+        os.makedirs(output_dir, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, clip_id, example):
+        """Adds an example, handing the shard to a writer once it is full.
+
+        Args:
+            clip_id: The clip_id of the example.
+            example: A list holding the label followed by one array per
+                feature.
+        """
+        record = make_sequence_example(clip_id, example,
+                                       self.features).SerializeToString()
+        if (self._records and
+                self._record_bytes + len(record) > self.max_shard_bytes):
+            self.flush()
+        self._records.append(record)
+        self._record_bytes += len(record)
+        self.num_examples += 1
+        for feature, extracted_feature in zip(self.features, example[1:]):
+            if feature not in self._num_coefficients:
+                self._num_coefficients[feature] = _frames(
+                    extracted_feature).shape[1]
+
+    def flush(self):
+        """Hands the buffered records to a writer as a shard."""
+        if not self._records:
+            return
+        shard = SHARD_PATTERN.format(self.num_shards)
+        self._shards.append({'file': shard,
+                             'num_examples': len(self._records),
+                             'record_bytes': self._record_bytes})
+        while len(self._pending) >= self.num_writers:
+            self._pending.popleft().result()
+        self._pending.append(self._executor.submit(
+            _write_shard, join(self.output_dir, shard), self._records,
+            COMPRESSION_TYPES[self.compression]))
+        self.num_shards += 1
+        self._records = []
+        self._record_bytes = 0
+
+    def close(self):
+        """Writes out the last, possibly partial, shard and the manifest."""
+        try:
+            self.flush()
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            self._executor.shutdown()
+        write_manifest(self.output_dir, {
+            'features': self.features,
+            'compression_type': COMPRESSION_TYPES[self.compression],
+            'num_examples': self.num_examples,
+            'num_coefficients': self._num_coefficients,
+            'shards': self._shards,
+        })
+
+
+def _write_shard(path, records, compression_type):
+    """Writes serialized records to a TFRecord file, through a rename."""
+    tmp_path = path + '.tmp'
+    options = tf.io.TFRecordOptions(compression_type=compression_type)
+    with tf.io.TFRecordWriter(tmp_path, options) as writer:
+        for record in records:
+            writer.write(record)
+    os.replace(tmp_path, path)
+    logging.info('Wrote {} examples to {}'.format(len(records), path))
+
+
+def write_manifest(output_dir, manifest):
+    """Writes the manifest of a TFRecord output directory, through a rename.
+
+    Args:
+        output_dir: Path to the output directory.
+        manifest: A dictionary of the features, compression_type,
+            num_examples, num_coefficients and shards of the output.
+    """
+    tmp_path = join(output_dir, MANIFEST_FILENAME + '.tmp')
+    with open(tmp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(tmp_path, join(output_dir, MANIFEST_FILENAME))
+
+
+def read_manifest(output_dir):
+    """Reads the manifest of a TFRecord output directory.
+
+    Returns:
+        A dictionary of the features, compression_type, num_examples,
+        num_coefficients of each feature, and shards of the output, each
+        shard a dictionary of its file, num_examples and record_bytes.
+    """
+    with open(join(output_dir, MANIFEST_FILENAME)) as manifest_file:
+        return json.load(manifest_file)
+
+
+def shard_paths(output_dir, manifest=None):
+    """Returns the paths of the shards of a TFRecord output directory.
+
+    Args:
+        output_dir: Path to the output directory.
+        manifest: The manifest of the directory. Defaults to reading it.
+    """
+    if manifest is None:
+        manifest = read_manifest(output_dir)
+    return [join(output_dir, shard['file']) for shard in manifest['shards']]
+
+
+def merge_tfrecords(input_dirs, output_dir):
+    """Concatenates several TFRecord output directories into one.
+
+    The shards of each input directory are copied to output_dir in order,
+    renumbered to follow the shards of the previous input directories, and
+    their manifests are combined.
+
+    Args:
+        input_dirs: A list of paths to the TFRecord output directories.
+        output_dir: Path to the directory where the merged shards are
+            written.
+
+    Returns:
+        The number of examples in the merged output.
+
+    Raises:
+        ValueError: The inputs hold different features or compressions.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    merged = None
+    for input_dir in input_dirs:
+        manifest = read_manifest(input_dir)
+        if merged is None:
+            merged = dict(manifest, num_examples=0, shards=[],
+                          num_coefficients={})
+        elif (manifest['features'] != merged['features'] or
+              manifest['compression_type'] != merged['compression_type']):
+            raise ValueError('{} holds different features or a different '
+                             'compression'.format(input_dir))
+        for shard in manifest['shards']:
+            merged_shard = SHARD_PATTERN.format(len(merged['shards']))
+            shutil.copyfile(join(input_dir, shard['file']),
+                            join(output_dir, merged_shard))
+            merged['shards'].append(dict(shard, file=merged_shard))
+        for feature, num_coefficients in manifest[
+                'num_coefficients'].items():
+            merged['num_coefficients'].setdefault(feature, num_coefficients)
+        merged['num_examples'] += manifest['num_examples']
+        logging.info('Merged {} shards of {}'.format(len(manifest['shards']),
+                                                     input_dir))
+    write_manifest(output_dir, merged)
+    return merged['num_examples']
@@ -1,7 +1,16 @@
 import datetime
+from os.path import join
+import shutil
+import tempfile
 import unittest
 from unittest import TestCase
+import numpy as np
 from ..dataprocessing import audio_processing as ap
+from ..dataprocessing import merge_outputs
+from .test_downloader import write_wav
+
+ONTOLOGY_PATH = ('location/lbs/activity/audioset/dataprocessing/example_src_dir'
+                 '/ontology.json')
 
 
 class AudioProcessingTest(TestCase):
@@ -37,5 +46,147 @@ class AudioProcessingTest(TestCase):
         print(end_time - begin_time)
 
 
+
+class IsPositiveExampleTest(TestCase):
+
+    def test_checks_every_label(self):
+        labels_set = {'/m/032s66'}
+        self.assertTrue(ap.is_positive_example(['/m/032s66'], labels_set))
+        self.assertTrue(ap.is_positive_example(['/m/09x0r', '/m/032s66'],
+                                               labels_set))
+        self.assertFalse(ap.is_positive_example(['/m/09x0r'], labels_set))
+
+
+class OutputDataframeTest(TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        self.dest_dir = tempfile.mkdtemp()
+        shutil.copy(ONTOLOGY_PATH, self.src_dir)
+        rows = [('vid0', '"/m/032s66"'), ('vid1', '"/m/09x0r,/m/032s66"'),
+                ('broken', '"/m/09x0r"'), ('vid2', '"/m/09x0r"'),
+                ('vid3', '"/m/04zjc"')]
+        with open(join(self.src_dir, 'segments.csv'), 'w') as csv_file:
+            csv_file.write('# YTID, start_seconds, end_seconds, '
+                           'positive_labels\n')
+            for video_id, labels in rows:
+                csv_file.write('{}, 0.000, 2.000, {}\n'.format(video_id,
+                                                             labels))
+        yt_videos = join(self.dest_dir, 'yt_videos')
+        ap.audioset_helper.check_dir(yt_videos)
+        for video_id, _ in rows:
+            path = join(yt_videos, 'sliced_' + video_id + '_0.wav')
+            if video_id == 'broken':
+                with open(path, 'wb') as wav_file:
+                    wav_file.write(b'RIFF not really a wav file')
+            else:
+                write_wav(path, 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+        shutil.rmtree(self.dest_dir)
+
+    def test_parallel_extraction_matches_serial(self):
+        features = ['mfcc', 'zero_crossing_rate']
+        serial = ap.output_df(self.src_dir, self.dest_dir, 'segments',
+                              ['Gunshot, gunfire'], features)
+        parallel = ap.output_df(self.src_dir, self.dest_dir, 'segments',
+                                ['Gunshot, gunfire'], features,
+                                extract_workers=2, extract_chunksize=1)
+        self.assertEqual(list(serial['label']), [1, 1, 0, 1])
+        self.assertEqual(list(parallel['label']), list(serial['label']))
+        for feature in features:
+            for expected, actual in zip(serial[feature], parallel[feature]):
+                np.testing.assert_allclose(actual, expected)
+
+    def test_pipelined_extraction_matches_serial(self):
+        features = ['mfcc']
+        serial = ap.output_df(self.src_dir, self.dest_dir, 'segments',
+                              ['Gunshot, gunfire'], features)
+        examples = dict(ap.generate_examples(
+            self.src_dir, self.dest_dir, 'segments', ['Gunshot, gunfire'],
+            features, download_workers=2, extract_workers=2, pipelined=True))
+        self.assertEqual(sorted(examples),
+                         ['vid0_0', 'vid1_0', 'vid2_0', 'vid3_0'])
+        for i, clip_id in enumerate(sorted(examples)):
+            self.assertEqual(examples[clip_id][0], serial['label'][i])
+            np.testing.assert_allclose(examples[clip_id][1],
+                                       serial['mfcc'][i])
+
+    def test_profiler_records_every_stage(self):
+        profiler = ap.profiling.Profiler()
+        ap.output_df(self.src_dir, self.dest_dir, 'segments',
+                     ['Gunshot, gunfire'], ['mfcc', 'rms'],
+                     extract_workers=2, profiler=profiler)
+        summaries = profiler.stage_summaries()
+        for stage in ['parse', 'download_phase', 'dataframe', 'extract']:
+            self.assertIn(stage, summaries)
+        self.assertEqual(summaries['extract']['count'], 5)
+        self.assertEqual(summaries['decode']['count'], 5)
+        self.assertEqual(summaries['feature:mfcc']['count'], 4)
+        self.assertEqual(profiler.num_clips, 4)
+
+    def test_pooled_features(self):
+        features = ['mfcc', 'rms']
+        dataframe = ap.output_df(self.src_dir, self.dest_dir, 'segments',
+                                 ['Gunshot, gunfire'], features)
+        pooled = ap.output_df(self.src_dir, self.dest_dir, 'segments',
+                              ['Gunshot, gunfire'], features,
+                              extract_workers=2, statistics=['mean', 'p90'])
+        self.assertEqual(list(pooled['label']), list(dataframe['label']))
+        for feature, num_coefficients in [('mfcc', 20), ('rms', 1)]:
+            for expected, actual in zip(dataframe[feature], pooled[feature]):
+                self.assertEqual(actual.shape, (2 * num_coefficients,))
+                np.testing.assert_allclose(
+                    actual, ap.pooling.pool(expected, ['mean', 'p90']))
+
+    def test_output_shards_matches_dataframe(self):
+        features = ['mfcc']
+        dataframe = ap.output_df(self.src_dir, self.dest_dir, 'segments',
+                                 ['Gunshot, gunfire'], features)
+        output_dir = join(self.dest_dir, 'examples')
+        num_examples = ap.output_shards(
+            output_dir, self.src_dir, self.dest_dir, 'segments',
+            ['Gunshot, gunfire'], features, extract_workers=2, shard_size=3)
+        self.assertEqual(num_examples, 4)
+        shards = list(ap.sharded_output.read_shards(output_dir))
+        self.assertEqual([len(shard) for shard in shards], [3, 1])
+        self.assertEqual(list(shards[0].index),
+                         ['vid0_0', 'vid1_0', 'vid2_0'])
+        index = ap.sharded_output.load_index(output_dir)
+        self.assertEqual(index['vid3'], [('vid3_0', 'examples-00001.pkl', 0)])
+        examples = ap.sharded_output.read_examples(output_dir, 'vid3', index)
+        example = examples['vid3_0']
+        self.assertEqual(example['label'], 1)
+        np.testing.assert_allclose(example['mfcc'], dataframe['mfcc'][3])
+
+    def test_sharded_outputs_merge_into_dataframe(self):
+        features = ['mfcc']
+        dataframe = ap.output_df(self.src_dir, self.dest_dir, 'segments',
+                                 ['Gunshot, gunfire'], features)
+        shard_dirs = []
+        for shard_index in range(3):
+            shard_dirs.append(join(self.dest_dir, 'examples',
+                                   ap.audioset_helper.shard_name(
+                                       shard_index, 3)))
+            ap.output_shards(shard_dirs[-1], self.src_dir, self.dest_dir,
+                             'segments', ['Gunshot, gunfire'], features,
+                             num_shards=3, shard_index=shard_index,
+                             shard_size=1)
+        merged_dir = join(self.dest_dir, 'merged')
+        self.assertEqual(merge_outputs.merge(shard_dirs, merged_dir), 4)
+        merged = ap.pd.concat(ap.sharded_output.read_shards(merged_dir))
+        self.assertEqual(sorted(merged.index),
+                         ['vid0_0', 'vid1_0', 'vid2_0', 'vid3_0'])
+        index = ap.sharded_output.load_index(merged_dir)
+        for i, clip_id in enumerate(['vid0_0', 'vid1_0', 'vid2_0',
+                                     'vid3_0']):
+            video_id = clip_id.split('_')[0]
+            example = ap.sharded_output.read_examples(
+                merged_dir, video_id, index)[clip_id]
+            self.assertEqual(example['label'], dataframe['label'][i])
+            np.testing.assert_allclose(example['mfcc'], dataframe['mfcc'][i])
+
+
 if __name__ == '__main__':
     unittest.main()
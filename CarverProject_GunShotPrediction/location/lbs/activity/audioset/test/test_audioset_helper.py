@@ -0,0 +1,121 @@
+from os.path import join
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+import numpy as np
+from ..dataprocessing import audioset_helper
+
+CSV = '''# Segments csv created Sun Mar  5 10:54:31 2017
+# num_ytids=3, num_segs=4, num_unique_labels=3, num_positive_labels=6
+# YTID, start_seconds, end_seconds, positive_labels
+--PJHxphWEs, 30.000, 40.000, "/m/09x0r,/t/dd00088"
+--PJHxphWEs, 50.000, 60.000, "/m/032s66"
+-0SdAVK79lg, 0.000, 10.000, "/m/032s66"
+zzya4dDVRLk, 30.500, 40.500, "/t/dd00088,/m/032s66,/m/09x0r"
+'''
+
+
+class AudiosetHelperTest(TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        with open(join(self.src_dir, 'segments.csv'), 'w') as csv_file:
+            csv_file.write(CSV)
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+
+    def test_parse_segments(self):
+        table = audioset_helper.parse_segments(
+            join(self.src_dir, 'segments.csv'))
+        self.assertEqual(len(table), 4)
+        self.assertEqual(list(table.video_ids), ['--PJHxphWEs', '--PJHxphWEs',
+                                                 '-0SdAVK79lg', 'zzya4dDVRLk'])
+        self.assertEqual(list(table.start_times), [30, 50, 0, 30.5])
+        self.assertEqual(list(table.end_times), [40, 60, 10, 40.5])
+        self.assertEqual(table.label_vocab,
+                         ['/m/09x0r', '/t/dd00088', '/m/032s66'])
+        self.assertEqual(list(table.label_ids(0)), [0, 1])
+        self.assertEqual(list(table.label_ids(3)), [1, 2, 0])
+
+    def test_parse_segments_without_labels(self):
+        with open(join(self.src_dir, 'unlabelled.csv'), 'w') as csv_file:
+            csv_file.write('--PJHxphWEs, 30.000, 40.000, ""\n'
+                           '-0SdAVK79lg, 0.000, 10.000, "/m/032s66"\n'
+                           'zzya4dDVRLk, 30.500, 40.500,\n')
+        table = audioset_helper.parse_segments(
+            join(self.src_dir, 'unlabelled.csv'))
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.label_vocab, ['/m/032s66'])
+        self.assertEqual(list(table.label_ids(0)), [])
+        self.assertEqual(list(table.label_ids(1)), [0])
+        self.assertEqual(list(table.label_ids(2)), [])
+
+    def test_parse_segments_with_empty_tokens(self):
+        with open(join(self.src_dir, 'commas.csv'), 'w') as csv_file:
+            csv_file.write('vidA, 0.000, 10.000, "/m/a,"\n'
+                           'vidB, 0.000, 10.000, "/m/b,,/m/c"\n'
+                           'vidC, 0.000, 10.000, ", /m/c"\n'
+                           'vidD, 0.000, 10.000, "/m/d"\n')
+        table = audioset_helper.parse_segments(
+            join(self.src_dir, 'commas.csv'))
+        self.assertEqual(table.label_vocab, ['/m/a', '/m/b', '/m/c', '/m/d'])
+        self.assertEqual([list(table.label_ids(i)) for i in range(4)],
+                         [[0], [1, 2], [2], [3]])
+        table = audioset_helper.parse_segments(
+            join(self.src_dir, 'commas.csv'), ['/m/c', '/m/d'])
+        self.assertEqual([list(table.label_ids(i)) for i in range(4)],
+                         [[], [0], [0], [1]])
+
+    def test_select_shard(self):
+        table = audioset_helper.parse_segments(
+            join(self.src_dir, 'segments.csv'))
+        self.assertEqual(audioset_helper.shard_of('--PJHxphWEs', 1), 0)
+        self.assertEqual(audioset_helper.shard_of('abc', 1000), 578)
+        masks = [table.select_shard(3, i) for i in range(3)]
+        np.testing.assert_array_equal(np.sum(masks, axis=0), [1, 1, 1, 1])
+        for i, mask in enumerate(masks):
+            for video_id in table.video_ids[mask]:
+                self.assertEqual(audioset_helper.shard_of(video_id, 3), i)
+        self.assertEqual(audioset_helper.shard_name(3, 8),
+                         'shard-00003-of-00008')
+        with self.assertRaises(ValueError):
+            table.select_shard(3, 3)
+
+    def test_parse_segments_with_vocab(self):
+        table = audioset_helper.parse_segments(
+            join(self.src_dir, 'segments.csv'), ['/m/032s66', '/m/09x0r'])
+        self.assertEqual(list(table.label_ids(0)), [1])
+        self.assertEqual(list(table.label_ids(1)), [0])
+        self.assertEqual(list(table.label_ids(3)), [0, 1])
+
+    def test_label_matrix(self):
+        table = audioset_helper.parse_segments(
+            join(self.src_dir, 'segments.csv'))
+        np.testing.assert_array_equal(table.label_matrix().toarray(),
+                                      [[1, 1, 0], [0, 0, 1], [0, 0, 1],
+                                       [1, 1, 1]])
+        np.testing.assert_array_equal(table.select_positive([2]),
+                                      [False, True, True, True])
+        positives = table.select_positives([[0], [1, 2], []])
+        np.testing.assert_array_equal(positives, [[True, True, False],
+                                                  [False, True, False],
+                                                  [False, True, False],
+                                                  [True, True, False]])
+
+    def test_parse_metadata_keeps_every_segment(self):
+        audio_dict = audioset_helper.parse_metadata(self.src_dir, 'segments')
+        self.assertEqual(len(audio_dict), 4)
+        entry = audio_dict[('--PJHxphWEs', 50.0)]
+        self.assertEqual(entry.end_time, 60)
+        self.assertEqual(entry.labels, ['/m/032s66'])
+        self.assertEqual(entry.clip_id, '--PJHxphWEs_50000')
+        self.assertEqual(audio_dict[('zzya4dDVRLk', 30.5)].clip_id,
+                         'zzya4dDVRLk_30500')
+        self.assertEqual(audioset_helper.split_clip_id('zzya4dDVRLk_30500'),
+                         ('zzya4dDVRLk', 30.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
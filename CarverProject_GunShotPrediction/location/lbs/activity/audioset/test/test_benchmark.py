@@ -0,0 +1,59 @@
+import json
+from os.path import join
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+from ..dataprocessing import audioset_helper
+from ..dataprocessing import benchmark
+from ..dataprocessing import downloader
+from .test_audio_processing import ONTOLOGY_PATH
+
+
+class BenchmarkTest(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_generate_dataset(self):
+        benchmark.generate_dataset(self.work_dir, 3, 2, 20, 8000, 2, 5,
+                                   ontology_path=ONTOLOGY_PATH)
+        src_dir = join(self.work_dir, 'src')
+        audio_dict = audioset_helper.parse_metadata(src_dir,
+                                                    benchmark.CSV_NAME)
+        self.assertEqual(sorted(audio_dict), [
+            ('bench0000000', 0.0), ('bench0000000', 10.0),
+            ('bench0000001', 0.0), ('bench0000001', 10.0),
+            ('bench0000002', 0.0), ('bench0000002', 10.0)])
+        with open(join(src_dir, 'ontology.json')) as ontology_file:
+            labels = json.load(ontology_file)
+        self.assertEqual(len(labels), 5)
+        label_ids = {label['id'] for label in labels}
+        for label in labels:
+            self.assertTrue(set(label['child_ids']) <= label_ids)
+        with self.assertRaises(ValueError):
+            benchmark.generate_dataset(self.work_dir, 1, 3, 20, 8000, 1, 5)
+
+    def test_run_benchmarks(self):
+        benchmark.generate_dataset(self.work_dir, 2, 1, 12, 8000, 2, 7)
+        results = benchmark.run_benchmarks(self.work_dir, ['mfcc', 'rms'], 1)
+        self.assertEqual([result['name'] for result in results], [
+            'ontology', 'parse_segments', 'parse_metadata', 'download',
+            'chop', 'feature:mfcc', 'feature:rms', 'features:all',
+            'batch:mfcc', 'batch:rms'])
+        items = {result['name']: result['items'] for result in results}
+        self.assertEqual(items['ontology'], 7)
+        self.assertEqual(items['chop'], 2)
+        self.assertEqual(items['feature:mfcc'], 1)
+        for result in results:
+            self.assertGreater(result['items_per_second'], 0)
+            self.assertGreaterEqual(result['peak_mb'], 0)
+        self.assertEqual(len(downloader.ClipIndex(
+            join(self.work_dir, 'download'))), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
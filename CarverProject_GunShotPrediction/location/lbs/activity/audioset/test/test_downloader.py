@@ -0,0 +1,264 @@
+import functools
+import http.server
+import os
+from os.path import isdir, isfile, join
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+import wave
+from unittest import TestCase
+import numpy as np
+import soundfile
+from ..dataprocessing import audioset_helper
+from ..dataprocessing import downloader
+from ..dataprocessing import ingest_manifest
+
+
+def write_wav(path, seconds, sample_rate=8000):
+    with wave.open(path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        frames = [(i * 37) % 2000 - 1000 for i in range(seconds * sample_rate)]
+        wav_file.writeframes(struct.pack('<{}h'.format(len(frames)), *frames))
+
+
+class DownloaderTest(TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        self.dest_dir = tempfile.mkdtemp()
+        self.available = ['vid{}'.format(i) for i in range(6)]
+        for video_id in self.available:
+            write_wav(join(self.src_dir, video_id + '.wav'), 3)
+        self.audio_dict = {}
+        for video_id in self.available + ['missing0', 'missing1']:
+            entry = audioset_helper.AudioSetEntry(video_id, 1.0, 2.0,
+                                                  ['/m/032s66'])
+            self.audio_dict[entry.key] = entry
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+        shutil.rmtree(self.dest_dir)
+
+    def test_download_from_list_concurrent(self):
+        fetcher = downloader.LocalFileFetcher(self.src_dir)
+        downloader.download_from_list(self.dest_dir, self.audio_dict, False,
+                                      num_workers=4, fetcher=fetcher)
+        self.assertEqual(sorted(self.audio_dict),
+                         [(video_id, 1.0) for video_id in self.available])
+        for video_id in self.available:
+            path = join(self.dest_dir, 'yt_videos',
+                        'sliced_' + video_id + '_1000.wav')
+            with wave.open(path) as wav_file:
+                self.assertEqual(wav_file.getnchannels(), 1)
+                self.assertEqual(wav_file.getframerate(),
+                                 downloader.feature_extraction.SAMPLING_RATE)
+                self.assertEqual(wav_file.getnframes(), 22050)
+        self.assertEqual(downloader.get_failed_downloads(self.dest_dir),
+                         {'missing0', 'missing1'})
+        self.assertFalse(isdir(join(self.dest_dir, 'tmp')))
+
+    def test_download_from_list_skips_failed(self):
+        downloader.store_failed_download(
+            self.dest_dir, 'vid0', downloader.DownloadError('Private video'))
+        fetcher = downloader.LocalFileFetcher(self.src_dir)
+        downloader.download_from_list(self.dest_dir, self.audio_dict, False,
+                                      num_workers=2, fetcher=fetcher)
+        self.assertNotIn(('vid0', 1.0), self.audio_dict)
+        self.assertFalse(isfile(join(self.dest_dir, 'yt_videos',
+                                     'sliced_vid0_1000.wav')))
+        self.assertEqual(len(self.audio_dict), len(self.available) - 1)
+
+    def test_download_from_list_multiple_segments(self):
+        entry = audioset_helper.AudioSetEntry('vid0', 0.0, 1.5, ['/m/09x0r'])
+        self.audio_dict[entry.key] = entry
+        fetcher = downloader.LocalFileFetcher(self.src_dir)
+        downloader.download_from_list(self.dest_dir, self.audio_dict, False,
+                                      num_workers=3, fetcher=fetcher)
+        self.assertIn(('vid0', 0.0), self.audio_dict)
+        self.assertIn(('vid0', 1.0), self.audio_dict)
+        for clip_id, frames in [('vid0_0', 33075), ('vid0_1000', 22050)]:
+            path = downloader.clip_path(self.dest_dir, clip_id)
+            with wave.open(path) as wav_file:
+                self.assertEqual(wav_file.getnframes(), frames)
+
+    def test_clip_index(self):
+        yt_videos = join(self.dest_dir, 'yt_videos')
+        audioset_helper.check_dir(yt_videos)
+        for name in ['sliced_vid0_1000.wav', 'sliced_vid1_1000.wav.part',
+                     'notes.txt']:
+            open(join(yt_videos, name), 'w').close()
+        clip_index = downloader.ClipIndex(self.dest_dir)
+        self.assertEqual(len(clip_index), 1)
+        self.assertIn('vid0_1000', clip_index)
+        fetcher = RecordingFetcher(self.src_dir)
+        downloader.download_from_list(self.dest_dir, self.audio_dict, False,
+                                      num_workers=4, fetcher=fetcher,
+                                      clip_index=clip_index)
+        self.assertNotIn('vid0', fetcher.tmp_paths)
+        for video_id in self.available:
+            self.assertIn(video_id + '_1000', clip_index)
+
+    def test_downloads_into_private_tmp_dirs(self):
+        fetcher = RecordingFetcher(self.src_dir)
+        downloader.download_from_list(self.dest_dir, self.audio_dict, False,
+                                      num_workers=4, fetcher=fetcher)
+        tmp_paths = list(fetcher.tmp_paths.values())
+        self.assertEqual(len(set(tmp_paths)), len(self.available) + 2)
+        for tmp_path in tmp_paths:
+            self.assertEqual(os.path.dirname(tmp_path),
+                             join(self.dest_dir, 'tmp'))
+        self.assertFalse(isdir(join(self.dest_dir, 'tmp')))
+
+    def test_extract_segment_seeks_and_downmixes(self):
+        src_path = join(self.src_dir, 'stereo.wav')
+        samples = np.arange(4 * 8000, dtype=np.int16) % 10000
+        audio = np.stack([samples + 100, samples - 100], axis=1)
+        soundfile.write(src_path, audio, 8000, subtype='PCM_16')
+        wav_path = join(self.dest_dir, 'segment.wav')
+        downloader.extract_segment(src_path, wav_path, 1.5, 2.5, 8000)
+        clip, sample_rate = soundfile.read(wav_path, dtype='int16')
+        self.assertEqual(sample_rate, 8000)
+        self.assertEqual(clip.shape, (8000,))
+        np.testing.assert_array_equal(clip, samples[12000:20000])
+        downloader.extract_segment(src_path, wav_path, 3.5, 10.0, 4000)
+        clip, sample_rate = soundfile.read(wav_path)
+        self.assertEqual((len(clip), sample_rate), (2000, 4000))
+        self.assertEqual(os.listdir(self.dest_dir), ['segment.wav'])
+
+
+class RecordingFetcher(downloader.LocalFileFetcher):
+    """Records the directory each video is fetched into."""
+
+    def __init__(self, src_dir):
+        super().__init__(src_dir)
+        self.tmp_paths = {}
+
+    def fetch(self, video_id, tmp_path):
+        self.tmp_paths[video_id] = tmp_path
+        assert not os.listdir(tmp_path)
+        super().fetch(video_id, tmp_path)
+
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the files of a directory, honouring single byte ranges."""
+
+    def __init__(self, *args, directory, served, **kwargs):
+        self.directory = directory
+        self.served = served
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        path = join(self.directory, os.path.basename(self.path))
+        if not isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as file:
+            data = file.read()
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if match:
+            first, last = int(match.group(1)), int(match.group(2))
+            data = data[first:last + 1]
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.served.append(len(data))
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class RangedDownloadTest(TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        self.dest_dir = tempfile.mkdtemp()
+        write_wav(join(self.src_dir, 'long.wav'), 60)
+        self.served = []
+        handler = functools.partial(RangeRequestHandler,
+                                    directory=self.src_dir,
+                                    served=self.served)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      handler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.fetcher = downloader.HttpRangeFetcher(
+            'http://127.0.0.1:{}/'.format(self.server.server_address[1]))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.src_dir)
+        shutil.rmtree(self.dest_dir)
+
+    def test_fetches_only_the_window(self):
+        audio_dict = {}
+        for video_id, start_time in [('long', 30.0), ('long', 50.5),
+                                     ('missing', 0.0)]:
+            entry = audioset_helper.AudioSetEntry(video_id, start_time,
+                                                  start_time + 2, [])
+            audio_dict[entry.key] = entry
+        downloader.download_from_list(self.dest_dir, audio_dict, False,
+                                      num_workers=2, fetcher=self.fetcher,
+                                      sample_rate=8000, ranged=True)
+        self.assertEqual(sorted(audio_dict), [('long', 30.0), ('long', 50.5)])
+        # A header request and two seconds of 16-bit frames per segment.
+        self.assertEqual(sum(self.served),
+                         2 * (downloader.WAV_HEADER_BYTES + 2 * 16000))
+        full, _ = soundfile.read(join(self.src_dir, 'long.wav'),
+                                 dtype='int16')
+        for clip_id, start_frame in [('long_30000', 240000),
+                                     ('long_50500', 404000)]:
+            clip, sample_rate = soundfile.read(
+                downloader.clip_path(self.dest_dir, clip_id), dtype='int16')
+            self.assertEqual(sample_rate, 8000)
+            np.testing.assert_array_equal(
+                clip, full[start_frame:start_frame + 16000])
+        self.assertEqual(downloader.get_failed_downloads(self.dest_dir),
+                         {'missing'})
+
+    def test_failed_window_keeps_chopped_segments(self):
+        fetch_range = self.fetcher.fetch_range
+
+        def fail_second_window(video_id, tmp_path, start_time, end_time):
+            if start_time == 30.0:
+                raise downloader.DownloadError('unavailable', permanent=True)
+            return fetch_range(video_id, tmp_path, start_time, end_time)
+
+        self.fetcher.fetch_range = fail_second_window
+        entries = [audioset_helper.AudioSetEntry('long', start_time,
+                                                 start_time + 2, [])
+                   for start_time in (10.0, 30.0, 50.0)]
+        os.mkdir(join(self.dest_dir, 'yt_videos'))
+        manifest = ingest_manifest.IngestManifest(
+            join(self.dest_dir, 'manifest.sqlite'))
+        self.addCleanup(manifest.close)
+        manifest.add_segments(entries)
+        available = downloader.download_and_chop(
+            self.dest_dir, 'long', entries, False, self.fetcher, manifest,
+            sample_rate=8000, ranged=True)
+        self.assertEqual(available, entries[:1])
+        self.assertTrue(isfile(downloader.clip_path(self.dest_dir,
+                                                    'long_10000')))
+        self.assertEqual(manifest.states(), {
+            'long_10000': ingest_manifest.CHOPPED,
+            'long_30000': ingest_manifest.FAILED,
+            'long_50000': ingest_manifest.FAILED})
+
+    def test_fetch_downloads_whole_file(self):
+        with self.assertRaises(downloader.DownloadError):
+            downloader._parse_wav_header(b'RIFF\0\0\0\0WAVEdata')
+        self.fetcher.fetch('long', self.dest_dir)
+        self.assertEqual(self.served, [os.path.getsize(
+            join(self.src_dir, 'long.wav'))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+from os.path import join
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+import numpy as np
+from ..dataprocessing import example_loader
+from ..dataprocessing import feature_store
+from ..dataprocessing import sharded_output
+
+
+class ExampleLoaderTest(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        # The features of example i are filled with i, and vary in frames.
+        self.examples = []
+        for i in range(20):
+            clip_id = 'vid{}_0'.format(i)
+            if i == 7:
+                self.examples.append((clip_id, [0]))
+                continue
+            self.examples.append((clip_id, [i % 2, np.full((4, 5 + i % 3), i),
+                                            np.full((1, 5 + i % 3), i)]))
+        self.expected = [i for i in range(20) if i != 7]
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def write(self, writer):
+        with writer:
+            for clip_id, example in self.examples:
+                writer.write(clip_id, example)
+
+    def check_epochs(self, loader, num_epochs):
+        seen = []
+        for batch, labels in loader:
+            self.assertEqual(batch['mfcc'].shape[1:], (4, 6))
+            self.assertEqual(batch['mfcc'].dtype, np.float32)
+            ids = batch['mfcc'][:, 0, 0].astype(int).tolist()
+            np.testing.assert_array_equal(labels, [i % 2 for i in ids])
+            np.testing.assert_array_equal(batch['rms'][:, 0, 0], ids)
+            seen.extend(ids)
+        self.assertEqual(sorted(seen), sorted(self.expected * num_epochs))
+        return seen
+
+    def test_feature_store(self):
+        store_dir = join(self.output_dir, 'store')
+        self.write(feature_store.FeatureStoreWriter(store_dir,
+                                                    ['mfcc', 'rms']))
+        loader = example_loader.ExampleLoader(
+            store_dir, batch_size=4, shuffle_buffer=5, num_frames=6,
+            drop_remainder=False, num_epochs=2, seed=0, num_workers=2,
+            prefetch_chunks=2, chunk_size=3)
+        first = self.check_epochs(loader, 2)
+        self.assertNotEqual(first, sorted(first))
+        self.assertEqual(self.check_epochs(loader, 2), first)
+
+    def test_shards(self):
+        shards_dir = join(self.output_dir, 'shards')
+        self.write(sharded_output.ShardWriter(
+            shards_dir, ['label', 'mfcc', 'rms'], shard_size=6))
+        loader = example_loader.ExampleLoader(
+            shards_dir, ['mfcc', 'rms'], batch_size=19, num_frames=6,
+            seed=1)
+        self.check_epochs(loader, 1)
+        loader = example_loader.ExampleLoader(
+            shards_dir, ['mfcc', 'rms'], batch_size=4, shuffle_buffer=1,
+            num_frames=6)
+        batches = list(loader)
+        self.assertEqual(len(batches), 4)
+        np.testing.assert_array_equal(batches[0][0]['rms'][:, 0, 0],
+                                      [0, 1, 2, 3])
+
+    def test_different_shapes(self):
+        store_dir = join(self.output_dir, 'store')
+        self.write(feature_store.FeatureStoreWriter(store_dir, ['mfcc']))
+        with self.assertRaises(ValueError):
+            list(example_loader.ExampleLoader(store_dir, batch_size=4))
+        with self.assertRaises(ValueError):
+            example_loader.ExampleLoader(store_dir, ['tonnetz'])
+
+
+if __name__ == '__main__':
+    unittest.main()
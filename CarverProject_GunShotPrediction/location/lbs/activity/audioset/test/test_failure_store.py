@@ -0,0 +1,152 @@
+from os.path import isfile, join
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import TestCase
+from ..dataprocessing import audioset_helper
+from ..dataprocessing import downloader
+from ..dataprocessing import failure_store
+from .test_downloader import write_wav
+
+
+class FailureStoreTest(TestCase):
+
+    def setUp(self):
+        self.dest_dir = tempfile.mkdtemp()
+        self.path = join(self.dest_dir, failure_store.FAILURES_FILENAME)
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_dir)
+
+    def test_classify_error(self):
+        cases = [
+            ('ERROR: Private video', None, ('private', True)),
+            ('ERROR: Video unavailable', None, ('unavailable', True)),
+            ('ERROR: This video has been removed by the user', None,
+             ('removed', True)),
+            ('HTTP Error 429: Too Many Requests', None,
+             ('rate_limited', False)),
+            ('timed out', None, ('transient', False)),
+            ('No audio file for vid0', True, ('not_found', True)),
+            ('Private video', False, ('private', False)),
+        ]
+        for message, permanent, expected in cases:
+            error = downloader.DownloadError(message, permanent=permanent)
+            self.assertEqual(failure_store.classify_error(error), expected)
+
+    def test_backs_off_exponentially(self):
+        error = downloader.DownloadError('timed out')
+        with failure_store.FailureStore(self.path, base_delay=10,
+                                        max_delay=35,
+                                        max_attempts=5) as failures:
+            delays = [failures.record_failure('vid0', error, now=100)
+                      for _ in range(5)]
+            self.assertEqual(delays, [10, 20, 35, 35, None])
+            record = failures.get('vid0')
+            self.assertEqual(record['attempts'], 5)
+            self.assertEqual(record['error_class'], 'transient')
+            self.assertEqual(record['permanent'], 1)
+            self.assertIsNone(failures.get('vid1'))
+
+    def test_blocked_and_retryable(self):
+        with failure_store.FailureStore(self.path,
+                                        base_delay=10) as failures:
+            failures.record_failure(
+                'private', downloader.DownloadError('Private video'), now=0)
+            failures.record_failure(
+                'flaky', downloader.DownloadError('timed out'), now=0)
+            self.assertEqual(failures.blocked(now=5), {'private', 'flaky'})
+            self.assertEqual(failures.retryable(now=5), set())
+            self.assertEqual(failures.blocked(now=15), {'private'})
+            self.assertEqual(failures.retryable(now=15), {'flaky'})
+            failures.record_success('flaky')
+            self.assertEqual(failures.retryable(now=15), set())
+
+    def test_concurrent_writers(self):
+        error = downloader.DownloadError('timed out')
+        stores = [failure_store.FailureStore(self.path) for _ in range(2)]
+
+        def record(store, start):
+            for i in range(start, 100, 2):
+                store.record_failure('vid{}'.format(i), error, now=0)
+                store.record_failure('shared', error, now=0)
+
+        threads = [threading.Thread(target=record, args=(store, i))
+                   for i, store in enumerate(stores)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(stores[0].blocked(now=0)), 101)
+        self.assertEqual(stores[1].get('shared')['attempts'], 100)
+        for store in stores:
+            store.close()
+
+    def test_imports_legacy_list(self):
+        legacy_path = join(self.dest_dir, failure_store.LEGACY_FILENAME)
+        with open(legacy_path, 'w') as file:
+            file.write('vid0\nvid1\n')
+        with failure_store.open_store(self.dest_dir) as failures:
+            self.assertEqual(failures.retryable(), {'vid0', 'vid1'})
+            self.assertEqual(failures.get('vid0')['error_class'], 'legacy')
+        self.assertFalse(isfile(legacy_path))
+        self.assertTrue(isfile(legacy_path + '.migrated'))
+
+
+class FlakyFetcher(downloader.LocalFileFetcher):
+    """Fails the first attempts at every video with a transient error."""
+
+    def __init__(self, src_dir, failures_per_video):
+        super().__init__(src_dir)
+        self.failures_per_video = failures_per_video
+        self.attempts = {}
+
+    def fetch(self, video_id, tmp_path):
+        attempts = self.attempts.get(video_id, 0) + 1
+        self.attempts[video_id] = attempts
+        if attempts <= self.failures_per_video:
+            raise downloader.DownloadError('HTTP Error 503')
+        super().fetch(video_id, tmp_path)
+
+
+class DownloadRetryTest(TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        self.dest_dir = tempfile.mkdtemp()
+        write_wav(join(self.src_dir, 'vid0.wav'), 2)
+        self.audio_dict = {}
+        for video_id in ['vid0', 'missing']:
+            entry = audioset_helper.AudioSetEntry(video_id, 0.0, 1.0, [])
+            self.audio_dict[entry.key] = entry
+        self.failures = failure_store.open_store(self.dest_dir,
+                                                 base_delay=0.01)
+
+    def tearDown(self):
+        self.failures.close()
+        shutil.rmtree(self.src_dir)
+        shutil.rmtree(self.dest_dir)
+
+    def test_retries_transient_and_skips_permanent_failures(self):
+        fetcher = FlakyFetcher(self.src_dir, failures_per_video=2)
+        downloader.download_from_list(self.dest_dir, self.audio_dict, False,
+                                      fetcher=fetcher,
+                                      failures=self.failures)
+        self.assertEqual(list(self.audio_dict), [('vid0', 0.0)])
+        self.assertEqual(fetcher.attempts, {'vid0': 3, 'missing': 3})
+        self.assertIsNone(self.failures.get('vid0'))
+        self.assertEqual(self.failures.get('missing')['error_class'],
+                         'not_found')
+        audio_dict = {entry.key: entry
+                      for entry in [audioset_helper.AudioSetEntry(
+                          'missing', 0.0, 1.0, [])]}
+        downloader.download_from_list(self.dest_dir, audio_dict, False,
+                                      fetcher=fetcher,
+                                      failures=self.failures)
+        self.assertEqual(audio_dict, {})
+        self.assertEqual(fetcher.attempts['missing'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+from os.path import join
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest import mock
+import numpy as np
+from ..dataprocessing import audio_processing as ap
+from ..dataprocessing import feature_cache
+from .test_downloader import write_wav
+
+PARAMS = {'sampling_rate': 22050, 'n_fft': 2048}
+
+
+class FeatureCacheTest(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_put_and_get(self):
+        cache = feature_cache.FeatureCache(self.cache_dir)
+        feature = np.arange(12, dtype=np.float32).reshape(3, 4)
+        self.assertIsNone(cache.get('abc', 'mfcc', PARAMS))
+        cache.put('abc', 'mfcc', PARAMS, feature)
+        np.testing.assert_array_equal(cache.get('abc', 'mfcc', PARAMS),
+                                      feature)
+        self.assertIsNone(cache.get('abc', 'rms', PARAMS))
+        self.assertIsNone(cache.get('abd', 'mfcc', PARAMS))
+        self.assertIsNone(cache.get('abc', 'mfcc', dict(PARAMS, n_fft=1024)))
+
+    def test_evicts_least_recently_used(self):
+        feature = np.zeros(1000, dtype=np.float64)
+        cache = feature_cache.FeatureCache(self.cache_dir, max_bytes=20000)
+        for i in range(2):
+            cache.put(str(i), 'mfcc', PARAMS, feature)
+        # Make clip 0 older than clip 1, then read it so it is most recent.
+        for i, mtime in enumerate([100, 200]):
+            path = cache._path(str(i), 'mfcc', PARAMS)
+            os.utime(path, (mtime, mtime))
+        self.assertIsNotNone(cache.get('0', 'mfcc', PARAMS))
+        cache.put('2', 'mfcc', PARAMS, feature)
+        self.assertIsNone(cache.get('1', 'mfcc', PARAMS))
+        self.assertIsNotNone(cache.get('0', 'mfcc', PARAMS))
+        self.assertIsNotNone(cache.get('2', 'mfcc', PARAMS))
+
+    def test_size_is_scanned_once_per_process(self):
+        feature = np.zeros(100, dtype=np.float64)
+        cache = feature_cache.FeatureCache(self.cache_dir)
+        scan_size = feature_cache.FeatureCache._scan_size
+        with mock.patch.object(feature_cache.FeatureCache, '_scan_size',
+                               autospec=True,
+                               side_effect=scan_size) as patched:
+            for i in range(10):
+                copy = pickle.loads(pickle.dumps(cache))
+                copy.put(str(i), 'mfcc', PARAMS, feature)
+            # Rewriting a feature replaces its size rather than adding to it.
+            copy.put('0', 'mfcc', PARAMS, feature)
+        self.assertEqual(patched.call_count, 1)
+        self.assertEqual(
+            feature_cache._sizes[os.path.abspath(self.cache_dir)],
+            cache._scan_size())
+
+    def test_failed_write_leaves_no_temporary_file(self):
+        cache = feature_cache.FeatureCache(self.cache_dir)
+        with mock.patch.object(feature_cache.np, 'save',
+                               side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                cache.put('abc', 'mfcc', PARAMS, np.zeros(3))
+        self.assertEqual([name for _, _, names in os.walk(self.cache_dir)
+                          for name in names], [])
+
+
+class CachedExtractionTest(TestCase):
+
+    def setUp(self):
+        self.dest_dir = tempfile.mkdtemp()
+        os.mkdir(join(self.dest_dir, 'yt_videos'))
+        write_wav(join(self.dest_dir, 'yt_videos', 'sliced_vid0.wav'), 1)
+        self.cache = feature_cache.FeatureCache(join(self.dest_dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_dir)
+
+    def test_only_missing_features_are_extracted(self):
+        first = ap.extract_features(self.dest_dir, 'vid0', ['mfcc'],
+                                    self.cache)
+        extract = ap.feature_extraction.extract_features
+        with mock.patch.object(ap.feature_extraction, 'extract_features',
+                               side_effect=extract) as patched:
+            second = ap.extract_features(self.dest_dir, 'vid0',
+                                         ['mfcc', 'rms'], self.cache)
+            patched.assert_called_once_with(mock.ANY, ['rms'], None, None)
+            ap.extract_features(self.dest_dir, 'vid0', ['rms', 'mfcc'],
+                                self.cache)
+            self.assertEqual(patched.call_count, 1)
+        np.testing.assert_array_equal(first['mfcc'], second['mfcc'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+from os.path import join
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from unittest import TestCase
+import librosa
+import numpy as np
+import soundfile
+from ..dataprocessing import feature_extraction
+from ..dataprocessing import pcm_store
+
+
+class FeatureExtractionTest(TestCase):
+
+    def setUp(self):
+        sampling_rate = 22050
+        time = np.arange(2 * sampling_rate) / sampling_rate
+        rng = np.random.RandomState(0)
+        self.audio = (0.5 * np.sin(2 * np.pi * 440 * time) +
+                      0.1 * rng.randn(len(time))).astype(np.float32)
+        self.sampling_rate = sampling_rate
+
+    def test_shared_intermediates_match_librosa(self):
+        clip = feature_extraction.ClipFeatures(self.audio, self.sampling_rate)
+        waveform_only = {'rms', 'spectral_flatness', 'zero_crossing_rate'}
+        for feature in feature_extraction.FEATURES:
+            librosa_function = getattr(librosa.feature, feature)
+            if feature in waveform_only:
+                expected = librosa_function(y=self.audio)
+            else:
+                expected = librosa_function(y=self.audio,
+                                            sr=self.sampling_rate)
+            np.testing.assert_allclose(clip.extract(feature), expected,
+                                       rtol=1e-3, atol=1e-4,
+                                       err_msg=feature)
+
+    def test_intermediates_computed_once(self):
+        clip = feature_extraction.ClipFeatures(self.audio, self.sampling_rate)
+        clip.extract('mfcc')
+        magnitude = clip.get('magnitude')
+        clip.extract('spectral_centroid')
+        clip.extract('chroma_stft')
+        self.assertIs(clip.get('magnitude'), magnitude)
+
+    def test_plan_includes_only_dependencies(self):
+        names = [extractor.name for extractor in
+                 feature_extraction.plan(['mfcc', 'tonnetz', 'rms'])]
+        self.assertEqual(names, ['magnitude', 'power', 'mel_power', 'mfcc',
+                                 'cqt', 'chroma_cqt', 'tonnetz', 'rms'])
+        clip = feature_extraction.ClipFeatures(self.audio, self.sampling_rate,
+                                               ['mfcc', 'spectral_centroid'])
+        clip.extract('mfcc')
+        self.assertIn('magnitude', clip._values)
+        self.assertNotIn('mel_power', clip._values)
+        clip.extract('spectral_centroid')
+        self.assertNotIn('magnitude', clip._values)
+
+    def test_custom_feature(self):
+
+        @feature_extraction.register_feature(
+            'spectral_flux', requires=('magnitude',), params={'order': 1})
+        def spectral_flux(magnitude, order):
+            return np.sum(np.diff(magnitude, n=order, axis=1) ** 2, axis=0)
+
+        self.addCleanup(feature_extraction.unregister, 'spectral_flux')
+        self.assertIn('spectral_flux',
+                      feature_extraction.registered_features())
+        clip = feature_extraction.ClipFeatures(self.audio, self.sampling_rate,
+                                               ['spectral_flux', 'mfcc'])
+        magnitude = np.abs(librosa.stft(self.audio))
+        np.testing.assert_allclose(
+            clip.extract('spectral_flux'),
+            np.sum(np.diff(magnitude, axis=1) ** 2, axis=0), rtol=1e-4)
+        params = feature_extraction.extraction_params(
+            feature='spectral_flux')
+        self.assertEqual(params['extractors']['spectral_flux'], {'order': 1})
+        self.assertNotIn('mel_power', params['extractors'])
+        with self.assertRaises(ValueError):
+            feature_extraction.register_feature('spectral_flux')
+        with self.assertRaises(ValueError):
+            feature_extraction.register_feature('x', requires=('unknown',))
+        with self.assertRaises(ValueError):
+            feature_extraction.unregister('magnitude')
+
+    def test_unsupported_feature(self):
+        with self.assertRaises(ValueError):
+            feature_extraction.check_features(['mfcc', 'loudness'])
+
+
+class BatchFeaturesTest(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.clips = [(0.1 * rng.randn(length)).astype(np.float32)
+                      for length in (22050, 30000, 15000)]
+        self.num_samples = 22050
+
+    def test_batch_matches_librosa_per_clip(self):
+        batch = feature_extraction.stack_clips(self.clips, self.num_samples)
+        self.assertEqual(batch.shape, (3, self.num_samples))
+        np.testing.assert_array_equal(batch[1], self.clips[1][:22050])
+        np.testing.assert_array_equal(batch[2, 15000:], 0)
+        features = feature_extraction.BatchFeatures(batch, 22050)
+        num_frames = feature_extraction.num_frames(1.0)
+        for feature in feature_extraction.BATCH_FEATURES:
+            extracted = features.extract(feature)
+            self.assertEqual(extracted.shape[::2], (3, num_frames))
+            self.assertEqual(extracted.dtype, np.float32)
+            librosa_function = getattr(librosa.feature, feature)
+            for i in range(3):
+                if feature == 'rms':
+                    expected = librosa_function(y=batch[i])
+                else:
+                    expected = librosa_function(y=batch[i], sr=22050)
+                np.testing.assert_allclose(extracted[i], expected, rtol=1e-3,
+                                           atol=1e-4, err_msg=feature)
+        with self.assertRaises(ValueError):
+            features.extract('tonnetz')
+
+    def test_extract_batch(self):
+        src_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, src_dir)
+        paths = []
+        for i, clip in enumerate(self.clips):
+            paths.append(join(src_dir, 'clip{}.wav'.format(i)))
+            soundfile.write(paths[-1], clip, 22050, subtype='FLOAT')
+        batch = feature_extraction.extract_batch(paths, ['mfcc', 'rms'],
+                                                 duration=1.0)
+        self.assertEqual(batch['mfcc'].shape, (3, 20, 44))
+        self.assertEqual(batch['rms'].shape, (3, 1, 44))
+        expected = librosa.feature.mfcc(y=self.clips[0], sr=22050)
+        np.testing.assert_allclose(batch['mfcc'][0], expected, rtol=1e-3,
+                                   atol=1e-3)
+        with self.assertRaises(ValueError):
+            feature_extraction.check_batch_features(['mfcc', 'chroma_cqt'])
+
+
+class ClipLoaderTest(TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        self.path = join(self.src_dir, 'sliced_vid0.wav')
+        time = np.arange(44100) / 44100
+        soundfile.write(self.path, 0.5 * np.sin(2 * np.pi * 440 * time),
+                        44100, subtype='PCM_16')
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+
+    def test_polyphase_matches_default_resampler(self):
+        loader = feature_extraction.ClipLoader(res_type='polyphase')
+        audio = loader.load(self.path)
+        expected, _ = librosa.load(self.path, sr=22050)
+        self.assertEqual(audio.shape, expected.shape)
+        np.testing.assert_allclose(audio[100:-100], expected[100:-100],
+                                   atol=1e-2)
+        self.assertEqual(
+            feature_extraction.extraction_params(loader)['res_type'],
+            'polyphase')
+        self.assertNotIn('res_type', feature_extraction.extraction_params())
+        with self.assertRaises(ValueError):
+            feature_extraction.ClipLoader(res_type='kaiser_best')
+
+    def test_decoded_clip_is_read_from_store(self):
+        store = pcm_store.PcmStore(join(self.src_dir, 'store'))
+        loader = feature_extraction.ClipLoader(sampling_rate=16000,
+                                               pcm_store=store)
+        first = feature_extraction.extract_features(self.path, ['rms'],
+                                                    loader=loader)
+        self.assertIsNotNone(store.get(self.path, 16000, 'soxr_hq'))
+        with mock.patch.object(feature_extraction.librosa, 'load',
+                                        side_effect=AssertionError):
+            second = feature_extraction.extract_features(self.path, ['rms'],
+                                                         loader=loader)
+        np.testing.assert_allclose(second['rms'], first['rms'], atol=1e-4)
+        self.assertEqual(
+            feature_extraction.extraction_params(loader)['pcm_dtype'],
+            'int16')
+
+
+if __name__ == '__main__':
+    unittest.main()
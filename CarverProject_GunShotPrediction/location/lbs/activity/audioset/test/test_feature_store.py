@@ -0,0 +1,90 @@
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+import numpy as np
+from ..dataprocessing import feature_store
+
+
+class FeatureStoreTest(TestCase):
+
+    def setUp(self):
+        self.store_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.examples = [
+            ('vid0', [1, rng.rand(20, 5), rng.rand(1, 5)]),
+            ('vid1', [0, rng.rand(20, 7), rng.rand(1, 7)]),
+            ('vid2', [0]),
+            ('vid3', [1, rng.rand(20, 5), rng.rand(1, 5)]),
+        ]
+        with feature_store.FeatureStoreWriter(
+                self.store_dir, ['mfcc', 'rms']) as writer:
+            for clip_id, example in self.examples:
+                writer.write(clip_id, example)
+
+    def tearDown(self):
+        shutil.rmtree(self.store_dir)
+
+    def test_read_examples(self):
+        store = feature_store.FeatureStore(self.store_dir)
+        self.assertEqual(len(store), 4)
+        self.assertEqual(list(store.clip_ids),
+                         ['vid0', 'vid1', 'vid2', 'vid3'])
+        self.assertEqual(list(store.labels), [1, 0, 0, 1])
+        for i, (_, example) in enumerate(self.examples):
+            for j, feature in enumerate(['mfcc', 'rms']):
+                if len(example) == 1:
+                    self.assertEqual(store.get(feature, i).size, 0)
+                    continue
+                expected = example[j + 1].astype(np.float32)
+                np.testing.assert_array_equal(store.get(feature, i), expected)
+        self.assertIsInstance(store.get('mfcc', 1).base, np.memmap)
+
+    def test_batch(self):
+        store = feature_store.FeatureStore(self.store_dir)
+        batch, labels = store.batch([3, 0], ['mfcc'], stack=True)
+        self.assertEqual(batch['mfcc'].shape, (2, 20, 5))
+        np.testing.assert_array_equal(labels, [1, 1])
+        np.testing.assert_array_equal(store.shapes('rms')[:, 1],
+                                      [5, 7, 0, 5])
+
+    def test_rejects_features_of_more_dimensions(self):
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        with feature_store.FeatureStoreWriter(store_dir, ['f']) as writer:
+            with self.assertRaises(ValueError):
+                writer.write('vid0', [1, np.ones((2, 3, 4))])
+            writer.write('vid1', [0, np.ones((2, 2))])
+        store = feature_store.FeatureStore(store_dir)
+        self.assertEqual(list(store.clip_ids), ['vid1'])
+        np.testing.assert_array_equal(store.get('f', 0), np.ones((2, 2)))
+
+    def test_merge_stores(self):
+        other_dir = tempfile.mkdtemp()
+        merged_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other_dir)
+        self.addCleanup(shutil.rmtree, merged_dir)
+        other_example = [0, np.ones((20, 3)), np.ones((1, 3))]
+        with feature_store.FeatureStoreWriter(
+                other_dir, ['mfcc', 'rms']) as writer:
+            writer.write('vid4', other_example)
+        num_examples = feature_store.merge_stores(
+            [self.store_dir, other_dir], merged_dir)
+        self.assertEqual(num_examples, 5)
+        store = feature_store.FeatureStore(merged_dir)
+        self.assertEqual(list(store.clip_ids),
+                         ['vid0', 'vid1', 'vid2', 'vid3', 'vid4'])
+        self.assertEqual(list(store.labels), [1, 0, 0, 1, 0])
+        np.testing.assert_array_equal(store.get('mfcc', 3),
+                                      self.examples[3][1][1].astype(
+                                          np.float32))
+        np.testing.assert_array_equal(store.get('rms', 4), np.ones((1, 3)))
+        with feature_store.FeatureStoreWriter(other_dir, ['mfcc']):
+            pass
+        with self.assertRaises(ValueError):
+            feature_store.merge_stores([self.store_dir, other_dir],
+                                       merged_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import os
+from os.path import isfile, join
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest import mock
+import numpy as np
+from ..dataprocessing import audio_processing as ap
+from ..dataprocessing import audioset_helper
+from ..dataprocessing import downloader
+from ..dataprocessing import ingest_manifest
+from .test_audio_processing import ONTOLOGY_PATH
+from .test_downloader import write_wav
+
+
+class IngestManifestTest(TestCase):
+
+    def setUp(self):
+        self.dest_dir = tempfile.mkdtemp()
+        self.path = join(self.dest_dir, ingest_manifest.MANIFEST_FILENAME)
+        self.entries = [audioset_helper.AudioSetEntry(video_id, 1.0, 2.0,
+                                                      ['/m/032s66'])
+                        for video_id in ['vid0', 'vid1', 'vid2']]
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_dir)
+
+    def test_states_persist_across_reopening(self):
+        with ingest_manifest.IngestManifest(self.path) as manifest:
+            manifest.add_segments(self.entries)
+            manifest.set_state(['vid0_1000'], ingest_manifest.CHOPPED,
+                               output='clip.wav')
+            manifest.set_state(['vid1_1000'], ingest_manifest.FAILED,
+                               error='download failed')
+        with ingest_manifest.IngestManifest(self.path) as manifest:
+            manifest.add_segments(self.entries)
+            self.assertEqual(manifest.states(), {
+                'vid0_1000': ingest_manifest.CHOPPED,
+                'vid1_1000': ingest_manifest.FAILED,
+                'vid2_1000': ingest_manifest.PENDING,
+            })
+            self.assertEqual(manifest.outputs(ingest_manifest.CHOPPED),
+                             {'vid0_1000': 'clip.wav'})
+            self.assertEqual(manifest.counts()[ingest_manifest.PENDING], 1)
+            with self.assertRaises(ValueError):
+                manifest.set_state(['vid2_1000'], 'done')
+
+    def test_reset_deletes_saved_features(self):
+        path = ingest_manifest.features_path(self.dest_dir, 'vid0_1000')
+        ingest_manifest.save_features(path, {'mfcc': np.ones((2, 3))})
+        with ingest_manifest.IngestManifest(self.path) as manifest:
+            manifest.add_segments(self.entries)
+            manifest.set_state(['vid0_1000'], ingest_manifest.EXTRACTED,
+                               output=path)
+            manifest.reset(['vid0_1000'])
+            self.assertEqual(manifest.clip_ids(ingest_manifest.PENDING),
+                             {'vid0_1000', 'vid1_1000', 'vid2_1000'})
+        self.assertFalse(isfile(path))
+
+    def test_load_features(self):
+        path = ingest_manifest.features_path(self.dest_dir, 'vid0_1000')
+        self.assertEqual(ingest_manifest.load_features(path, ['mfcc']), {})
+        ingest_manifest.save_features(path, {'mfcc': np.ones((2, 3))})
+        saved = ingest_manifest.load_features(path, ['mfcc', 'rms'])
+        self.assertEqual(list(saved), ['mfcc'])
+        np.testing.assert_array_equal(saved['mfcc'], np.ones((2, 3)))
+        with open(path, 'wb') as file:
+            file.write(b'truncated')
+        self.assertEqual(ingest_manifest.load_features(path, ['mfcc']), {})
+
+    def test_download_from_list_resumes(self):
+        src_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, src_dir)
+        for video_id in ['vid0', 'vid1']:
+            write_wav(join(src_dir, video_id + '.wav'), 3)
+        fetcher = downloader.LocalFileFetcher(src_dir)
+        audio_dict = {entry.key: entry for entry in self.entries}
+        with ingest_manifest.IngestManifest(self.path) as manifest:
+            manifest.add_segments(self.entries)
+            downloader.download_from_list(self.dest_dir, audio_dict, False,
+                                          fetcher=fetcher, manifest=manifest)
+            self.assertEqual(manifest.states(), {
+                'vid0_1000': ingest_manifest.CHOPPED,
+                'vid1_1000': ingest_manifest.CHOPPED,
+                'vid2_1000': ingest_manifest.FAILED,
+            })
+            self.assertEqual(
+                manifest.outputs(ingest_manifest.CHOPPED)['vid0_1000'],
+                downloader.clip_path(self.dest_dir, 'vid0_1000'))
+        with ingest_manifest.IngestManifest(self.path) as manifest:
+            audio_dict = {entry.key: entry for entry in self.entries}
+            fetcher = mock.Mock()
+            fetcher.fetch.side_effect = AssertionError
+            downloader.download_from_list(self.dest_dir, audio_dict, False,
+                                          fetcher=fetcher, manifest=manifest)
+            self.assertEqual(sorted(audio_dict),
+                             [('vid0', 1.0), ('vid1', 1.0)])
+
+
+class ResumeGenerateExamplesTest(TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        self.dest_dir = tempfile.mkdtemp()
+        shutil.copy(ONTOLOGY_PATH, self.src_dir)
+        with open(join(self.src_dir, 'segments.csv'), 'w') as csv_file:
+            csv_file.write('# YTID, start_seconds, end_seconds, '
+                           'positive_labels\n')
+            for i in range(3):
+                csv_file.write('vid{}, 0.000, 2.000, "/m/032s66"\n'.format(i))
+        yt_videos = join(self.dest_dir, 'yt_videos')
+        audioset_helper.check_dir(yt_videos)
+        for i in range(3):
+            write_wav(join(yt_videos, 'sliced_vid{}_0.wav'.format(i)), 2)
+        self.manifest_path = join(self.dest_dir,
+                                  ingest_manifest.MANIFEST_FILENAME)
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+        shutil.rmtree(self.dest_dir)
+
+    def generate(self, manifest):
+        return list(ap.generate_examples(
+            self.src_dir, self.dest_dir, 'segments', ['Gunshot, gunfire'],
+            ['mfcc'], manifest=manifest))
+
+    def test_resumes_without_extracting_again(self):
+        extract = ap.feature_extraction.extract_features
+        with mock.patch.object(ap.feature_extraction, 'extract_features',
+                               side_effect=extract) as patched:
+            with ingest_manifest.IngestManifest(self.manifest_path) as manifest:
+                examples = self.generate(manifest)
+            self.assertEqual(patched.call_count, 3)
+        # Roll vid2_0 back to how a run killed before extracting it left it.
+        os.remove(ingest_manifest.features_path(self.dest_dir, 'vid2_0'))
+        with ingest_manifest.IngestManifest(self.manifest_path) as manifest:
+            manifest.set_state(['vid2_0'], ingest_manifest.CHOPPED)
+            with mock.patch.object(ap.feature_extraction, 'extract_features',
+                                   side_effect=extract) as patched:
+                resumed = self.generate(manifest)
+            self.assertEqual(patched.call_count, 1)
+            self.assertEqual(manifest.clip_ids(ingest_manifest.EXTRACTED),
+                             {'vid0_0', 'vid1_0', 'vid2_0'})
+        self.assertEqual([clip_id for clip_id, _ in resumed],
+                         ['vid0_0', 'vid1_0', 'vid2_0'])
+        for (_, expected), (_, actual) in zip(examples, resumed):
+            self.assertEqual(actual[0], expected[0])
+            np.testing.assert_allclose(actual[1], expected[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
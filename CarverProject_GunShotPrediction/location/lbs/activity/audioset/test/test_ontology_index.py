@@ -0,0 +1,102 @@
+import json
+import os
+from os.path import join
+import pickle
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+from unittest import TestCase
+from ..dataprocessing import audioset_helper
+from ..dataprocessing import ontology_index
+
+ONTOLOGY = [
+    {'id': '/m/a', 'name': 'Explosion', 'description': '',
+     'child_ids': ['/m/b', '/m/d']},
+    {'id': '/m/b', 'name': 'Gunshot, gunfire', 'description': '',
+     'child_ids': ['/m/c']},
+    {'id': '/m/c', 'name': 'Machine gun', 'description': '',
+     'child_ids': ['/m/e']},
+    {'id': '/m/d', 'name': 'Burst, pop', 'description': '',
+     'child_ids': ['/m/e']},
+    {'id': '/m/e', 'name': 'Rapid fire', 'description': '', 'child_ids': []},
+    {'id': '/m/f', 'name': 'Snoring', 'description': '', 'child_ids': []},
+]
+
+
+class OntologyIndexTest(TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        self.write_ontology(ONTOLOGY)
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+
+    def write_ontology(self, ontology):
+        path = join(self.src_dir, 'ontology.json')
+        with open(path, 'w') as ontology_file:
+            json.dump(ontology, ontology_file)
+
+    def test_transitive_closure(self):
+        ontology = ontology_index.load_ontology_index(self.src_dir)
+        self.assertEqual(ontology.expand(['Gunshot, gunfire']),
+                         {'/m/b', '/m/c', '/m/e'})
+        self.assertEqual(ontology.expand(['Explosion']),
+                         {'/m/a', '/m/b', '/m/c', '/m/d', '/m/e'})
+        self.assertEqual(list(ontology.expand_indices(['/m/d', 'Snoring'])),
+                         [3, 4, 5])
+        with self.assertRaises(ValueError):
+            ontology.expand(['Laughter'])
+
+    def test_label_list_to_set_matches_index(self):
+        label_dict = audioset_helper.get_label_dict(self.src_dir)
+        ontology = ontology_index.load_ontology_index(self.src_dir)
+        for name in ['Explosion', 'Gunshot, gunfire', 'Snoring']:
+            self.assertEqual(
+                audioset_helper.label_list_to_set([name], label_dict),
+                ontology.expand([name]))
+
+    def test_index_is_persisted_and_refreshed(self):
+        ontology_index.load_ontology_index(self.src_dir)
+        index_path = join(self.src_dir, ontology_index.INDEX_FILENAME)
+        self.assertTrue(os.path.isfile(index_path))
+        with mock.patch.object(ontology_index, 'compile_ontology',
+                                        side_effect=AssertionError):
+            ontology = ontology_index.load_ontology_index(self.src_dir)
+        self.assertEqual(len(ontology), 6)
+        changed = ONTOLOGY + [{'id': '/m/g', 'name': 'Laughter',
+                               'description': '', 'child_ids': []}]
+        self.write_ontology(changed)
+        os.utime(join(self.src_dir, 'ontology.json'), ns=(0, 0))
+        ontology = ontology_index.load_ontology_index(self.src_dir)
+        self.assertEqual(ontology.expand(['Laughter']), {'/m/g'})
+
+    def test_failed_write_leaves_no_temporary_file(self):
+        with mock.patch.object(ontology_index.os, 'replace',
+                               side_effect=OSError('read-only')):
+            ontology = ontology_index.load_ontology_index(self.src_dir)
+        self.assertEqual(len(ontology), 6)
+        self.assertEqual(os.listdir(self.src_dir), ['ontology.json'])
+
+    def test_unimportable_index_is_recompiled(self):
+        ontology_index.load_ontology_index(self.src_dir)
+        index_path = join(self.src_dir, ontology_index.INDEX_FILENAME)
+        with open(index_path, 'rb') as index_file:
+            signature, arrays = pickle.load(index_file)
+        self.assertIsInstance(arrays, tuple)
+        # An index pickled with a class that cannot be imported anymore.
+        module = types.ModuleType('location')
+        stale = type('OntologyIndex', (), {'__module__': 'location'})
+        module.OntologyIndex = stale
+        with mock.patch.dict(sys.modules, {'location': module}):
+            with open(index_path, 'wb') as index_file:
+                pickle.dump((signature, stale()), index_file)
+        ontology = ontology_index.load_ontology_index(self.src_dir)
+        self.assertEqual(ontology.expand(['Machine gun']), {'/m/c', '/m/e'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+from os.path import join
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+import numpy as np
+import soundfile
+from ..dataprocessing import pcm_store
+
+
+class PcmStoreTest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.clip_path = join(self.tmp_dir, 'sliced_vid0.wav')
+        rng = np.random.RandomState(0)
+        self.audio = (0.5 * rng.uniform(-1, 1, 8000)).astype(np.float32)
+        soundfile.write(self.clip_path, self.audio, 8000, subtype='PCM_16')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_roundtrip(self):
+        for dtype, atol in (('int16', 1 / 32768), ('float16', 1e-3)):
+            store = pcm_store.PcmStore(join(self.tmp_dir, dtype), dtype)
+            self.assertIsNone(store.get(self.clip_path, 8000, 'polyphase'))
+            store.put(self.clip_path, 8000, 'polyphase', self.audio)
+            audio = store.get(self.clip_path, 8000, 'polyphase')
+            self.assertEqual(audio.dtype, np.float32)
+            np.testing.assert_allclose(audio, self.audio, atol=atol)
+            self.assertIsNone(store.get(self.clip_path, 8000, 'soxr_hq'))
+            self.assertIsNone(store.get(self.clip_path, 16000, 'polyphase'))
+
+    def test_clip_newer_than_store(self):
+        store = pcm_store.PcmStore(join(self.tmp_dir, 'store'))
+        store.put(self.clip_path, 8000, 'soxr_hq', self.audio)
+        stored_mtime = os.stat(store.path(self.clip_path, 8000,
+                                          'soxr_hq')).st_mtime_ns
+        os.utime(self.clip_path, ns=(stored_mtime + 10 ** 9,
+                                     stored_mtime + 10 ** 9))
+        self.assertIsNone(store.get(self.clip_path, 8000, 'soxr_hq'))
+
+    def test_unsupported_dtype(self):
+        with self.assertRaises(ValueError):
+            pcm_store.PcmStore(join(self.tmp_dir, 'store'), 'float32')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import threading
+import unittest
+from unittest import TestCase
+from ..dataprocessing import pipeline
+
+
+class RunStagesTest(TestCase):
+
+    def test_extracts_downloaded_and_ready_items(self):
+        groups = [('a', [1, -2]), ('failed', [3]), ('b', [-4])]
+
+        def download(key, items):
+            return [] if key == 'failed' else items
+
+        results = list(pipeline.run_stages(groups, download, abs,
+                                           ready_items=[-5, 6],
+                                           download_workers=2,
+                                           extract_workers=2, queue_size=1))
+        self.assertEqual(sorted(results),
+                         [(-5, 5), (-4, 4), (-2, 2), (1, 1), (6, 6)])
+
+    def test_extracts_while_downloading(self):
+        first_result = threading.Event()
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def download(key, items):
+            with lock:
+                running.append(key)
+                max_running.append(len(running))
+            if key == 'last':
+                # Only returns once an item of an earlier group is extracted.
+                items = [first_result.wait(timeout=10)]
+            with lock:
+                running.remove(key)
+            return items
+
+        groups = [(str(i), [i]) for i in range(6)] + [('last', None)]
+        results = []
+        for _, result in pipeline.run_stages(groups, download, abs,
+                                             download_workers=2):
+            first_result.set()
+            results.append(result)
+        self.assertIn(True, results)
+        self.assertLessEqual(max(max_running), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from unittest import TestCase
+import numpy as np
+from ..dataprocessing import pooling
+
+
+class PoolingTest(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.batch = rng.rand(3, 20, 431).astype(np.float32)
+
+    def test_pool_clip(self):
+        feature = self.batch[0]
+        statistics = ['mean', 'std', 'min', 'max', 'p10', 'p90',
+                      'delta_mean', 'delta_std']
+        vector = pooling.pool(feature, statistics)
+        self.assertEqual(vector.shape, (8 * 20,))
+        self.assertEqual(vector.dtype, np.float32)
+        delta = np.diff(feature, axis=1)
+        expected = np.concatenate([
+            feature.mean(axis=1), feature.std(axis=1), feature.min(axis=1),
+            feature.max(axis=1), np.percentile(feature, 10, axis=1),
+            np.percentile(feature, 90, axis=1), delta.mean(axis=1),
+            delta.std(axis=1)])
+        np.testing.assert_allclose(vector, expected, rtol=1e-5, atol=1e-6)
+
+    def test_pool_batch_matches_clips(self):
+        pooled = pooling.pool(self.batch, ['mean', 'p50', 'delta_mean'])
+        self.assertEqual(pooled.shape, (3, 60))
+        for i in range(3):
+            np.testing.assert_allclose(
+                pooled[i], pooling.pool(self.batch[i],
+                                        ['mean', 'p50', 'delta_mean']))
+
+    def test_short_and_empty_features(self):
+        np.testing.assert_array_equal(
+            pooling.pool(np.ones((2, 1)), ['mean', 'delta_mean']),
+            [1, 1, 0, 0])
+        self.assertEqual(pooling.pool(np.zeros((0, 0)), ['mean']).shape,
+                         (0,))
+
+    def test_unsupported_statistic(self):
+        self.assertTrue(pooling.is_supported(['p0', 'p100', 'max']))
+        for statistic in ['median', 'p101', 'p']:
+            with self.assertRaises(ValueError):
+                pooling.check_statistics(['mean', statistic])
+
+
+if __name__ == '__main__':
+    unittest.main()
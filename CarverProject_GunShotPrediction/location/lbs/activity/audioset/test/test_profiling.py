@@ -0,0 +1,89 @@
+import json
+from os.path import join
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+from ..dataprocessing import profiling
+
+
+class ProfilerTest(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.profiler = profiling.Profiler(per_clip=True)
+        for i in range(100):
+            self.profiler.record('decode', (i + 1) / 100, 'vid{}_0'.format(i))
+        self.profiler.record_all({'decode': 1.0, 'feature:mfcc': 0.5},
+                                 'vid0_0')
+        with self.profiler.timer('parse'):
+            pass
+        for _ in range(4):
+            self.profiler.count_clip()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_stage_summaries(self):
+        summaries = self.profiler.stage_summaries()
+        self.assertEqual(sorted(summaries), ['decode', 'feature:mfcc',
+                                             'parse'])
+        decode = summaries['decode']
+        self.assertEqual(decode['count'], 101)
+        self.assertAlmostEqual(decode['total_seconds'], 51.5)
+        self.assertAlmostEqual(decode['p50_seconds'], 0.51)
+        self.assertAlmostEqual(decode['max_seconds'], 1.0)
+        self.assertEqual(summaries['parse']['count'], 1)
+
+    def test_write_reports(self):
+        self.profiler.write_reports(self.output_dir)
+        with open(join(self.output_dir, profiling.JSON_FILENAME)) as file:
+            report = json.load(file)
+        self.assertEqual(report['clips'], 4)
+        self.assertGreater(report['clips_per_second'], 0)
+        self.assertEqual(report['per_clip']['vid0_0'],
+                         {'decode': 1.01, 'feature:mfcc': 0.5})
+        with open(join(self.output_dir,
+                       profiling.PROMETHEUS_FILENAME)) as file:
+            lines = file.read().splitlines()
+        self.assertIn('# TYPE audioset_ingest_stage_seconds summary', lines)
+        self.assertIn('audioset_ingest_stage_seconds_count{stage="decode"} '
+                      '101', lines)
+        self.assertIn('audioset_ingest_clips_total 4', lines)
+        self.assertTrue(any(line.startswith(
+            'audioset_ingest_stage_seconds{stage="decode",quantile="0.9"} ')
+            for line in lines))
+
+    def test_memory_is_bounded(self):
+        profiler = profiling.Profiler(reservoir_size=1000)
+        for i in range(100000):
+            profiler.record('decode', i / 100000)
+        self.assertEqual(len(profiler._latencies['decode'].samples), 1000)
+        summary = profiler.stage_summaries()['decode']
+        self.assertEqual(summary['count'], 100000)
+        self.assertAlmostEqual(summary['total_seconds'], 49999.5)
+        self.assertAlmostEqual(summary['max_seconds'], 0.99999)
+        self.assertAlmostEqual(summary['p50_seconds'], 0.5, delta=0.05)
+        self.assertAlmostEqual(summary['p90_seconds'], 0.9, delta=0.05)
+
+    def test_stage_shared_by_clips(self):
+        self.profiler.record('download', 2.0, ['vid0_0', 'vid0_30000'])
+        self.assertEqual(
+            self.profiler.stage_summaries()['download']['count'], 1)
+        per_clip = self.profiler.report()['per_clip']
+        self.assertEqual(per_clip['vid0_0']['download'], 2.0)
+        self.assertEqual(per_clip['vid0_30000'], {'download': 2.0})
+
+    def test_timers_without_profiler(self):
+        with profiling.timer(None, 'chop'):
+            pass
+        timings = {}
+        with profiling.stage_timer(timings, 'decode'):
+            pass
+        with profiling.stage_timer(None, 'decode'):
+            pass
+        self.assertEqual(list(timings), ['decode'])
+
+
+if __name__ == '__main__':
+    unittest.main()
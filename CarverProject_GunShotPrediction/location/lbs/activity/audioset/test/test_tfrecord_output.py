@@ -0,0 +1,92 @@
+import os
+from os.path import join
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+import numpy as np
+from ..dataprocessing import tfrecord_output
+
+
+class TFRecordOutputTest(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.examples = [
+            ('vid0_0', [1, rng.rand(20, 5), rng.rand(1, 5)]),
+            ('vid1_30000', [0, rng.rand(20, 7), rng.rand(1, 7)]),
+            ('vid2_0', [0]),
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    @unittest.skipIf(tfrecord_output.tf is None, 'tensorflow not installed')
+    def test_write_and_parse(self):
+        tf = tfrecord_output.tf
+        with tfrecord_output.TFRecordShardWriter(
+                self.output_dir, ['mfcc', 'rms'], max_shard_bytes=1000,
+                num_writers=2) as writer:
+            for clip_id, example in self.examples:
+                writer.write(clip_id, example)
+        manifest = tfrecord_output.read_manifest(self.output_dir)
+        self.assertEqual(manifest['num_examples'], 3)
+        self.assertEqual(manifest['num_coefficients'],
+                         {'mfcc': 20, 'rms': 1})
+        self.assertEqual(sum(shard['num_examples']
+                             for shard in manifest['shards']), 3)
+        self.assertGreater(len(manifest['shards']), 1)
+        dataset = tf.data.TFRecordDataset(
+            tfrecord_output.shard_paths(self.output_dir),
+            compression_type=manifest['compression_type'])
+        records = list(dataset.as_numpy_iterator())
+        context, sequence = tf.io.parse_single_sequence_example(
+            records[1],
+            context_features={
+                'video_id': tf.io.FixedLenFeature([], tf.string),
+                'start_time_seconds': tf.io.FixedLenFeature([], tf.float32),
+                'label': tf.io.FixedLenFeature([], tf.int64)},
+            sequence_features={
+                'mfcc': tf.io.FixedLenSequenceFeature([20], tf.float32)})
+        self.assertEqual(context['video_id'].numpy(), b'vid1')
+        self.assertEqual(context['start_time_seconds'].numpy(), 30.0)
+        self.assertEqual(context['label'].numpy(), 0)
+        np.testing.assert_allclose(sequence['mfcc'].numpy(),
+                                   self.examples[1][1][1].T, rtol=1e-6)
+
+    def test_merge_tfrecords(self):
+        input_dirs = []
+        for i, num_examples in enumerate([3, 2]):
+            input_dir = join(self.output_dir, 'input{}'.format(i))
+            os.makedirs(input_dir)
+            shards = []
+            for j in range(2):
+                shard = tfrecord_output.SHARD_PATTERN.format(j)
+                with open(join(input_dir, shard), 'w') as shard_file:
+                    shard_file.write('{}-{}'.format(i, j))
+                shards.append({'file': shard, 'num_examples': j + 1,
+                               'record_bytes': 10})
+            tfrecord_output.write_manifest(input_dir, {
+                'features': ['mfcc'], 'compression_type': 'GZIP',
+                'num_examples': num_examples, 'num_coefficients': {'mfcc': 20},
+                'shards': shards})
+            input_dirs.append(input_dir)
+        merged_dir = join(self.output_dir, 'merged')
+        self.assertEqual(
+            tfrecord_output.merge_tfrecords(input_dirs, merged_dir), 5)
+        paths = tfrecord_output.shard_paths(merged_dir)
+        self.assertEqual([os.path.basename(path) for path in paths],
+                         [tfrecord_output.SHARD_PATTERN.format(i)
+                          for i in range(4)])
+        with open(paths[2]) as shard_file:
+            self.assertEqual(shard_file.read(), '1-0')
+        tfrecord_output.write_manifest(input_dirs[1], {
+            'features': ['rms'], 'compression_type': 'GZIP',
+            'num_examples': 0, 'num_coefficients': {}, 'shards': []})
+        with self.assertRaises(ValueError):
+            tfrecord_output.merge_tfrecords(input_dirs, merged_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,11 @@
 # To use this script, please put balanced_train_segments.csv, eval_segments.csv,
 # unbalanced_train_segments.csv, and ontology.json into ReferDoc folder.
 # Usage: python3 audio_prep.py Snoring
+# Several labels can be downloaded at once, each into its own folder:
+# python3 audio_prep.py Snoring "Breathing" "Cough"
+# Their ids are looked up once, and each csv file is read a single time for
+# all of them. A segment belongs to a label only if the label's id is exactly
+# one of the segment's ids, not merely a prefix of one.
 
 
 from __future__ import unicode_literals
@@ -19,17 +24,74 @@ from os.path import isfile, join
 import sys
 
 referDoc = "ReferDoc/"
+splits = [
+	('eval_segments.csv', 'audio_eval'),
+	('balanced_train_segments.csv', 'audio_balanced_train'),
+	('unbalanced_train_segments.csv', 'audio_unbalanced_train'),
+]
+_labelIds = None
+
+def loadLabelIds():
+	# Reads ontology.json once, and keeps the id of every label name
+	# input: None
+	# output: dict {str label: str label_encode}
+	global _labelIds
+	if _labelIds is None:
+		with open(referDoc+"ontology.json") as f:
+			labelInfo = json.load(f)
+		_labelIds = {}
+		for info in labelInfo:
+			# The first entry of a name wins, as in a linear search.
+			_labelIds.setdefault(info["name"], info["id"])
+	return _labelIds
 
 def labelIdSearch(label):
 	# Reads in the label, and finds the corresponding id in ontology.json
 	# input: str label
 	# output: str label_encode
-	with open(referDoc+"ontology.json") as f:
-		labelInfo = json.load(f)
-	for info in labelInfo:
-		if info["name"] == label:
-			return info["id"]
-	return None
+	return loadLabelIds().get(label)
+
+def labelIdsSearch(labels):
+	# Compiles several labels to their exact ids
+	# input: list of str labels
+	# output: dict {str label: str label_encode}
+	labelIds = {}
+	for label in labels:
+		labelId = labelIdSearch(label)
+		if labelId == None:
+			raise ValueError('Unknown label: '+label)
+		labelIds[label] = labelId
+	return labelIds
+
+def readSegments(csvFile):
+	# Streams the segments of an AudioSet csv file, skipping comment lines
+	# input: str csvFile
+	# output: generator of (str url, float startTime, float endTime,
+	#         set of str label_encode)
+	with open(csvFile, newline='') as csvfile:
+		for row in csv.reader(csvfile, skipinitialspace=True):
+			if not row or row[0].startswith('#'):
+				continue
+			url, startTime, endTime, ids = row[0], row[1], row[2], row[3]
+			yield url, float(startTime), float(endTime), set(ids.split(','))
+
+def buildWorkLists(labelIds, csvFiles):
+	# Reads every csv file once, and lists the segments of each label in each
+	# input: dict {str label: str label_encode}, list of str csvFile
+	# output: dict {str label: dict {str csvFile: list of
+	#         [str url, float startTime, float endTime]}}
+	labelsById = {}
+	for label, labelId in labelIds.items():
+		labelsById.setdefault(labelId, []).append(label)
+	idSet = set(labelsById)
+	workLists = {label: {csvFile: [] for csvFile in csvFiles}
+		for label in labelIds}
+	for csvFile in csvFiles:
+		for url, startTime, endTime, ids in readSegments(csvFile):
+			for labelId in ids & idSet:
+				for label in labelsById[labelId]:
+					workLists[label][csvFile].append([url, startTime, endTime])
+	return workLists
 
 def chopAudio(url, destDir, startTime, endTime):
 	# Chop the whole audio, 
@@ -54,22 +116,19 @@ def download(labelId, csvFile, destDir):
 	# Download all labeled audios from given AudioSet csv list to a dest folder
 	# input: str labelId, str csvFile, str destDir
 	# output: None
+	audio_list = buildWorkLists({labelId: labelId}, [csvFile])[labelId][csvFile]
+	downloadList(audio_list, destDir)
+
+
+def downloadList(audio_list, destDir):
+	# Download the audios of a work list to a dest folder
+	# input: list of [str url, float startTime, float endTime], str destDir
+	# output: None
 	try:
-		os.mkdir(destDir)
+		os.makedirs(destDir)
 	except OSError as error:
 		print(error)
 
-	# Extract all labeled audio info from csv
-	audio_list = []
-	with open(csvFile, newline='') as csvfile:
-		info = csv.reader(csvfile, delimiter=' ', quotechar='|')
-		for row in info:
-			r = ','.join(row)
-			if labelId in r:
-				r_lst = r.split(',')
-				url, startTime, endTime = r_lst[0], float(r_lst[2]), float(r_lst[4])
-				audio_list.append([url, startTime, endTime])
-
 	# Download audio into destDir/tmp/ directory
 	# Camera recorded audios would be downloaded in .m4a format
 	# Phone recorded audios would be downloaded in .opus format
@@ -98,8 +157,12 @@ def download(labelId, csvFile, destDir):
 
 
 if __name__ == "__main__":
-	labelId = labelIdSearch(sys.argv[1])
-	if labelId == None: raise TypeError
-	download(labelId, referDoc+'eval_segments.csv', 'audio_eval')
-	download(labelId, referDoc+'balanced_train_segments.csv', 'audio_balanced_train')
-	download(labelId, referDoc+'unbalanced_train_segments.csv', 'audio_unbalanced_train')
+	labels = sys.argv[1:]
+	labelIds = labelIdsSearch(labels)
+	csvFiles = [referDoc+csvName for csvName, _ in splits]
+	workLists = buildWorkLists(labelIds, csvFiles)
+	for label in labels:
+		for csvName, splitDir in splits:
+			# A single label keeps the folders of earlier versions.
+			destDir = splitDir if len(labels) == 1 else join(label, splitDir)
+			downloadList(workLists[label][referDoc+csvName], destDir)